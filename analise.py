@@ -0,0 +1,244 @@
+import threading
+from array import array
+from datetime import date
+
+_NUMPY = []  # [módulo numpy ou None], preenchido na primeira análise
+
+
+# NumPy só é importado quando uma análise é calculada (não pesa na abertura do programa);
+# sem NumPy as somas são feitas direto sobre os arrays da biblioteca padrão
+def _np():
+    if not _NUMPY:
+        try:
+            import numpy
+        except ImportError:
+            numpy = None
+        _NUMPY.append(numpy)
+    return _NUMPY[0]
+
+
+# ----------------- Análise de vendas -----------------
+# julianday(data) - JULIANO_ORDINAL = date.toordinal() do dia (a parte inteira)
+JULIANO_ORDINAL = 1721424.5
+
+
+def _ordinal(texto):
+    return date.fromisoformat(str(texto)[:10]).toordinal()
+
+
+def _dia(ordinal):
+    return date.fromordinal(ordinal).isoformat()
+
+
+class AnaliseVendas:
+    # análises sobre o histórico de itens vendidos, sem interface. Os itens ficam em memória em
+    # colunas (array de inteiros: produto, dia, quantidade, receita em centavos), lidos em blocos
+    # de fetchmany; a cada consulta só entram as vendas com id acima da última já lida. As somas
+    # por produto/dia são vetorizadas com NumPy quando instalado. Os resultados ficam guardados
+    # até chegar uma venda ou movimentação nova (chave: id da última venda/movimentação)
+    COLUNAS = ("produto_id", "dia", "quantidade", "receita_centavos")
+    CLASSES_ABC = (("A", 0.80), ("B", 0.95), ("C", 1.0))
+
+    def __init__(self, estoque, tamanho_bloco=50000):
+        self.estoque = estoque
+        self.tamanho_bloco = tamanho_bloco
+        self._lock = threading.Lock()
+        self._colunas = {c: array("q") for c in self.COLUNAS}
+        self._vetores = None  # colunas como arrays NumPy, refeitos quando entram vendas
+        self._resultados = {}
+        self.ultima_venda = 0
+        self.ultimo_movimento = 0
+
+    # ---- carga incremental ----
+    def _atualizar(self):
+        cur = self.estoque.conn.cursor()
+        ultima = cur.execute("SELECT COALESCE(MAX(id), 0) FROM vendas").fetchone()[0]
+        # velocidade e giro usam o estoque atual: entrada/ajuste sem venda também invalida os resultados
+        movimento = cur.execute("SELECT COALESCE(MAX(id), 0) FROM movimentacoes").fetchone()[0]
+        if movimento != self.ultimo_movimento:
+            self.ultimo_movimento = movimento
+            self._resultados.clear()
+        if ultima == self.ultima_venda:
+            return
+        if ultima < self.ultima_venda:  # banco restaurado/trocado: relê tudo
+            self._colunas = {c: array("q") for c in self.COLUNAS}
+            self.ultima_venda = 0
+        cur.execute(f"""
+            SELECT vi.produto_id, CAST(julianday(v.data) - {JULIANO_ORDINAL} AS INTEGER), vi.quantidade,
+                   vi.preco_unit_centavos * vi.quantidade - COALESCE(vi.desconto_item_centavos, 0)
+            FROM vendas v JOIN venda_itens vi ON vi.venda_id = v.id
+            WHERE v.id > ? AND v.id <= ? AND vi.produto_id IS NOT NULL
+        """, (self.ultima_venda, ultima))
+        colunas = [self._colunas[c] for c in self.COLUNAS]
+        while True:
+            linhas = cur.fetchmany(self.tamanho_bloco)
+            if not linhas:
+                break
+            for coluna, valores in zip(colunas, zip(*linhas)):
+                coluna.extend(valores)
+        self.ultima_venda = ultima
+        self._vetores = None
+        self._resultados.clear()
+
+    # devolve o resultado guardado para a chave ou o calcula (depois de trazer as vendas novas)
+    def _calcular(self, chave, calcular):
+        with self._lock:
+            self._atualizar()
+            if chave not in self._resultados:
+                self._resultados[chave] = calcular()
+            return self._resultados[chave]
+
+    def _periodo(self, data_inicio, data_fim, dias):
+        fim = _ordinal(data_fim) if data_fim else date.today().toordinal()
+        inicio = _ordinal(data_inicio) if data_inicio else fim - dias + 1
+        if inicio > fim:
+            raise ValueError("Período inválido: início depois do fim")
+        return inicio, fim
+
+    # ---- somas por produto e por dia ----
+    def _vetor(self):
+        np = _np()
+        if self._vetores is None:
+            self._vetores = {c: np.array(v, dtype=np.int64) for c, v in self._colunas.items()}
+        return self._vetores
+
+    # {produto_id: (quantidade, receita_centavos)} dos itens vendidos entre os dias inicio e fim
+    def _por_produto(self, inicio, fim):
+        np = _np()
+        if np is not None:
+            v = self._vetor()
+            filtro = (v["dia"] >= inicio) & (v["dia"] <= fim)
+            ids, posicao = np.unique(v["produto_id"][filtro], return_inverse=True)
+            quantidades = np.bincount(posicao, weights=v["quantidade"][filtro], minlength=len(ids))
+            receitas = np.bincount(posicao, weights=v["receita_centavos"][filtro], minlength=len(ids))
+            return dict(zip(ids.tolist(), zip(np.rint(quantidades).astype(np.int64).tolist(),
+                                               np.rint(receitas).astype(np.int64).tolist())))
+        somas = {}
+        c = self._colunas
+        for pid, dia, qtd, receita in zip(c["produto_id"], c["dia"], c["quantidade"], c["receita_centavos"]):
+            if inicio <= dia <= fim:
+                q, r = somas.get(pid, (0, 0))
+                somas[pid] = (q + qtd, r + receita)
+        return somas
+
+    # (quantidades, receitas) por dia, listas com um valor para cada dia de inicio a fim
+    def _por_dia(self, inicio, fim):
+        dias = fim - inicio + 1
+        np = _np()
+        if np is not None:
+            v = self._vetor()
+            filtro = (v["dia"] >= inicio) & (v["dia"] <= fim)
+            posicao = v["dia"][filtro] - inicio
+            quantidades = np.bincount(posicao, weights=v["quantidade"][filtro], minlength=dias)
+            receitas = np.bincount(posicao, weights=v["receita_centavos"][filtro], minlength=dias)
+            return (np.rint(quantidades).astype(np.int64).tolist(), np.rint(receitas).astype(np.int64).tolist())
+        quantidades, receitas = [0] * dias, [0] * dias
+        c = self._colunas
+        for dia, qtd, receita in zip(c["dia"], c["quantidade"], c["receita_centavos"]):
+            if inicio <= dia <= fim:
+                quantidades[dia - inicio] += qtd
+                receitas[dia - inicio] += receita
+        return quantidades, receitas
+
+    def _nomes(self, ids):
+        return {p["id"]: p for p in self.estoque.obter_produtos(ids)}
+
+    # ---- análises ----
+    # curva ABC pela receita do período: A até 80% da receita acumulada, B até 95%, C o resto.
+    # O produto que cruza o limite ainda fica na classe de cima
+    def curva_abc(self, data_inicio=None, data_fim=None, dias=90):
+        inicio, fim = self._periodo(data_inicio, data_fim, dias)
+
+        def calcular():
+            somas = sorted(self._por_produto(inicio, fim).items(), key=lambda item: (-item[1][1], item[0]))
+            total = sum(receita for _, (_, receita) in somas) or 1
+            produtos = self._nomes([pid for pid, _ in somas])
+            linhas, acumulado = [], 0
+            for pid, (quantidade, receita) in somas:
+                anterior = acumulado / total
+                acumulado += receita
+                classe = next(c for c, limite in self.CLASSES_ABC if anterior < limite or limite == 1.0)
+                linhas.append({"produto_id": pid, "nome": produtos.get(pid, {}).get("nome"), "quantidade": quantidade,
+                               "receita_centavos": receita, "participacao": receita / total,
+                               "acumulado": acumulado / total, "classe": classe})
+            return linhas
+        return self._calcular(("abc", inicio, fim), calcular)
+
+    # unidades vendidas por dia no período (padrão: últimos 30 dias) e quantos dias o estoque cobre
+    # nesse ritmo (estoque lido quando o resultado é calculado)
+    def velocidade(self, data_inicio=None, data_fim=None, dias=30):
+        inicio, fim = self._periodo(data_inicio, data_fim, dias)
+
+        def calcular():
+            somas = self._por_produto(inicio, fim)
+            produtos = self._nomes(list(somas))
+            linhas = []
+            for pid, (quantidade, receita) in somas.items():
+                por_dia = quantidade / (fim - inicio + 1)
+                estoque = produtos.get(pid, {}).get("quantidade")
+                linhas.append({"produto_id": pid, "nome": produtos.get(pid, {}).get("nome"), "vendidos": quantidade,
+                               "por_dia": por_dia, "estoque": estoque,
+                               "cobertura_dias": estoque / por_dia if estoque is not None and por_dia else None})
+            linhas.sort(key=lambda l: (-l["por_dia"], l["produto_id"]))
+            return linhas
+        return self._calcular(("velocidade", inicio, fim), calcular)
+
+    # receita e quantidade por dia (dias sem venda entram com zero) e médias móveis da receita;
+    # a série começa antes do período para a primeira média já ter a janela completa
+    def medias_moveis(self, data_inicio=None, data_fim=None, janelas=(7, 30), dias=90):
+        inicio, fim = self._periodo(data_inicio, data_fim, dias)
+        janelas = tuple(int(j) for j in janelas)
+
+        def calcular():
+            recuo = max(janelas) - 1
+            quantidades, receitas = self._por_dia(inicio - recuo, fim)
+            np = _np()
+            if np is not None:
+                acumulada = np.concatenate(([0], np.cumsum(np.array(receitas, dtype=np.int64))))
+                medias = {j: ((acumulada[j:] - acumulada[:-j]) / j)[recuo - j + 1:].tolist() for j in janelas}
+            else:
+                acumulada = [0]
+                for receita in receitas:
+                    acumulada.append(acumulada[-1] + receita)
+                medias = {j: [(acumulada[i + 1] - acumulada[i + 1 - j]) / j for i in range(recuo, len(receitas))]
+                          for j in janelas}
+            return [dict({"dia": _dia(inicio + i), "quantidade": quantidades[recuo + i],
+                          "receita_centavos": receitas[recuo + i]},
+                         **{f"media_{j}d_centavos": round(medias[j][i]) for j in janelas})
+                    for i in range(fim - inicio + 1)]
+        return self._calcular(("medias", inicio, fim, janelas), calcular)
+
+    # estoque_em, ou None quando a data é anterior ao primeiro retrato (estoque desconhecido)
+    def _estoque_em(self, ordinal):
+        try:
+            return self.estoque.estoque_em(_dia(ordinal))
+        except ValueError:
+            return None
+
+    # giro no período: unidades vendidas / estoque médio (média do estoque no início e no fim,
+    # tirados de estoque_em); dias_por_giro é quanto tempo o estoque médio leva para ser vendido.
+    # Sem retrato que cubra o início (ou o fim), estoque e giro ficam None em vez de partir de zero
+    def giro(self, data_inicio=None, data_fim=None, dias=90):
+        inicio, fim = self._periodo(data_inicio, data_fim, dias)
+
+        def calcular():
+            somas = self._por_produto(inicio, fim)
+            estoque_inicial = self._estoque_em(inicio - 1)
+            if fim >= date.today().toordinal():
+                estoque_final = {p["id"]: p["quantidade"] for p in self.estoque.obter_produtos(list(somas))}
+            else:
+                estoque_final = self._estoque_em(fim)
+            produtos = self._nomes(list(somas))
+            periodo = fim - inicio + 1
+            linhas = []
+            for pid, (quantidade, receita) in somas.items():
+                no_inicio = None if estoque_inicial is None else estoque_inicial.get(pid, 0)
+                no_fim = None if estoque_final is None else estoque_final.get(pid, 0)
+                medio = None if no_inicio is None or no_fim is None else (max(0, no_inicio) + max(0, no_fim)) / 2
+                giro = quantidade / medio if medio else None
+                linhas.append({"produto_id": pid, "nome": produtos.get(pid, {}).get("nome"), "vendidos": quantidade,
+                               "estoque_inicial": no_inicio, "estoque_final": no_fim,
+                               "estoque_medio": medio, "giro": giro, "dias_por_giro": periodo / giro if giro else None})
+            linhas.sort(key=lambda l: (l["giro"] is None, -(l["giro"] or 0), l["produto_id"]))
+            return linhas
+        return self._calcular(("giro", inicio, fim), calcular)
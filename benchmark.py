@@ -0,0 +1,303 @@
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from main import GerenciadorEstoque
+
+CATEGORIAS = ["Eletrônicos", "Vestuário", "Móveis", "Alimentos", "Papelaria", "Ferramentas"]
+FORNECEDORES = ["TechSupplier Ltda", "FashionWear", "MobileTech", "OfficePlus", "SoundStore", "Distribuidora Sul"]
+
+
+# ----------------- Gerador de dados sintéticos -----------------
+# mesma semente e mesma data final geram sempre o mesmo banco
+def gerar_banco(db_path, produtos=10000, vendas=100000, itens_por_venda=3, movimentacoes=1000000, dias=365,
+                semente=42, fim="2025-12-31"):
+    rnd = random.Random(semente)
+    estoque = GerenciadorEstoque(db_path)
+    estoque.fechar()
+
+    conn = sqlite3.connect(db_path)
+    conn.execute("PRAGMA synchronous=OFF")
+    inicio = datetime.strptime(fim, "%Y-%m-%d") + timedelta(days=1) - timedelta(days=dias)
+    segundos = dias * 24 * 3600
+
+    def data_aleatoria():
+        return (inicio + timedelta(seconds=rnd.randrange(segundos))).strftime("%Y-%m-%d %H:%M:%S")
+
+    conn.executemany("""
+        INSERT INTO produtos (nome, categoria, quantidade, preco_centavos, descricao, fornecedor, estoque_minimo)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    """, ((f"Produto {i:06d}", rnd.choice(CATEGORIAS), rnd.randint(0, 500), round(rnd.uniform(1, 5000) * 100),
+           f"Descrição do produto {i}", rnd.choice(FORNECEDORES), rnd.randint(1, 20)) for i in range(produtos)))
+    ids = [r[0] for r in conn.execute("SELECT id FROM produtos")]
+    precos = dict(conn.execute("SELECT id, preco_centavos FROM produtos"))
+
+    itens = []
+    for venda_id in range(1, vendas + 1):
+        total = 0
+        for _ in range(itens_por_venda):
+            pid = rnd.choice(ids)
+            qtd = rnd.randint(1, 5)
+            itens.append((venda_id, pid, qtd, precos[pid], 0))
+            total += precos[pid] * qtd
+        conn.execute("INSERT INTO vendas (id, data, total_centavos, desconto_centavos) VALUES (?, ?, ?, 0)", (venda_id, data_aleatoria(), total))
+    conn.executemany("""
+        INSERT INTO venda_itens (venda_id, produto_id, quantidade, preco_unit_centavos, desconto_item_centavos)
+        VALUES (?, ?, ?, ?, ?)
+    """, itens)
+
+    # movimentações: as de venda primeiro, o restante como entradas/saídas manuais
+    movs = [(pid, 'sale', qtd, f'Venda #{vid}') for vid, pid, qtd, _, _ in itens[:movimentacoes]]
+    conn.executemany("""
+        INSERT INTO movimentacoes (produto_id, tipo, quantidade, descricao, data)
+        VALUES (?, ?, ?, ?, ?)
+    """, ((pid, tipo, qtd, desc, data_aleatoria()) for pid, tipo, qtd, desc in movs))
+    restantes = max(0, movimentacoes - len(movs))
+    conn.executemany("""
+        INSERT INTO movimentacoes (produto_id, tipo, quantidade, descricao, data)
+        VALUES (?, ?, ?, ?, ?)
+    """, ((rnd.choice(ids), t, rnd.randint(1, 50), 'Movimentação gerada', data_aleatoria())
+          for t in (rnd.choice(("add", "remove")) for _ in range(restantes))))
+    conn.commit()
+    conn.close()
+
+
+# ----------------- Medição -----------------
+def percentil(valores, p):
+    ordenados = sorted(valores)
+    indice = min(len(ordenados) - 1, max(0, int(round(p / 100 * len(ordenados) + 0.5)) - 1))
+    return ordenados[indice]
+
+
+# conta os statements (e commits) executados pela conexão da thread atual
+class ContadorConsultas:
+    def __init__(self, conn):
+        self.statements = 0
+        self.commits = 0
+        conn.set_trace_callback(self._trace)
+
+    def _trace(self, sql):
+        if sql.startswith("--"):  # corpo de trigger
+            return
+        self.statements += 1
+        if sql.lstrip().upper().startswith("COMMIT"):
+            self.commits += 1
+
+
+def medir_operacao(nome, func, contador, repeticoes, preparar=None):
+    tempos, statements, commits = [], [], []
+    for i in range(repeticoes):
+        if preparar:
+            preparar()
+        s0, c0 = contador.statements, contador.commits
+        t0 = time.perf_counter()
+        func(i)
+        tempos.append((time.perf_counter() - t0) * 1000)
+        statements.append(contador.statements - s0)
+        commits.append(contador.commits - c0)
+    return {
+        "operacao": nome,
+        "repeticoes": repeticoes,
+        "media_ms": statistics.fmean(tempos),
+        "p50_ms": percentil(tempos, 50),
+        "p90_ms": percentil(tempos, 90),
+        "p99_ms": percentil(tempos, 99),
+        "max_ms": max(tempos),
+        "consultas_por_op": statistics.fmean(statements),
+        "commits_por_op": statistics.fmean(commits),
+    }
+
+
+# operações principais do GerenciadorEstoque, sobre uma cópia do banco gerado
+def benchmark_suite(db_path, repeticoes, itens_por_venda, semente=7):
+    copia = os.path.join(tempfile.mkdtemp(), "suite.db")
+    shutil.copyfile(db_path, copia)
+    estoque = GerenciadorEstoque(copia)
+    rnd = random.Random(semente)
+    cur = estoque.conn.cursor()
+    ids = [r[0] for r in cur.execute("SELECT id FROM produtos")]
+    cur.execute("UPDATE produtos SET quantidade = 1000000")  # vendas do benchmark nunca faltam estoque
+    estoque.conn.commit()
+    estoque.cache.limpar()
+    ultima = cur.execute("SELECT MAX(data) FROM vendas").fetchone()[0] or "2000-01-01"
+    ultimo_dia = ultima[:10]
+    mes = (datetime.strptime(ultimo_dia, "%Y-%m-%d") - timedelta(days=30)).strftime("%Y-%m-%d")
+    contador = ContadorConsultas(estoque.conn)
+
+    def venda(_):
+        estoque.registrar_venda([{"produto_id": rnd.choice(ids), "quantidade": 1} for _ in range(itens_por_venda)])
+
+    operacoes = [
+        ("registrar_venda", venda, None),
+        ("listar_produtos (frio)", lambda _: estoque.listar_produtos(), estoque.cache.limpar),
+        ("listar_produtos (cache)", lambda _: estoque.listar_produtos(), None),
+        ("obter_produto (frio)", lambda _: estoque.obter_produto(rnd.choice(ids)), estoque.cache.limpar),
+        ("relatorio_vendas (página)", lambda _: list(estoque.relatorio_vendas(limite=200)), None),
+        ("relatorio_vendas (último dia)", lambda _: list(estoque.relatorio_vendas(ultimo_dia, ultimo_dia)), None),
+        ("historico_movimentacoes (página)", lambda _: estoque.historico_movimentacoes(limite=500), None),
+        ("historico_movimentacoes (produto)",
+         lambda _: estoque.historico_movimentacoes(produto_id=rnd.choice(ids), limite=500), None),
+        ("vendas_por_dia (período todo)", lambda _: estoque.vendas_por_dia(), None),
+        ("vendas_por_produto (30 dias)", lambda _: estoque.vendas_por_produto(mes, ultimo_dia, limite=50), None),
+        ("exportar movimentacoes (csv.gz)",
+         lambda _: estoque.exportar_tabela("movimentacoes", os.path.join(os.path.dirname(copia), "mov.csv.gz")), None),
+        ("exportar movimentacoes (colunar)",
+         lambda _: estoque.exportar_tabela("movimentacoes", os.path.join(os.path.dirname(copia), "mov.col")), None),
+    ]
+    resultados = [medir_operacao(nome, func, contador, repeticoes, preparar) for nome, func, preparar in operacoes]
+    estoque.conn.set_trace_callback(None)
+    estoque.fechar()
+    shutil.rmtree(os.path.dirname(copia), ignore_errors=True)
+    return resultados
+
+
+def medir(func, repeticoes=5):
+    tempos = []
+    for _ in range(repeticoes):
+        t0 = time.perf_counter()
+        func()
+        tempos.append((time.perf_counter() - t0) * 1000)
+    return statistics.median(tempos)
+
+
+def consultas_relatorio(estoque, semente=7):
+    rnd = random.Random(semente)
+    cur = estoque.conn.cursor()
+    max_venda = cur.execute("SELECT MAX(id) FROM vendas").fetchone()[0] or 1
+    max_prod = cur.execute("SELECT MAX(id) FROM produtos").fetchone()[0] or 1
+    ultima = cur.execute("SELECT MAX(data) FROM vendas").fetchone()[0] or "2000-01-01"
+    semana = (datetime.strptime(ultima[:10], "%Y-%m-%d") - timedelta(days=7)).strftime("%Y-%m-%d")
+    return {
+        "listar_produtos": lambda: estoque.listar_produtos(),
+        "relatorio_vendas (1 página)": lambda: list(estoque.relatorio_vendas(limite=200)),
+        "relatorio_vendas (última semana)": lambda: list(estoque.relatorio_vendas(data_inicio=semana)),
+        "itens_venda": lambda: [estoque.itens_venda(rnd.randint(1, max_venda)) for _ in range(100)],
+        "movimentações por produto": lambda: [cur.execute(
+            "SELECT * FROM movimentacoes WHERE produto_id=? ORDER BY data DESC", (rnd.randint(1, max_prod),)).fetchall()
+            for _ in range(100)],
+        "historico_movimentacoes": lambda: estoque.historico_movimentacoes(),
+    }
+
+
+# compara as consultas dos relatórios sem e com os índices das migrações. Os índices são
+# recriados pelo próprio SQL guardado em sqlite_master: reaplicar as migrações antigas não dá,
+# porque a dos resumos ainda usa as colunas em reais que a migração 9 removeu
+def benchmark_indices(db_path, repeticoes):
+    estoque = GerenciadorEstoque(db_path)
+    cur = estoque.conn.cursor()
+    indices = cur.execute("SELECT name, sql FROM sqlite_master WHERE type='index' AND name LIKE 'idx_%'").fetchall()
+    for nome, _ in indices:
+        cur.execute(f"DROP INDEX {nome}")
+    estoque.conn.commit()
+
+    antes = {nome: medir(f, repeticoes) for nome, f in consultas_relatorio(estoque).items()}
+    for _, sql in indices:
+        cur.execute(sql)
+    estoque.conn.commit()
+    estoque.conn.execute("ANALYZE")
+    depois = {nome: medir(f, repeticoes) for nome, f in consultas_relatorio(estoque).items()}
+    estoque.fechar()
+
+    print(f"{'consulta':<36}{'antes (ms)':>12}{'depois (ms)':>13}")
+    for nome in antes:
+        print(f"{nome:<36}{antes[nome]:>12.1f}{depois[nome]:>13.1f}")
+
+
+# partida a frio: cada repetição é um processo novo que importa o sistema, abre o banco e lê a
+# primeira tela de produtos (o que acontece antes de a janela mostrar a lista); o catálogo completo
+# vem depois, em segundo plano, e é medido só para comparação. A meta vale para a mediana
+CODIGO_PARTIDA = """
+import json, sys, time
+t0 = time.perf_counter()
+from main import BuscaProdutos, GerenciadorEstoque
+t1 = time.perf_counter()
+estoque = GerenciadorEstoque(sys.argv[1])
+t2 = time.perf_counter()
+estoque.listar_produtos(BuscaProdutos.PRIMEIRA_PAGINA)
+t3 = time.perf_counter()
+estoque.listar_produtos()
+t4 = time.perf_counter()
+print(json.dumps({"importar": t1 - t0, "abrir_banco": t2 - t1, "primeira_tela": t3 - t2, "catalogo_completo": t4 - t3}))
+"""
+
+
+def benchmark_partida(db_path, repeticoes, meta_ms):
+    pasta = os.path.dirname(os.path.abspath(__file__))
+    GerenciadorEstoque(db_path).fechar()  # migrações pendentes não entram na medida
+    medidas = []
+    for _ in range(repeticoes):
+        t0 = time.perf_counter()
+        saida = subprocess.run([sys.executable, "-c", CODIGO_PARTIDA, db_path], cwd=pasta, check=True,
+                               capture_output=True, text=True).stdout
+        processo = time.perf_counter() - t0
+        fases = json.loads(saida.strip().splitlines()[-1])
+        fases["processo"] = processo
+        medidas.append({fase: segundos * 1000 for fase, segundos in fases.items()})
+    print(f"{'fase':<20}{'mediana ms':>12}{'máx ms':>10}")
+    for fase in ("importar", "abrir_banco", "primeira_tela", "catalogo_completo", "processo"):
+        valores = [m[fase] for m in medidas]
+        print(f"{fase:<20}{statistics.median(valores):>12.1f}{max(valores):>10.1f}")
+    ate_tela = statistics.median(m["importar"] + m["abrir_banco"] + m["primeira_tela"] for m in medidas)
+    print(f"até a primeira tela: {ate_tela:.1f} ms (meta {meta_ms:.0f} ms)")
+    return ate_tela <= meta_ms
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark do GerenciadorEstoque (sem interface gráfica)")
+    parser.add_argument("cenario", choices=["gerar", "suite", "indices", "partida"],
+                        help="gerar: só cria o banco; suite: operações principais; indices: antes/depois dos índices; "
+                             "partida: tempo de abertura a frio até a primeira tela de produtos")
+    parser.add_argument("--db", help="banco gerado (padrão: arquivo temporário)")
+    parser.add_argument("--produtos", type=int, default=10000)
+    parser.add_argument("--vendas", type=int, default=100000)
+    parser.add_argument("--itens-por-venda", type=int, default=3)
+    parser.add_argument("--movimentacoes", type=int, default=1000000)
+    parser.add_argument("--dias", type=int, default=365)
+    parser.add_argument("--semente", type=int, default=42)
+    parser.add_argument("--repeticoes", type=int, default=5)
+    parser.add_argument("--meta-partida-ms", type=float, default=300.0,
+                        help="partida: tempo máximo até a primeira tela (mediana); acima dele o código de saída é 1")
+    parser.add_argument("--json", help="grava os resultados da suite neste arquivo (use - para a saída padrão)")
+    args = parser.parse_args()
+
+    db_path = args.db or os.path.join(tempfile.mkdtemp(), "benchmark.db")
+    if not os.path.exists(db_path):
+        t0 = time.perf_counter()
+        gerar_banco(db_path, args.produtos, args.vendas, args.itens_por_venda, args.movimentacoes, args.dias, args.semente)
+        print(f"banco gerado em {time.perf_counter() - t0:.1f}s: {db_path}", file=sys.stderr)
+
+    if args.cenario == "indices":
+        benchmark_indices(db_path, args.repeticoes)
+    elif args.cenario == "partida":
+        sys.exit(0 if benchmark_partida(db_path, args.repeticoes, args.meta_partida_ms) else 1)
+    elif args.cenario == "suite":
+        resultados = benchmark_suite(db_path, args.repeticoes, args.itens_por_venda)
+        if args.json:
+            saida = {
+                "parametros": {k: getattr(args, k) for k in ("produtos", "vendas", "itens_por_venda", "movimentacoes",
+                                                             "dias", "semente", "repeticoes")},
+                "ambiente": {"python": platform.python_version(), "sqlite": sqlite3.sqlite_version,
+                             "plataforma": platform.platform()},
+                "resultados": resultados,
+            }
+            texto = json.dumps(saida, ensure_ascii=False, indent=2)
+            if args.json == "-":
+                print(texto)
+            else:
+                with open(args.json, "w", encoding="utf-8") as f:
+                    f.write(texto)
+        if args.json != "-":
+            print(f"{'operação':<36}{'p50 ms':>9}{'p90 ms':>9}{'p99 ms':>9}{'consultas':>11}{'commits':>9}")
+            for r in resultados:
+                print(f"{r['operacao']:<36}{r['p50_ms']:>9.2f}{r['p90_ms']:>9.2f}{r['p99_ms']:>9.2f}"
+                      f"{r['consultas_por_op']:>11.1f}{r['commits_por_op']:>9.1f}")
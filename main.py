@@ -1,12 +1,40 @@
 import tkinter as tk
-from tkinter import messagebox
+from tkinter import messagebox, filedialog
 import sqlite3
 import ttkbootstrap as ttk
 from ttkbootstrap.constants import *
 import tkinter.ttk as ttk_native
 from datetime import datetime
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+from collections import OrderedDict, deque
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+from functools import wraps
+import argparse
+import atexit
+import bisect
+import csv
+import gzip
+import inspect
 import json
+import logging
+import math
 import os
+import queue
+import re
+import struct
+import sys
+import threading
+import time
+import zlib
+
+try:
+    import fcntl
+except ImportError:  # Windows: trava de arquivo via msvcrt
+    fcntl = None
+    import msvcrt
+
+from analise import AnaliseVendas
 
 # ----------------- Utils -----------------
 class Utils:
@@ -21,17 +49,1070 @@ class Utils:
         pos_y = (altura_tela // 2) - (altura // 2)
         janela.geometry(f"{largura}x{altura}+{pos_x}+{pos_y}")
 
+# ----------------- Modelo do Treeview de produtos -----------------
+class ModeloProdutosTree:
+    # mantém o Treeview sincronizado com o catálogo (iid = id do produto), mexendo só nas linhas
+    # que mudaram. Acima de limite_virtual produtos, o Treeview guarda apenas a janela visível
+    # e a barra de rolagem passa a ser controlada pelo modelo
+    def __init__(self, tree, scrollbar, formatar, limite_virtual=2000):
+        self.tree = tree
+        self.scrollbar = scrollbar
+        self.formatar = formatar  # produto -> (values, tags)
+        self.limite_virtual = limite_virtual
+        self.produtos = {}      # id -> produto
+        self.ordem = []         # (chave, id) ordenado: chave é o nome (ORDER BY nome) ou a posição no ranking
+        self.ranking = None     # id -> posição, quando a lista é um resultado de busca (ordem da relevância)
+        self.renderizadas = {}  # id -> (values, tags) presentes no Treeview
+        self._mover = set()     # ids cuja posição mudou (renomeados)
+        self.inicio = 0
+        self.janela = int(str(tree.cget("height")))
+
+        scrollbar.config(command=self._rolar)
+        tree.config(yscrollcommand=self._tree_rolou)
+        for evento in ("<MouseWheel>", "<Button-4>", "<Button-5>"):
+            tree.bind(evento, self._roda_mouse, add="+")
+
+    @property
+    def virtual(self):
+        return len(self.ordem) > self.limite_virtual
+
+    def _chave(self, p):
+        if self.ranking is None:
+            return p["nome"]
+        return self.ranking.setdefault(p["id"], len(self.ranking))  # produto novo vai para o fim
+
+    # sincroniza com a lista de produtos: o catálogo completo (ordenar: exibe por nome) ou um
+    # resultado de busca já ranqueado (ordenar=False: mantém a ordem recebida)
+    def carregar(self, produtos, ordenar=True):
+        chaves = {pid: chave for chave, pid in self.ordem}
+        novos = {p["id"]: p for p in produtos}
+        for pid in [pid for pid in self.produtos if pid not in novos]:
+            del self.produtos[pid]
+        self.ranking = None if ordenar else {p["id"]: i for i, p in enumerate(novos.values())}
+        for pid, p in novos.items():
+            if pid in self.produtos and chaves.get(pid) != self._chave(p):
+                self._mover.add(pid)
+            self.produtos[pid] = p
+        self.ordem = sorted((self._chave(p), pid) for pid, p in self.produtos.items())
+        self._renderizar()
+
+    # aplica apenas os produtos alterados/removidos, sem reler o catálogo
+    def atualizar(self, produtos, removidos=()):
+        for pid in removidos:
+            antigo = self.produtos.pop(pid, None)
+            if antigo is not None:
+                self._remover_ordem(self._chave(antigo), pid)
+        for p in produtos:
+            pid = p["id"]
+            antigo = self.produtos.get(pid)
+            if antigo is None or self._chave(antigo) != self._chave(p):
+                if antigo is not None:
+                    self._remover_ordem(self._chave(antigo), pid)
+                    self._mover.add(pid)
+                bisect.insort(self.ordem, (self._chave(p), pid))
+            self.produtos[pid] = p
+        self._renderizar()
+
+    def _remover_ordem(self, chave, pid):
+        i = bisect.bisect_left(self.ordem, (chave, pid))
+        if i < len(self.ordem) and self.ordem[i] == (chave, pid):
+            del self.ordem[i]
+
+    def _visiveis(self):
+        if not self.virtual:
+            self.inicio = 0
+            return [pid for _, pid in self.ordem]
+        self.inicio = max(0, min(self.inicio, len(self.ordem) - self.janela))
+        return [pid for _, pid in self.ordem[self.inicio:self.inicio + self.janela]]
+
+    def _renderizar(self):
+        visiveis = self._visiveis()
+        conjunto = set(visiveis)
+        for pid in list(self.renderizadas):
+            if pid not in conjunto:
+                self.tree.delete(str(pid))
+                del self.renderizadas[pid]
+            elif pid in self._mover:
+                self.tree.detach(str(pid))
+        # o que sobrou no Treeview já está na ordem relativa certa: basta inserir/reanexar na posição
+        for i, pid in enumerate(visiveis):
+            linha = self.formatar(self.produtos[pid])
+            atual = self.renderizadas.get(pid)
+            if atual is None:
+                self.tree.insert("", i, iid=str(pid), values=linha[0], tags=linha[1])
+            else:
+                if pid in self._mover:
+                    self.tree.move(str(pid), "", i)
+                if atual != linha:
+                    self.tree.item(str(pid), values=linha[0], tags=linha[1])
+            self.renderizadas[pid] = linha
+        self._mover.clear()
+        if self.virtual:
+            self._ajustar_scrollbar()
+
+    def _ajustar_scrollbar(self):
+        total = max(1, len(self.ordem))
+        self.scrollbar.set(self.inicio / total, min(1.0, (self.inicio + self.janela) / total))
+
+    def _tree_rolou(self, primeiro, ultimo):
+        if not self.virtual:
+            self.scrollbar.set(primeiro, ultimo)
+
+    def _rolar(self, acao, *args):
+        if not self.virtual:
+            self.tree.yview(acao, *args)
+            return
+        if acao == "moveto":
+            self.inicio = int(float(args[0]) * len(self.ordem))
+        elif acao == "scroll":
+            passo = self.janela if args[1] == "pages" else 1
+            self.inicio += int(args[0]) * passo
+        self._renderizar()
+
+    def _roda_mouse(self, event):
+        if not self.virtual:
+            return None
+        if event.num == 4 or getattr(event, "delta", 0) > 0:
+            self._rolar("scroll", -3, "units")
+        else:
+            self._rolar("scroll", 3, "units")
+        return "break"
+
+
+# ----------------- Resumos de vendas (agregados) -----------------
+# totais por dia e por dia x produto, mantidos por triggers dentro da própria transação da venda
+SQL_RESUMOS = [
+    """CREATE TABLE IF NOT EXISTS resumo_vendas_dia (
+        dia TEXT PRIMARY KEY,
+        num_vendas INTEGER NOT NULL DEFAULT 0,
+        total_centavos INTEGER NOT NULL DEFAULT 0,
+        desconto_centavos INTEGER NOT NULL DEFAULT 0
+    )""",
+    """CREATE TABLE IF NOT EXISTS resumo_vendas_dia_produto (
+        dia TEXT NOT NULL,
+        produto_id INTEGER NOT NULL,
+        quantidade INTEGER NOT NULL DEFAULT 0,
+        receita_centavos INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (dia, produto_id)
+    )""",
+    "CREATE INDEX IF NOT EXISTS idx_resumo_produto ON resumo_vendas_dia_produto(produto_id, dia)",
+    """CREATE TRIGGER IF NOT EXISTS trg_resumo_vendas AFTER INSERT ON vendas BEGIN
+        INSERT INTO resumo_vendas_dia (dia, num_vendas, total_centavos, desconto_centavos)
+        VALUES (date(NEW.data), 1, COALESCE(NEW.total_centavos, 0), COALESCE(NEW.desconto_centavos, 0))
+        ON CONFLICT(dia) DO UPDATE SET num_vendas = num_vendas + 1,
+            total_centavos = total_centavos + excluded.total_centavos,
+            desconto_centavos = desconto_centavos + excluded.desconto_centavos;
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS trg_resumo_venda_itens AFTER INSERT ON venda_itens BEGIN
+        INSERT INTO resumo_vendas_dia_produto (dia, produto_id, quantidade, receita_centavos)
+        SELECT date(v.data), NEW.produto_id, NEW.quantidade,
+               NEW.preco_unit_centavos * NEW.quantidade - COALESCE(NEW.desconto_item_centavos, 0)
+        FROM vendas v WHERE v.id = NEW.venda_id
+        ON CONFLICT(dia, produto_id) DO UPDATE SET quantidade = quantidade + excluded.quantidade,
+            receita_centavos = receita_centavos + excluded.receita_centavos;
+    END""",
+]
+
+SQL_RECONSTRUIR_RESUMOS = [
+    "DELETE FROM resumo_vendas_dia",
+    "DELETE FROM resumo_vendas_dia_produto",
+    """INSERT INTO resumo_vendas_dia (dia, num_vendas, total_centavos, desconto_centavos)
+        SELECT date(data), COUNT(*), COALESCE(SUM(total_centavos), 0), COALESCE(SUM(desconto_centavos), 0)
+        FROM vendas GROUP BY date(data)""",
+    """INSERT INTO resumo_vendas_dia_produto (dia, produto_id, quantidade, receita_centavos)
+        SELECT date(v.data), vi.produto_id, SUM(vi.quantidade),
+               SUM(vi.preco_unit_centavos * vi.quantidade - COALESCE(vi.desconto_item_centavos, 0))
+        FROM venda_itens vi JOIN vendas v ON v.id = vi.venda_id
+        GROUP BY date(v.data), vi.produto_id""",
+]
+
+# a migração 3 criou os resumos quando os valores ainda eram REAL em reais (colunas sem o
+# sufixo _centavos); a 9 os recria em centavos
+SQL_RESUMOS_REAIS = [sql.replace("_centavos", "") for sql in SQL_RESUMOS + SQL_RECONSTRUIR_RESUMOS]
+
+# ----------------- Índice de busca de produtos (FTS5) -----------------
+# tabela de conteúdo externo sobre produtos: o texto fica só em produtos e o índice é mantido por
+# triggers. remove_diacritics faz "cafe" achar "Café"; o UPDATE só reindexa quando muda o texto,
+# não a cada movimentação de estoque
+COLUNAS_BUSCA = ("nome", "categoria", "descricao", "fornecedor")
+
+SQL_BUSCA = [
+    f"""CREATE VIRTUAL TABLE IF NOT EXISTS produtos_fts USING fts5(
+        {', '.join(COLUNAS_BUSCA)}, content='produtos', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    )""",
+    f"""CREATE TRIGGER IF NOT EXISTS trg_produtos_fts_ins AFTER INSERT ON produtos BEGIN
+        INSERT INTO produtos_fts (rowid, {', '.join(COLUNAS_BUSCA)})
+        VALUES (NEW.id, {', '.join('NEW.' + c for c in COLUNAS_BUSCA)});
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS trg_produtos_fts_del AFTER DELETE ON produtos BEGIN
+        INSERT INTO produtos_fts (produtos_fts, rowid, {', '.join(COLUNAS_BUSCA)})
+        VALUES ('delete', OLD.id, {', '.join('OLD.' + c for c in COLUNAS_BUSCA)});
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS trg_produtos_fts_upd AFTER UPDATE OF {', '.join(COLUNAS_BUSCA)} ON produtos BEGIN
+        INSERT INTO produtos_fts (produtos_fts, rowid, {', '.join(COLUNAS_BUSCA)})
+        VALUES ('delete', OLD.id, {', '.join('OLD.' + c for c in COLUNAS_BUSCA)});
+        INSERT INTO produtos_fts (rowid, {', '.join(COLUNAS_BUSCA)})
+        VALUES (NEW.id, {', '.join('NEW.' + c for c in COLUNAS_BUSCA)});
+    END""",
+    "INSERT INTO produtos_fts (produtos_fts) VALUES ('rebuild')",
+]
+
+
+# sem o módulo fts5 no SQLite a migração passa sem o índice e a busca usa LIKE
+def _criar_indice_busca(cur):
+    try:
+        cur.execute("SAVEPOINT busca")
+        for sql in SQL_BUSCA:
+            cur.execute(sql)
+        cur.execute("RELEASE busca")
+    except sqlite3.OperationalError as e:
+        if "fts5" not in str(e):
+            raise
+        cur.execute("ROLLBACK TO busca")
+        cur.execute("RELEASE busca")
+        log.warning("SQLite sem FTS5: busca de produtos sem índice (%s)", e)
+
+
+# ----------------- Retratos de estoque e arquivo de movimentações -----------------
+# um retrato guarda a quantidade de cada produto num instante; ate_movimentacao é o maior id de
+# movimentação já refletido nele. Como as movimentações são gravadas em ordem, o estoque num
+# momento posterior é o retrato mais as movimentações de id maior até aquele momento
+SQL_RETRATOS = [
+    """CREATE TABLE IF NOT EXISTS estoque_retratos (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        data TEXT NOT NULL,
+        ate_movimentacao INTEGER NOT NULL
+    )""",
+    "CREATE INDEX IF NOT EXISTS idx_estoque_retratos_data ON estoque_retratos(data)",
+    """CREATE TABLE IF NOT EXISTS estoque_retrato_itens (
+        retrato_id INTEGER NOT NULL,
+        produto_id INTEGER NOT NULL,
+        quantidade INTEGER NOT NULL,
+        PRIMARY KEY (retrato_id, produto_id)
+    ) WITHOUT ROWID""",
+]
+
+# primeiro retrato, com as quantidades atuais: o estoque que já existia antes da migração (ou
+# que nunca virou movimentação) passa a ser a base do cálculo de estoque_em
+def _retrato_inicial(cur):
+    cur.execute("""
+        INSERT INTO estoque_retratos (data, ate_movimentacao)
+        SELECT datetime('now','localtime'), COALESCE(MAX(id), 0) FROM movimentacoes
+    """)
+    cur.execute("INSERT INTO estoque_retrato_itens (retrato_id, produto_id, quantidade) SELECT ?, id, quantidade FROM produtos",
+                (cur.lastrowid,))
+
+
+# o banco de arquivo (anexado como "arquivo") recebe as movimentações e os retratos antigos
+SQL_ARQUIVO = [
+    """CREATE TABLE IF NOT EXISTS arquivo.movimentacoes (
+        id INTEGER PRIMARY KEY,
+        produto_id INTEGER,
+        tipo TEXT,
+        quantidade INTEGER,
+        data TEXT,
+        descricao TEXT
+    )""",
+    "CREATE INDEX IF NOT EXISTS arquivo.idx_movimentacoes_produto ON movimentacoes(produto_id, data)",
+    "CREATE INDEX IF NOT EXISTS arquivo.idx_movimentacoes_data ON movimentacoes(data)",
+] + [sql.replace("IF NOT EXISTS ", "IF NOT EXISTS arquivo.") for sql in SQL_RETRATOS]
+
+
+# ----------------- Alertas de estoque baixo -----------------
+# um produto entra em alertas_estoque no momento em que a quantidade cruza o estoque_minimo
+# (na mesma transação da venda/remoção/ajuste) e sai quando volta acima. O id cresce a cada
+# novo cruzamento, o que permite buscar só os alertas novos
+SQL_ALERTAS = [
+    """CREATE TABLE IF NOT EXISTS alertas_estoque (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        produto_id INTEGER NOT NULL UNIQUE,
+        desde TEXT NOT NULL DEFAULT (datetime('now','localtime'))
+    )""",
+    """CREATE TRIGGER IF NOT EXISTS trg_alerta_entra AFTER UPDATE OF quantidade, estoque_minimo ON produtos
+    WHEN NEW.quantidade <= NEW.estoque_minimo AND OLD.quantidade > OLD.estoque_minimo BEGIN
+        INSERT OR IGNORE INTO alertas_estoque (produto_id) VALUES (NEW.id);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS trg_alerta_sai AFTER UPDATE OF quantidade, estoque_minimo ON produtos
+    WHEN NEW.quantidade > NEW.estoque_minimo AND OLD.quantidade <= OLD.estoque_minimo BEGIN
+        DELETE FROM alertas_estoque WHERE produto_id = NEW.id;
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS trg_alerta_cadastro AFTER INSERT ON produtos
+    WHEN NEW.quantidade <= NEW.estoque_minimo BEGIN
+        INSERT OR IGNORE INTO alertas_estoque (produto_id) VALUES (NEW.id);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS trg_alerta_exclusao AFTER DELETE ON produtos BEGIN
+        DELETE FROM alertas_estoque WHERE produto_id = OLD.id;
+    END""",
+    """INSERT OR IGNORE INTO alertas_estoque (produto_id)
+        SELECT id FROM produtos WHERE quantidade <= estoque_minimo ORDER BY id""",
+]
+
+
+# código de barras/SKU: coluna opcional, única quando preenchida (NULLs não conflitam)
+def _adicionar_codigo_barras(cur):
+    _adicionar_coluna(cur, "produtos", "codigo_barras", "TEXT")
+    cur.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_produtos_codigo_barras ON produtos(codigo_barras)")
+
+
+# chave de idempotência da venda (gerada no caixa): reenviar a mesma venda não a duplica
+def _adicionar_chave_venda(cur):
+    _adicionar_coluna(cur, "vendas", "chave", "TEXT")
+    cur.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_vendas_chave ON vendas(chave)")
+
+
+# preço, totais e descontos passam de REAL (reais) para INTEGER (centavos) em colunas *_centavos.
+# Os triggers dos resumos leem as colunas antigas, então saem antes e os resumos são recriados
+COLUNAS_DINHEIRO = [("produtos", "preco"), ("vendas", "total"), ("vendas", "desconto"),
+                    ("venda_itens", "preco_unit"), ("venda_itens", "desconto_item")]
+
+
+def _converter_para_centavos(cur):
+    for sql in ("DROP TRIGGER IF EXISTS trg_resumo_vendas", "DROP TRIGGER IF EXISTS trg_resumo_venda_itens",
+                "DROP TABLE IF EXISTS resumo_vendas_dia", "DROP TABLE IF EXISTS resumo_vendas_dia_produto"):
+        cur.execute(sql)
+    for tabela, coluna in COLUNAS_DINHEIRO:
+        if coluna not in {row[1] for row in cur.execute(f"PRAGMA table_info({tabela})")}:
+            continue
+        _adicionar_coluna(cur, tabela, f"{coluna}_centavos", "INTEGER NOT NULL DEFAULT 0")
+        cur.execute(f"UPDATE {tabela} SET {coluna}_centavos = CAST(round(COALESCE({coluna}, 0) * 100) AS INTEGER)")
+        cur.execute(f"ALTER TABLE {tabela} DROP COLUMN {coluna}")
+    for sql in SQL_RESUMOS + SQL_RECONSTRUIR_RESUMOS:
+        cur.execute(sql)
+
+
+# ALTER TABLE ADD COLUMN não tem IF NOT EXISTS
+def _adicionar_coluna(cur, tabela, coluna, tipo):
+    colunas = {row[1] for row in cur.execute(f"PRAGMA table_info({tabela})")}
+    if coluna not in colunas:
+        cur.execute(f"ALTER TABLE {tabela} ADD COLUMN {coluna} {tipo}")
+
+
+# ----------------- Migrações de schema -----------------
+# cada entrada leva o banco para a versão indicada (PRAGMA user_version);
+# os passos podem ser SQL ou funções que recebem o cursor, e precisam ser idempotentes.
+# novas alterações de schema entram sempre no final da lista
+MIGRACOES = [
+    (1, "índices das colunas de filtro/ordenação dos relatórios", [
+        "CREATE INDEX IF NOT EXISTS idx_produtos_nome ON produtos(nome)",
+        "CREATE INDEX IF NOT EXISTS idx_vendas_data ON vendas(data)",
+        "CREATE INDEX IF NOT EXISTS idx_venda_itens_venda ON venda_itens(venda_id)",
+        "CREATE INDEX IF NOT EXISTS idx_movimentacoes_produto ON movimentacoes(produto_id, data)",
+        "CREATE INDEX IF NOT EXISTS idx_movimentacoes_data ON movimentacoes(data)",
+    ]),
+    (2, "índice para filtrar o histórico por tipo de movimentação", [
+        "CREATE INDEX IF NOT EXISTS idx_movimentacoes_tipo ON movimentacoes(tipo, data)",
+    ]),
+    (3, "resumos de vendas por dia e por dia x produto", SQL_RESUMOS_REAIS),
+    (4, "índice de busca textual de produtos", [_criar_indice_busca]),
+    (5, "código de barras/SKU dos produtos", [_adicionar_codigo_barras]),
+    (6, "retratos periódicos do estoque", SQL_RETRATOS + [_retrato_inicial]),
+    (7, "chave de idempotência das vendas", [_adicionar_chave_venda]),
+    (8, "alertas de estoque abaixo do mínimo", SQL_ALERTAS),
+    (9, "valores em dinheiro como centavos inteiros", [_converter_para_centavos]),
+]
+VERSAO_SCHEMA = MIGRACOES[-1][0]
+
+# ----------------- Cache de Produtos -----------------
+class CacheProdutos:
+    # produtos indexados por id (LRU quando max_itens é informado) e, sem limite, o catálogo
+    # completo já ordenado por (nome, id). A geração muda a cada invalidação, para que uma leitura
+    # feita antes de uma escrita não grave no cache um valor já desatualizado
+    def __init__(self, max_itens=None):
+        self.max_itens = max_itens
+        self._itens = OrderedDict()
+        self._lista = None
+        self._geracao = 0
+        self._lock = threading.Lock()
+        self.acertos = 0
+        self.falhas = 0
+
+    @property
+    def geracao(self):
+        return self._geracao
+
+    def obter(self, produto_id):
+        with self._lock:
+            produto = self._itens.get(produto_id)
+            if produto is None:
+                self.falhas += 1
+                return None
+            self._itens.move_to_end(produto_id)
+            self.acertos += 1
+            return dict(produto)
+
+    def colocar(self, produtos, geracao):
+        with self._lock:
+            if geracao != self._geracao:
+                return
+            for p in produtos:
+                self._itens[p["id"]] = dict(p)
+                self._itens.move_to_end(p["id"])
+            if self.max_itens is not None:
+                while len(self._itens) > self.max_itens:
+                    self._itens.popitem(last=False)
+
+    def lista(self, limite=None):
+        with self._lock:
+            if self._lista is None:
+                self.falhas += 1
+                return None
+            self.acertos += 1
+            ids = self._lista if limite is None else self._lista[:limite]
+            return [dict(self._itens[pid]) for pid in ids]
+
+    def guardar_lista(self, produtos, geracao):
+        if self.max_itens is not None:
+            return
+        self.colocar(produtos, geracao)
+        with self._lock:
+            if geracao == self._geracao:
+                self._lista = [p["id"] for p in produtos]
+
+    # ids alterados saem do cache; o catálogo completo sempre é descartado
+    def invalidar(self, ids=()):
+        with self._lock:
+            self._geracao += 1
+            for pid in ids:
+                self._itens.pop(pid, None)
+            self._lista = None
+
+    def limpar(self):
+        with self._lock:
+            self._geracao += 1
+            self._itens.clear()
+            self._lista = None
+
+
+# ----------------- Instrumentação -----------------
+log = logging.getLogger("estoque")
+
+
+class Instrumentacao:
+    # conta statements/commits e mede a latência de cada método do GerenciadorEstoque
+    # (via set_trace_callback das conexões); operações acima de limite_lento_ms vão para o log
+    # junto com o EXPLAIN QUERY PLAN dos statements executados
+    FAIXAS_MS = (1, 5, 10, 50, 100, 500, 1000)
+
+    def __init__(self, limite_lento_ms=100.0, max_lentas=50):
+        self.limite_lento_ms = limite_lento_ms
+        self.conexao = None  # função que devolve a conexão da thread atual (definida pelo GerenciadorEstoque)
+        self.metodos = {}
+        self.lentas = deque(maxlen=max_lentas)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def conectar(self, conn):
+        conn.set_trace_callback(self._trace)
+
+    def _trace(self, sql):
+        op = getattr(self._local, "op", None)
+        if op is not None and not sql.startswith("--"):  # "--" = corpo de trigger
+            op.append(sql)
+
+    # envolve um método; chamadas aninhadas contam só para o método mais externo
+    def envolver(self, nome, func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if getattr(self._local, "op", None) is not None:
+                return func(*args, **kwargs)
+            self._local.op = []
+            inicio = time.perf_counter()
+            try:
+                resultado = func(*args, **kwargs)
+            except Exception:
+                statements, self._local.op = self._local.op, None
+                self._registrar(nome, (time.perf_counter() - inicio) * 1000, statements)
+                raise
+            statements, self._local.op = self._local.op, None
+            if inspect.isgenerator(resultado):
+                return self._envolver_gerador(nome, resultado)
+            self._registrar(nome, (time.perf_counter() - inicio) * 1000, statements)
+            return resultado
+        return wrapper
+
+    # geradores (ex.: relatorio_vendas) são medidos enquanto são consumidos
+    def _envolver_gerador(self, nome, gerador):
+        total_ms, statements = 0.0, []
+        try:
+            while True:
+                self._local.op = statements
+                inicio = time.perf_counter()
+                try:
+                    item = next(gerador)
+                except StopIteration:
+                    break
+                finally:
+                    self._local.op = None
+                    total_ms += (time.perf_counter() - inicio) * 1000
+                yield item
+        finally:
+            gerador.close()
+            self._registrar(nome, total_ms, statements)
+
+    def _registrar(self, nome, ms, statements):
+        commits = sum(1 for s in statements if s.lstrip().upper().startswith("COMMIT"))
+        with self._lock:
+            m = self.metodos.setdefault(nome, {"chamadas": 0, "statements": 0, "commits": 0, "total_ms": 0.0,
+                                               "max_ms": 0.0, "histograma": [0] * (len(self.FAIXAS_MS) + 1)})
+            m["chamadas"] += 1
+            m["statements"] += len(statements)
+            m["commits"] += commits
+            m["total_ms"] += ms
+            m["max_ms"] = max(m["max_ms"], ms)
+            m["histograma"][bisect.bisect_left(self.FAIXAS_MS, ms)] += 1
+        if ms >= self.limite_lento_ms:
+            self._registrar_lenta(nome, ms, statements)
+
+    def _registrar_lenta(self, nome, ms, statements):
+        planos = []
+        for sql in dict.fromkeys(statements):  # sem repetir statements iguais
+            if len(planos) >= 10:
+                break
+            if not sql.lstrip().upper().startswith(("SELECT", "UPDATE", "DELETE", "INSERT", "WITH")):
+                continue
+            try:
+                plano = [r[3] for r in self.conexao().execute("EXPLAIN QUERY PLAN " + sql)]
+            except sqlite3.Error as e:
+                plano = [f"(sem plano: {e})"]
+            if plano:  # INSERT ... VALUES não tem plano
+                planos.append({"sql": " ".join(sql.split()), "plano": plano})
+        registro = {"metodo": nome, "ms": ms, "statements": len(statements),
+                    "quando": datetime.now().strftime("%Y-%m-%d %H:%M:%S"), "planos": planos}
+        with self._lock:
+            self.lentas.append(registro)
+        log.warning("operação lenta: %s levou %.1f ms (%d statements)\n%s", nome, ms, len(statements),
+                    "\n".join(f"  {p['sql']}\n    " + "\n    ".join(p["plano"]) for p in planos))
+
+    def relatorio(self):
+        with self._lock:
+            metodos = {}
+            for nome, m in sorted(self.metodos.items()):
+                chamadas = m["chamadas"] or 1
+                metodos[nome] = dict(m, media_ms=m["total_ms"] / chamadas,
+                                     statements_por_chamada=m["statements"] / chamadas,
+                                     commits_por_chamada=m["commits"] / chamadas,
+                                     histograma=dict(zip([f"<={f}ms" for f in self.FAIXAS_MS] + [f">{self.FAIXAS_MS[-1]}ms"],
+                                                         m["histograma"])))
+            return {"limite_lento_ms": self.limite_lento_ms, "metodos": metodos, "lentas": list(self.lentas)}
+
+    def salvar_json(self, caminho):
+        with open(caminho, "w", encoding="utf-8") as f:
+            json.dump(self.relatorio(), f, ensure_ascii=False, indent=2)
+
+    def zerar(self):
+        with self._lock:
+            self.metodos.clear()
+            self.lentas.clear()
+
+
+# ----------------- Pool de Conexões -----------------
+class PoolConexoes:
+    # uma conexão por thread, criada sob demanda; no modo multi-terminal usa WAL
+    # para que relatórios consigam ler enquanto outro terminal grava uma venda
+    def __init__(self, db_path, multi_terminal=False, timeout=5.0, ao_abrir=None):
+        self.db_path = db_path
+        self.multi_terminal = multi_terminal
+        self.timeout = timeout
+        self.ao_abrir = ao_abrir  # chamado com cada conexão nova (ex.: instrumentação)
+        self._local = threading.local()
+        self._conexoes = []
+        self._lock = threading.Lock()
+
+    def _abrir(self):
+        conn = sqlite3.connect(self.db_path, timeout=self.timeout, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        if self.multi_terminal:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(f"PRAGMA busy_timeout={int(self.timeout * 1000)}")
+        if self.ao_abrir:
+            self.ao_abrir(conn)
+        return conn
+
+    def conexao(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._abrir()
+            self._local.conn = conn
+            with self._lock:
+                self._conexoes.append(conn)
+        return conn
+
+    def fechar(self):
+        with self._lock:
+            for conn in self._conexoes:
+                conn.close()
+            self._conexoes.clear()
+        self._local = threading.local()
+
+
+# repete a operação de escrita quando o banco está travado por outro terminal
+def repetir_se_ocupado(func, tentativas=5, espera=0.05):
+    @wraps(func)
+    def wrapper(self, *args, **kwargs):
+        for tentativa in range(tentativas):
+            try:
+                return func(self, *args, **kwargs)
+            except sqlite3.OperationalError as e:
+                msg = str(e).lower()
+                if ("locked" not in msg and "busy" not in msg) or tentativa == tentativas - 1:
+                    raise
+                self.conn.rollback()
+                time.sleep(espera * (2 ** tentativa))
+    return wrapper
+
+
+# ----------------- Dinheiro -----------------
+# valores em dinheiro são inteiros em centavos (colunas *_centavos); reais aparecem só na digitação,
+# na importação e na exibição. A conversão de reais usa Decimal e, daí em diante, as contas são
+# entre inteiros: somas e totais saem exatos. No texto digitado/importado vale o formato brasileiro:
+# o ponto é separador de milhar quando há vírgula ou quando vem seguido de grupos de três dígitos
+# (1.234 = mil duzentos e trinta e quatro); mais de duas casas decimais é erro, não arredondamento.
+# Números float (JSON, REAL antigos) são arredondados meio-para-cima para o centavo
+CENTAVO = Decimal("0.01")
+MILHAR = re.compile(r"[+-]?[1-9]\d{0,2}(\.\d{3})+")
+
+
+def centavos(valor):
+    if isinstance(valor, int):
+        return valor * 100
+    texto = str(valor).strip()
+    if isinstance(valor, str):
+        if "," in texto or MILHAR.fullmatch(texto):
+            texto = texto.replace(".", "").replace(",", ".")  # formato brasileiro 1.234,56
+    try:
+        decimal = Decimal(texto)
+    except InvalidOperation:
+        raise ValueError(f"valor inválido: {valor!r}") from None
+    if not decimal.is_finite():
+        raise ValueError(f"valor inválido: {valor!r}")
+    if isinstance(valor, str) and decimal != decimal.quantize(CENTAVO):
+        raise ValueError(f"valor inválido: {valor!r} (mais de duas casas decimais)")
+    return int(decimal.quantize(CENTAVO, rounding=ROUND_HALF_UP) * 100)
+
+
+def reais(valor_centavos):
+    return Decimal(int(valor_centavos or 0)).scaleb(-2)
+
+
+def formatar_moeda(valor_centavos):
+    return f"R${reais(valor_centavos)}"
+
+
+# desconto de um item do carrinho: desconto_item_centavos ou, em vendas antigas da fila local
+# e de clientes HTTP, desconto_item em reais
+def desconto_do_item(item):
+    if item.get("desconto_item_centavos") is not None:
+        return int(item["desconto_item_centavos"])
+    return centavos(item.get("desconto_item") or 0)
+
+
+# motor de preços: a venda (registrar_venda), o carrinho e o recibo calculam por aqui. Recebe as
+# colunas do carrinho em centavos (preço unitário, quantidade e desconto de cada linha) e o
+# desconto total; devolve o subtotal de cada linha, o total bruto e o total final. Desconto negativo
+# ou maior que o valor é recusado (validar=False só para refazer as contas de uma venda já gravada)
+def calcular_totais(precos, quantidades, descontos_item, desconto_total=0, validar=True):
+    subtotais = [p * q - d for p, q, d in zip(precos, quantidades, descontos_item)]
+    bruto = sum(subtotais)
+    if not validar:
+        return {"subtotais": subtotais, "bruto": bruto, "desconto": desconto_total, "total": bruto - desconto_total}
+    for preco, qtd, desconto, subtotal in zip(precos, quantidades, descontos_item, subtotais):
+        if desconto < 0 or subtotal < 0:
+            raise ValueError(f"Desconto de item inválido: {formatar_moeda(desconto)} sobre {formatar_moeda(preco * qtd)}")
+    if desconto_total < 0 or desconto_total > bruto:
+        raise ValueError(f"Desconto total inválido: {formatar_moeda(desconto_total)} sobre {formatar_moeda(bruto)}")
+    return {"subtotais": subtotais, "bruto": bruto, "desconto": desconto_total, "total": bruto - desconto_total}
+
+
+# ----------------- Importação / Exportação -----------------
+CAMPOS_PRODUTO = ["id", "nome", "categoria", "quantidade", "preco_centavos", "descricao", "fornecedor", "estoque_minimo",
+                  "codigo_barras"]
+# tabela/relatório -> (consulta, coluna de data para filtrar o período ou None, ordem).
+# {movimentacoes} inclui as movimentações do banco de arquivo, quando ele existe
+TABELAS_EXPORTAVEIS = {
+    "produtos": ("SELECT * FROM produtos", None, "id"),
+    "vendas": ("SELECT * FROM vendas", "data", "id"),
+    "venda_itens": ("SELECT vi.* FROM venda_itens vi JOIN vendas v ON v.id = vi.venda_id", "v.data", "vi.id"),
+    "movimentacoes": ("SELECT * FROM {movimentacoes} m", "m.data", "m.id"),
+    "estoque": ("""SELECT id, nome, categoria, fornecedor, quantidade, estoque_minimo, preco_centavos,
+                          quantidade * preco_centavos AS valor_centavos FROM produtos""", None, "nome, id"),
+    "historico": ("""SELECT m.*, p.nome AS produto_nome FROM {movimentacoes} m
+                     LEFT JOIN produtos p ON p.id = m.produto_id""", "m.data", "m.data, m.id"),
+    "vendas_por_dia": ("SELECT * FROM resumo_vendas_dia", "dia", "dia"),
+    "vendas_por_dia_produto": ("""SELECT r.*, p.nome FROM resumo_vendas_dia_produto r
+                                  LEFT JOIN produtos p ON p.id = r.produto_id""", "r.dia", "r.dia, r.produto_id"),
+}
+MOVIMENTACOES_COM_ARQUIVO = """(SELECT id, produto_id, tipo, quantidade, data, descricao FROM arquivo.movimentacoes
+                               UNION ALL
+                               SELECT id, produto_id, tipo, quantidade, data, descricao FROM main.movimentacoes)"""
+
+
+# .csv/.jsonl, os dois também compactados (.csv.gz, .jsonl.gz), ou o formato colunar (.col)
+def formato_arquivo(caminho):
+    nome = caminho.lower()
+    if nome.endswith(".gz"):
+        nome = nome[:-3]
+    elif nome.endswith(".col"):
+        return "colunar"
+    if nome.endswith(".csv"):
+        return "csv"
+    if nome.endswith(".jsonl") or nome.endswith(".json"):
+        return "jsonl"
+    raise ValueError(f"Formato não suportado: {caminho} (use .csv, .jsonl, .csv.gz, .jsonl.gz ou .col)")
+
+
+# abre o arquivo de texto, com gzip quando o nome termina em .gz; arquivo: outro caminho
+# para abrir no lugar (o .parcial da exportação), mantendo o formato do nome final
+def _abrir_texto(caminho, modo="r", arquivo=None, **kwargs):
+    if caminho.lower().endswith(".gz"):
+        return gzip.open(arquivo or caminho, modo + "t", compresslevel=6, **kwargs)
+    return open(arquivo or caminho, modo, **kwargs)
+
+
+class EscritorColunar:
+    # formato colunar compacto (.col): cabeçalho com os nomes das colunas e, para cada bloco de
+    # linhas, cada coluna separada e compactada com zlib (nível 1: bem mais rápido e quase do
+    # mesmo tamanho): inteiros como int64, reais como float64 e o resto como texto UTF-8 (tamanho
+    # de cada um em caracteres + o texto), com um mapa de nulos quando há algum. Cada bloco é
+    # gravado assim que chega, então a memória depende só do tamanho do bloco
+    MAGICO = b"ERPCOL1\n"
+    TAMANHO = struct.Struct("<I")
+
+    def __init__(self, f, colunas):
+        self.f = f
+        self.colunas = list(colunas)
+        cabecalho = json.dumps({"colunas": self.colunas}).encode("utf-8")
+        f.write(self.MAGICO + self.TAMANHO.pack(len(cabecalho)) + cabecalho)
+
+    def _pedaco(self, dados):
+        dados = zlib.compress(dados, 1) if dados else b""
+        return self.TAMANHO.pack(len(dados)) + dados
+
+    @staticmethod
+    def _binario(valores):
+        if sys.byteorder == "big":
+            valores.byteswap()
+        return valores.tobytes()
+
+    def _coluna(self, valores):
+        nulos = bytes(v is None for v in valores) if None in valores else b""
+        presentes = [v for v in valores if v is not None] if nulos else valores
+        tipos = set(map(type, presentes))
+        tamanhos = b""
+        try:
+            if tipos <= {int}:
+                tipo, dados = b"i", self._binario(array("q", presentes))
+            elif tipos <= {int, float}:
+                tipo, dados = b"f", self._binario(array("d", presentes))
+            else:
+                raise OverflowError
+        except OverflowError:  # texto, blob ou inteiro fora de 64 bits
+            textos = presentes if tipos <= {str} else [str(v) for v in presentes]
+            tipo, dados = b"s", "".join(textos).encode("utf-8")
+            tamanhos = self._binario(array("I", map(len, textos)))
+        return tipo + self._pedaco(nulos) + self._pedaco(tamanhos) + self._pedaco(dados)
+
+    # linhas: sequência de tuplas (ou sqlite3.Row) na ordem das colunas
+    def escrever(self, linhas):
+        if not linhas:
+            return
+        self.f.write(self.TAMANHO.pack(len(linhas)))
+        for valores in zip(*linhas):
+            self.f.write(self._coluna(valores))
+
+    def fechar(self):
+        self.f.write(self.TAMANHO.pack(0))
+
+
+# lê um arquivo colunar bloco a bloco: gera um dict por linha
+def ler_colunar(caminho):
+    tamanho = EscritorColunar.TAMANHO
+
+    def inteiro(f):
+        dados = f.read(tamanho.size)
+        if len(dados) < tamanho.size:
+            raise ValueError(f"Arquivo colunar truncado: {caminho}")
+        return tamanho.unpack(dados)[0]
+
+    def pedaco(f):
+        n = inteiro(f)
+        return zlib.decompress(f.read(n)) if n else b""
+
+    def numeros(codigo, dados):
+        valores = array(codigo)
+        valores.frombytes(dados)
+        if sys.byteorder == "big":
+            valores.byteswap()
+        return valores
+
+    with open(caminho, "rb") as f:
+        if f.read(len(EscritorColunar.MAGICO)) != EscritorColunar.MAGICO:
+            raise ValueError(f"Não é um arquivo colunar: {caminho}")
+        colunas = json.loads(f.read(inteiro(f)))["colunas"]
+        while True:
+            linhas = inteiro(f)
+            if not linhas:
+                return
+            valores = []
+            for _ in colunas:
+                tipo, nulos, tamanhos, dados = f.read(1), pedaco(f), pedaco(f), pedaco(f)
+                if tipo == b"s":
+                    presentes, inicio, texto = [], 0, dados.decode("utf-8")
+                    for n in numeros("I", tamanhos):
+                        presentes.append(texto[inicio:inicio + n])
+                        inicio += n
+                else:
+                    presentes = numeros("q" if tipo == b"i" else "d", dados).tolist()
+                if nulos:
+                    presentes = iter(presentes)
+                    presentes = [None if nulo else next(presentes) for nulo in nulos]
+                valores.append(presentes)
+            for linha in zip(*valores):
+                yield dict(zip(colunas, linha))
+
+
+# grava blocos de linhas (tuplas na ordem das colunas) em qualquer formato de formato_arquivo.
+# Escreve em <caminho>.parcial e só renomeia no fim: quem lê o destino (um job noturno, outro
+# programa) nunca vê um arquivo pela metade. ao_progresso(total) a cada bloco; devolve o total
+def gravar_registros(caminho, colunas, blocos, ao_progresso=None):
+    formato = formato_arquivo(caminho)
+    parcial = caminho + ".parcial"
+    total = 0
+    try:
+        if formato == "colunar":
+            with open(parcial, "wb") as f:
+                escritor = EscritorColunar(f, colunas)
+                for linhas in blocos:
+                    escritor.escrever(linhas)
+                    total += len(linhas)
+                    if ao_progresso:
+                        ao_progresso(total)
+                escritor.fechar()
+        else:
+            with _abrir_texto(caminho, "w", arquivo=parcial, newline="", encoding="utf-8") as f:
+                escritor = csv.writer(f) if formato == "csv" else None
+                if escritor:
+                    escritor.writerow(colunas)
+                for linhas in blocos:
+                    if escritor:
+                        escritor.writerows(tuple(r) for r in linhas)
+                    else:
+                        f.writelines(json.dumps(dict(zip(colunas, r)), ensure_ascii=False) + "\n" for r in linhas)
+                    total += len(linhas)
+                    if ao_progresso:
+                        ao_progresso(total)
+        os.replace(parcial, caminho)
+    except BaseException:
+        if os.path.exists(parcial):
+            os.remove(parcial)
+        raise
+    return total
+
+
+# linha ilegível do arquivo: ler_registros a entrega no lugar do registro, para quem valida
+# rejeitar só essa linha e seguir com as outras
+class RegistroInvalido(ValueError):
+    pass
+
+
+# lê o arquivo linha a linha, sem carregar tudo na memória: gera um dict por registro
+# (ou RegistroInvalido para a linha que não pôde ser lida)
+def ler_registros(caminho):
+    formato = formato_arquivo(caminho)
+    if formato == "colunar":
+        yield from ler_colunar(caminho)
+    elif formato == "csv":
+        with _abrir_texto(caminho, newline="", encoding="utf-8-sig") as f:
+            amostra = f.read(4096)
+            f.seek(0)
+            try:
+                dialeto = csv.Sniffer().sniff(amostra, delimiters=",;\t")
+            except csv.Error:
+                dialeto = csv.excel
+            for registro in csv.DictReader(f, dialect=dialeto):
+                yield registro
+    else:
+        with _abrir_texto(caminho, encoding="utf-8") as f:
+            for linha in f:
+                if linha.strip():
+                    try:
+                        yield json.loads(linha)
+                    except json.JSONDecodeError as e:
+                        yield RegistroInvalido(f"JSON inválido: {e}")
+
+
+def _vazio(valor):
+    return valor is None or str(valor).strip() == ""
+
+
+def _numero(valor, tipo, campo, obrigatorio=True):
+    if _vazio(valor):
+        if obrigatorio:
+            raise ValueError(f"campo '{campo}' obrigatório")
+        return None
+    texto = str(valor).strip()
+    if tipo is float and "," in texto:
+        texto = texto.replace(".", "").replace(",", ".")  # formato brasileiro 1.234,56
+    numero = tipo(texto)
+    if numero < 0:
+        raise ValueError(f"campo '{campo}' negativo")
+    return numero
+
+
+def _exigir_objeto(registro):
+    if isinstance(registro, RegistroInvalido):
+        raise registro
+    if not isinstance(registro, dict):
+        raise ValueError("registro deve ser um objeto com os campos")
+
+
+# preco em reais (planilha, clientes antigos) ou preco_centavos (exportação deste sistema)
+def _preco_centavos(registro):
+    if not _vazio(registro.get("preco_centavos")):
+        return _numero(registro["preco_centavos"], int, "preco_centavos")
+    if _vazio(registro.get("preco")):
+        raise ValueError("campo 'preco' obrigatório")
+    valor = centavos(registro["preco"])
+    if valor < 0:
+        raise ValueError("campo 'preco' negativo")
+    return valor
+
+
+# valida e normaliza um registro de produto vindo de arquivo; campos opcionais ausentes
+# ficam None (no cadastro recebem o padrão, na atualização mantêm o valor atual)
+def validar_produto(registro):
+    _exigir_objeto(registro)
+    nome = (registro.get("nome") or "").strip()
+    if not nome:
+        raise ValueError("campo 'nome' obrigatório")
+    return {
+        "id": _numero(registro.get("id"), int, "id", obrigatorio=False) or None,
+        "nome": nome,
+        "categoria": registro.get("categoria") or None,
+        "quantidade": _numero(registro.get("quantidade"), int, "quantidade", obrigatorio=False),
+        "preco_centavos": _preco_centavos(registro),
+        "descricao": registro.get("descricao") or None,
+        "fornecedor": registro.get("fornecedor") or None,
+        "estoque_minimo": _numero(registro.get("estoque_minimo"), int, "estoque_minimo", obrigatorio=False),
+        "codigo_barras": str(registro.get("codigo_barras") or "").strip() or None,
+    }
+
+
+# linha de uma contagem de inventário: produto pelo id (id/produto_id) ou pelo código de barras,
+# quantidade contada em 'contado' (ou 'quantidade', como na exportação de produtos)
+def validar_contagem(registro):
+    _exigir_objeto(registro)
+    produto_id = _numero(registro.get("id", registro.get("produto_id")), int, "id", obrigatorio=False) or None
+    codigo = str(registro.get("codigo_barras") or "").strip() or None
+    if produto_id is None and codigo is None:
+        raise ValueError("informe 'id' ou 'codigo_barras'")
+    contado = registro.get("contado")
+    if _vazio(contado):
+        contado = registro.get("quantidade")
+    return {"id": produto_id, "codigo_barras": codigo, "contado": _numero(contado, int, "contado")}
+
+
+# lê um arquivo de contagem: devolve (contagens válidas, [(numero_linha, erro), ...])
+def ler_contagens(caminho):
+    contagens, erros = [], []
+    for numero, registro in enumerate(ler_registros(caminho), start=1):
+        try:
+            contagens.append(validar_contagem(registro))
+        except (ValueError, TypeError) as e:
+            erros.append((numero, str(e)))
+    return contagens, erros
+
+
+COLUNAS_DIVERGENCIA = ("produto_id", "nome", "codigo_barras", "sistema", "contado", "diferenca", "valor_centavos")
+
+
+# grava as divergências de uma conciliação de inventário (mesmos formatos da exportação)
+def gravar_divergencias(relatorio, caminho):
+    linhas = [tuple(d[c] for c in COLUNAS_DIVERGENCIA) for d in relatorio["divergencias"]]
+    return gravar_registros(caminho, COLUNAS_DIVERGENCIA, [linhas])
+
+
 # ----------------- Gerenciador de Estoque / Vendas -----------------
+class EstoqueInsuficiente(ValueError):
+    pass
+
+
+# data anterior ao retrato mais antigo: o estoque daquele momento não é conhecido
+class EstoqueDesconhecido(ValueError):
+    pass
+
+
 class GerenciadorEstoque:
-    def __init__(self, db_path="estoque.db"):
-        self.conn = sqlite3.connect(db_path)
-        self.conn.row_factory = sqlite3.Row
-        self.cur = self.conn.cursor()
-        self.criar_banco_tabela()
+    # métodos medidos quando a instrumentação está ligada
+    METODOS_INSTRUMENTADOS = (
+        "criar_banco_tabela", "aplicar_migracoes", "cadastrar_produto", "listar_produtos", "obter_produto",
+        "obter_produtos", "obter_produto_por_codigo", "buscar_produtos", "atualizar_estoque", "remover_estoque", "adicionar_estoque", "aplicar_ajustes",
+        "registrar_movimentacao",
+        "registrar_venda", "importar_produtos", "exportar_tabela", "reconstruir_resumos", "relatorio_vendas",
+        "vendas_por_dia", "vendas_por_produto", "vendas_por_categoria", "contar_vendas", "relatorio_estoque",
+        "itens_venda", "historico_movimentacoes", "criar_retrato", "estoque_em", "arquivar_movimentacoes",
+        "dados_recibo", "produtos_abaixo_minimo", "situacao_alertas", "sugestoes_compra", "conciliar_inventario",
+    )
+
+    # migrar=False deixa a criação/migração do banco para preparar_banco (a janela a executa em segundo plano)
+    def __init__(self, db_path="estoque.db", multi_terminal=False, cache_max=None, instrumentacao=None, migrar=True):
+        self.db_path = db_path
+        # movimentações antigas vão para um banco separado, anexado só quando preciso
+        raiz, ext = os.path.splitext(db_path)
+        self.caminho_arquivo = f"{raiz}_arquivo{ext or '.db'}"
+        self.pool = PoolConexoes(db_path, multi_terminal=multi_terminal)
+        self.cache = CacheProdutos(cache_max)
+        self._data_version = {}  # id(conexão) -> (último PRAGMA data_version visto, escritas das outras conexões)
+        self._escritas = 0  # commits feitos por este processo (todas as threads)
+        self._escritas_conexao = {}  # id(conexão) -> commits feitos por ela
+        self._lock_escritas = threading.Lock()
+        self.instrumentacao = instrumentacao
+        if instrumentacao is not None:
+            self.pool.ao_abrir = instrumentacao.conectar
+            instrumentacao.conexao = self.pool.conexao
+            for nome in self.METODOS_INSTRUMENTADOS:
+                setattr(self, nome, instrumentacao.envolver(nome, getattr(self, nome)))
+        if migrar:
+            self.preparar_banco()
+
+    # conexão da thread atual (cada operação abre o seu próprio cursor)
+    @property
+    def conn(self):
+        return self.pool.conexao()
+
+    def fechar(self):
+        self.pool.fechar()
+        self._data_version.clear()
+        self._escritas_conexao.clear()
+
+    # commit da conexão atual, contado como escrita deste processo
+    def _confirmar(self):
+        conn = self.conn
+        gravou = conn.in_transaction
+        conn.commit()
+        if gravou:
+            with self._lock_escritas:
+                self._escritas += 1
+                self._escritas_conexao[id(conn)] = self._escritas_conexao.get(id(conn), 0) + 1
+
+    # PRAGMA data_version muda quando qualquer outra conexão grava no banco, inclusive as das outras
+    # threads deste processo. Essas escritas já atualizaram o cache por id; o cache só é descartado
+    # quando a versão mudou sem nenhum commit das outras conexões deste processo (outro terminal)
+    def _validar_cache(self):
+        conn = self.conn
+        with self._lock_escritas:
+            outras = self._escritas - self._escritas_conexao.get(id(conn), 0)
+        versao = conn.execute("PRAGMA data_version").fetchone()[0]
+        anterior = self._data_version.get(id(conn))
+        if anterior is None or (anterior[0] != versao and anterior[1] == outras):
+            self.cache.limpar()
+        self._data_version[id(conn)] = (versao, outras)
 
     def criar_banco_tabela(self):
+        cur = self.conn.cursor()
         # Tabela produtos
-        self.cur.execute("""
+        cur.execute("""
             CREATE TABLE IF NOT EXISTS produtos (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 nome TEXT NOT NULL,
@@ -45,7 +1126,7 @@ class GerenciadorEstoque:
         """)
 
         # Tabela vendas
-        self.cur.execute("""
+        cur.execute("""
             CREATE TABLE IF NOT EXISTS vendas (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 data TEXT DEFAULT (datetime('now','localtime')),
@@ -55,7 +1136,7 @@ class GerenciadorEstoque:
         """)
 
         # Itens da venda
-        self.cur.execute("""
+        cur.execute("""
             CREATE TABLE IF NOT EXISTS venda_itens (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 venda_id INTEGER,
@@ -69,7 +1150,7 @@ class GerenciadorEstoque:
         """)
 
         # Movimentações (adicionar/remover/venta)
-        self.cur.execute("""
+        cur.execute("""
             CREATE TABLE IF NOT EXISTS movimentacoes (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 produto_id INTEGER,
@@ -81,170 +1162,1384 @@ class GerenciadorEstoque:
             )
         """)
 
-        # Popula com alguns produtos iniciais se estiver vazio
-        self.cur.execute("SELECT COUNT(*) FROM produtos")
-        if self.cur.fetchone()[0] == 0:
-            self.cur.executemany("""
-                INSERT INTO produtos (nome, categoria, quantidade, preco, descricao, fornecedor, estoque_minimo)
+        self._confirmar()
+
+    # Popula com alguns produtos iniciais se estiver vazio (depois das migrações: preço em centavos)
+    def popular_exemplos(self):
+        cur = self.conn.cursor()
+        cur.execute("SELECT COUNT(*) FROM produtos")
+        if cur.fetchone()[0] == 0:
+            cur.executemany("""
+                INSERT INTO produtos (nome, categoria, quantidade, preco_centavos, descricao, fornecedor, estoque_minimo)
                 VALUES (?, ?, ?, ?, ?, ?, ?)
             """, [
-                ('Notebook Lenovo', 'Eletrônicos', 15, 3500.00, 'Notebook Lenovo Ideapad 3, 8GB RAM, SSD 256GB', 'TechSupplier Ltda', 5),
-                ('Camiseta Polo', 'Vestuário', 40, 79.90, 'Camiseta polo algodão tamanho M', 'FashionWear', 10),
-                ('Smartphone Samsung A14', 'Eletrônicos', 8, 1200.00, 'Smartphone com 128GB armazenamento', 'MobileTech', 3),
-                ('Cadeira Gamer', 'Móveis', 5, 899.99, 'Cadeira gamer ergonômica preta e vermelha', 'OfficePlus', 2),
-                ('Fone de Ouvido JBL', 'Eletrônicos', 25, 199.90, 'Fone Bluetooth JBL Tune 510BT', 'SoundStore', 5)
+                ('Notebook Lenovo', 'Eletrônicos', 15, 350000, 'Notebook Lenovo Ideapad 3, 8GB RAM, SSD 256GB', 'TechSupplier Ltda', 5),
+                ('Camiseta Polo', 'Vestuário', 40, 7990, 'Camiseta polo algodão tamanho M', 'FashionWear', 10),
+                ('Smartphone Samsung A14', 'Eletrônicos', 8, 120000, 'Smartphone com 128GB armazenamento', 'MobileTech', 3),
+                ('Cadeira Gamer', 'Móveis', 5, 89999, 'Cadeira gamer ergonômica preta e vermelha', 'OfficePlus', 2),
+                ('Fone de Ouvido JBL', 'Eletrônicos', 25, 19990, 'Fone Bluetooth JBL Tune 510BT', 'SoundStore', 5)
             ])
-        self.conn.commit()
+            cur.execute("""
+                INSERT INTO movimentacoes (produto_id, tipo, quantidade, descricao)
+                SELECT id, 'add', quantidade, 'Cadastro inicial: ' || nome FROM produtos
+            """)
+        self._confirmar()
+
+    def versao_schema(self):
+        return self.conn.execute("PRAGMA user_version").fetchone()[0]
+
+    # banco já na versão atual: nada de CREATE/COUNT a cada abertura, só o PRAGMA user_version
+    def precisa_migrar(self):
+        return self.versao_schema() != VERSAO_SCHEMA
+
+    # cria/migra o banco se preciso; devolve se houve migração
+    def preparar_banco(self):
+        if not self.precisa_migrar():
+            return False
+        self.criar_banco_tabela()
+        self.aplicar_migracoes()
+        self.popular_exemplos()
+        return True
+
+    # aplica, em ordem, as migrações ainda não registradas em user_version
+    def aplicar_migracoes(self):
+        aplicadas = []
+        versao = self.versao_schema()
+        for numero, descricao, passos in MIGRACOES:
+            if numero <= versao:
+                continue
+            cur = self.conn.cursor()
+            try:
+                cur.execute("BEGIN")
+                for passo in passos:
+                    if callable(passo):
+                        passo(cur)
+                    else:
+                        cur.execute(passo)
+                cur.execute(f"PRAGMA user_version = {int(numero)}")
+                self._confirmar()
+            except Exception:
+                self.conn.rollback()
+                raise
+            aplicadas.append((numero, descricao))
+        return aplicadas
 
     # cadastrar produto (corrigido para especificar colunas)
+    @repetir_se_ocupado
     def cadastrar_produto(self, produto):
+        cur = self.conn.cursor()
         try:
-            self.cur.execute("""
-                INSERT INTO produtos (nome, categoria, quantidade, preco, descricao, fornecedor, estoque_minimo)
-                VALUES (?, ?, ?, ?, ?, ?, ?)
+            cur.execute("""
+                INSERT INTO produtos (nome, categoria, quantidade, preco_centavos, descricao, fornecedor, estoque_minimo, codigo_barras)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
             """, (
                 produto["nome"], produto.get("categoria"),
-                produto["quantidade"], produto["preco"],
+                produto["quantidade"], _preco_centavos(produto),
                 produto.get("descricao"), produto.get("fornecedor"),
-                produto.get("estoque_minimo", 5)
+                produto.get("estoque_minimo", 5), produto.get("codigo_barras") or None
             ))
-            self.conn.commit()
 
-            # registra movimentação de adição inicial
-            produto_id = self.cur.lastrowid
-            self.registrar_movimentacao(produto_id, 'add', produto["quantidade"], f'Cadastro inicial: {produto["nome"]}')
+            # registra movimentação de adição inicial na mesma transação
+            produto_id = cur.lastrowid
+            self._inserir_movimentacao(cur, produto_id, 'add', produto["quantidade"], f'Cadastro inicial: {produto["nome"]}')
+            self._confirmar()
+            self.cache.invalidar()
             return True
         except sqlite3.IntegrityError:
+            self.conn.rollback()
             return False
 
-    def listar_produtos(self):
-        self.cur.execute("SELECT * FROM produtos ORDER BY nome")
-        return [dict(row) for row in self.cur.fetchall()]
+    # limite: só os primeiros por nome (a primeira tela), lidos pelo índice sem montar o catálogo
+    def listar_produtos(self, limite=None):
+        self._validar_cache()
+        produtos = self.cache.lista(limite)
+        if produtos is not None:
+            return produtos
+        geracao = self.cache.geracao
+        cur = self.conn.cursor()
+        if limite is not None:
+            cur.execute("SELECT * FROM produtos ORDER BY nome, id LIMIT ?", (int(limite),))
+            produtos = [dict(row) for row in cur.fetchall()]
+            self.cache.colocar(produtos, geracao)
+            return produtos
+        cur.execute("SELECT * FROM produtos ORDER BY nome, id")
+        produtos = [dict(row) for row in cur.fetchall()]
+        self.cache.guardar_lista(produtos, geracao)
+        return produtos
 
     def obter_produto(self, produto_id):
-        self.cur.execute("SELECT * FROM produtos WHERE id=?", (produto_id,))
-        row = self.cur.fetchone()
-        return dict(row) if row else None
-
+        produtos = self.obter_produtos([produto_id])
+        return produtos[0] if produtos else None
+
+    # busca vários produtos de uma vez: o que está no cache não vai ao banco
+    def obter_produtos(self, ids):
+        self._validar_cache()
+        produtos, faltando = [], []
+        for pid in ids:
+            p = self.cache.obter(int(pid))
+            if p is None:
+                faltando.append(int(pid))
+            else:
+                produtos.append(p)
+        if faltando:
+            geracao = self.cache.geracao
+            cur = self.conn.cursor()
+            cur.execute(f"SELECT * FROM produtos WHERE id IN ({','.join('?' * len(faltando))})", faltando)
+            lidos = [dict(row) for row in cur.fetchall()]
+            self.cache.colocar(lidos, geracao)
+            produtos += lidos
+        return produtos
+
+    def obter_produto_por_codigo(self, codigo):
+        self._validar_cache()
+        geracao = self.cache.geracao
+        cur = self.conn.cursor()
+        cur.execute("SELECT * FROM produtos WHERE codigo_barras = ?", (str(codigo).strip(),))
+        row = cur.fetchone()
+        if row is None:
+            return None
+        produto = dict(row)
+        self.cache.colocar([produto], geracao)
+        return produto
+
+    # busca textual em nome/categoria/descrição/fornecedor: cada palavra casa como prefixo
+    # ("note len" acha "Notebook Lenovo"), sem diferenciar acentos; mais relevantes primeiro,
+    # com peso maior para o nome
+    def buscar_produtos(self, query, limite=50):
+        termos = re.findall(r"\w+", query or "")
+        if not termos:
+            return []
+        cur = self.conn.cursor()
+        try:
+            cur.execute("""
+                SELECT p.* FROM produtos_fts f JOIN produtos p ON p.id = f.rowid
+                WHERE produtos_fts MATCH ? ORDER BY bm25(produtos_fts, 10.0, 2.0, 1.0, 2.0) LIMIT ?
+            """, (" ".join(f'"{t}"*' for t in termos), limite))
+        except sqlite3.OperationalError as e:
+            if "produtos_fts" not in str(e):
+                raise
+            # banco sem índice FTS: LIKE por palavra (sem ignorar acentos)
+            where = " AND ".join(
+                "(" + " OR ".join(f"{c} LIKE ?" for c in COLUNAS_BUSCA) + ")" for _ in termos)
+            params = [f"%{t}%" for t in termos for _ in COLUNAS_BUSCA]
+            cur.execute(f"SELECT * FROM produtos WHERE {where} ORDER BY nome LIMIT ?", params + [limite])
+        return [dict(row) for row in cur.fetchall()]
+
+    @repetir_se_ocupado
     def atualizar_estoque(self, id, nova_qtd):
-        self.cur.execute("SELECT quantidade FROM produtos WHERE id=?", (id,))
-        res = self.cur.fetchone()
-        if not res:
+        cur = self.conn.cursor()
+        cur.execute("UPDATE produtos SET quantidade = ? WHERE id = ?", (int(nova_qtd), id))
+        if cur.rowcount == 0:
+            self.conn.rollback()
             return False
-        self.cur.execute("UPDATE produtos SET quantidade = ? WHERE id = ?", (int(nova_qtd), id))
-        self.conn.commit()
         # registra movimentação (tipo 'set' com descrição)
-        self.registrar_movimentacao(id, 'set', int(nova_qtd), f'Atualização direta para {nova_qtd}')
+        self._inserir_movimentacao(cur, id, 'set', int(nova_qtd), f'Atualização direta para {nova_qtd}')
+        self._confirmar()
+        self.cache.invalidar([id])
         return True
 
+    @repetir_se_ocupado
     def remover_estoque(self, id, qtd):
-        self.cur.execute("SELECT quantidade FROM produtos WHERE id=?", (id,))
-        res = self.cur.fetchone()
-        if res and res[0] >= qtd:
-            self.cur.execute("UPDATE produtos SET quantidade = quantidade - ? WHERE id=?", (qtd, id))
-            self.conn.commit()
-            self.registrar_movimentacao(id, 'remove', qtd, 'Remoção manual')
-            return True
-        return False
+        cur = self.conn.cursor()
+        cur.execute("UPDATE produtos SET quantidade = quantidade - ? WHERE id=? AND quantidade >= ?", (qtd, id, qtd))
+        if cur.rowcount == 0:
+            self.conn.rollback()
+            return False
+        self._inserir_movimentacao(cur, id, 'remove', qtd, 'Remoção manual')
+        self._confirmar()
+        self.cache.invalidar([id])
+        return True
 
+    @repetir_se_ocupado
     def adicionar_estoque(self, id, qtd):
-        self.cur.execute("UPDATE produtos SET quantidade = quantidade + ? WHERE id=?", (qtd, id))
-        self.conn.commit()
-        if self.cur.rowcount > 0:
-            self.registrar_movimentacao(id, 'add', qtd, 'Adição manual')
-            return True
-        return False
+        cur = self.conn.cursor()
+        cur.execute("UPDATE produtos SET quantidade = quantidade + ? WHERE id=?", (qtd, id))
+        if cur.rowcount == 0:
+            self.conn.rollback()
+            return False
+        self._inserir_movimentacao(cur, id, 'add', qtd, 'Adição manual')
+        self._confirmar()
+        self.cache.invalidar([id])
+        return True
+
+    # aplica vários ajustes [(produto_id, tipo 'add'|'remove'|'set', quantidade), ...] numa única
+    # transação; cada ajuste tem seu resultado (um 'remove' sem saldo não derruba os outros)
+    @repetir_se_ocupado
+    def aplicar_ajustes(self, ajustes, descricao=None):
+        sql = {
+            'add': ("UPDATE produtos SET quantidade = quantidade + ? WHERE id=?", 'Adição manual'),
+            'remove': ("UPDATE produtos SET quantidade = quantidade - ? WHERE id=? AND quantidade >= ?", 'Remoção manual'),
+            'set': ("UPDATE produtos SET quantidade = ? WHERE id=?", 'Atualização direta'),
+        }
+        cur = self.conn.cursor()
+        resultados, movs, alterados = [], [], set()
+        try:
+            for produto_id, tipo, qtd in ajustes:
+                if tipo not in sql:
+                    raise ValueError(f"Tipo de ajuste inválido: {tipo}")
+                update, padrao = sql[tipo]
+                qtd = int(qtd)
+                params = (qtd, produto_id, qtd) if tipo == 'remove' else (qtd, produto_id)
+                cur.execute(update, params)
+                ok = cur.rowcount > 0
+                resultados.append(ok)
+                if ok:
+                    movs.append((produto_id, tipo, qtd, descricao or padrao))
+                    alterados.add(produto_id)
+            cur.executemany("""
+                INSERT INTO movimentacoes (produto_id, tipo, quantidade, descricao)
+                VALUES (?, ?, ?, ?)
+            """, movs)
+            self._confirmar()
+        except Exception:
+            self.conn.rollback()
+            raise
+        finally:
+            self.cache.invalidar(alterados)
+        return resultados
+
+    # concilia uma contagem física [{id ou codigo_barras, contado}, ...] com o estoque do sistema.
+    # A contagem vai para uma tabela temporária e as diferenças saem de uma única consulta; com
+    # aplicar, as quantidades e as movimentações ('set') de todos os divergentes são gravadas numa
+    # só transação, senão nada é gravado (conferência). Produto em mais de uma linha (contado em
+    # dois lugares) soma as contagens. Devolve o relatório de divergências
+    @repetir_se_ocupado
+    def conciliar_inventario(self, contagens, aplicar=True, descricao="Inventário"):
+        inicio = time.perf_counter()
+        cur = self.conn.cursor()
+        # BEGIN IMMEDIATE: o estoque não muda entre o cálculo das diferenças e a gravação
+        cur.execute("BEGIN IMMEDIATE")
+        try:
+            cur.execute("""CREATE TEMP TABLE IF NOT EXISTS contagem_inventario (
+                produto_id INTEGER, codigo_barras TEXT, contado INTEGER NOT NULL)""")
+            cur.execute("DELETE FROM temp.contagem_inventario")
+            cur.executemany("INSERT INTO temp.contagem_inventario VALUES (?, ?, ?)",
+                            ((c["id"], c["codigo_barras"], c["contado"]) for c in contagens))
+            cur.execute("""
+                UPDATE temp.contagem_inventario SET produto_id = (
+                    SELECT id FROM produtos WHERE codigo_barras = contagem_inventario.codigo_barras)
+                WHERE produto_id IS NULL
+            """)
+            cur.execute("""
+                SELECT COALESCE(c.codigo_barras, c.produto_id) FROM temp.contagem_inventario c
+                WHERE c.produto_id IS NULL OR NOT EXISTS (SELECT 1 FROM produtos p WHERE p.id = c.produto_id)
+            """)
+            nao_encontrados = [str(r[0]) for r in cur.fetchall()]
+            cur.execute("""
+                SELECT p.id AS produto_id, p.nome, p.codigo_barras, p.quantidade AS sistema, c.contado,
+                       c.contado - p.quantidade AS diferenca, (c.contado - p.quantidade) * p.preco_centavos AS valor_centavos
+                FROM (SELECT produto_id, SUM(contado) AS contado FROM temp.contagem_inventario
+                      WHERE produto_id IS NOT NULL GROUP BY produto_id) c
+                JOIN produtos p ON p.id = c.produto_id
+            """)
+            conferidos = [dict(r) for r in cur.fetchall()]
+            divergencias = [d for d in conferidos if d["diferenca"]]
+            if aplicar and divergencias:
+                cur.executemany("UPDATE produtos SET quantidade = ? WHERE id = ?",
+                                ((d["contado"], d["produto_id"]) for d in divergencias))
+                cur.executemany("""
+                    INSERT INTO movimentacoes (produto_id, tipo, quantidade, descricao)
+                    VALUES (?, 'set', ?, ?)
+                """, ((d["produto_id"], d["contado"], f"{descricao}: {d['sistema']} -> {d['contado']}")
+                      for d in divergencias))
+                self._confirmar()
+            else:
+                self.conn.rollback()
+        except Exception:
+            self.conn.rollback()
+            raise
+        if aplicar:
+            self.cache.invalidar([d["produto_id"] for d in divergencias])
+        divergencias.sort(key=lambda d: (-abs(d["valor_centavos"]), d["produto_id"]))
+        return {
+            "aplicado": bool(aplicar),
+            "conferidos": len(conferidos),
+            "iguais": len(conferidos) - len(divergencias),
+            "divergencias": divergencias,
+            "sobras": sum(d["diferenca"] for d in divergencias if d["diferenca"] > 0),
+            "faltas": -sum(d["diferenca"] for d in divergencias if d["diferenca"] < 0),
+            "valor_sobras_centavos": sum(d["valor_centavos"] for d in divergencias if d["valor_centavos"] > 0),
+            "valor_faltas_centavos": -sum(d["valor_centavos"] for d in divergencias if d["valor_centavos"] < 0),
+            "nao_encontrados": nao_encontrados,
+            "segundos": time.perf_counter() - inicio,
+        }
 
     # registra movimentação no histórico
+    @repetir_se_ocupado
     def registrar_movimentacao(self, produto_id, tipo, quantidade, descricao=None):
-        self.cur.execute("""
+        self._inserir_movimentacao(self.conn.cursor(), produto_id, tipo, quantidade, descricao)
+        self._confirmar()
+
+    # insere a movimentação sem commit, para compor a transação de quem chama
+    def _inserir_movimentacao(self, cur, produto_id, tipo, quantidade, descricao=None):
+        cur.execute("""
             INSERT INTO movimentacoes (produto_id, tipo, quantidade, descricao)
             VALUES (?, ?, ?, ?)
         """, (produto_id, tipo, quantidade, descricao))
-        self.conn.commit()
 
-    # registrar venda: items = [ {produto_id, quantidade, desconto_item (opcional)} ], desconto_total (opcional)
-    def registrar_venda(self, items, desconto_total=0.0):
-        # validar estoque
+    # registrar venda: items = [ {produto_id, quantidade, desconto_item_centavos (opcional)} ],
+    # desconto_total_centavos (opcional); devolve (venda_id, total_centavos)
+    # tudo em uma única transação: uma consulta para os produtos do carrinho, inserts em lote
+    # e baixa condicional de estoque (quantidade >= ?), com um único commit no final.
+    # chave: identificador único gerado no caixa; se a venda com essa chave já existe, devolve a
+    # existente sem gravar de novo. permitir_negativo registra mesmo sem saldo (venda já feita
+    # offline) e data informa quando a venda aconteceu
+    @repetir_se_ocupado
+    def registrar_venda(self, items, desconto_total_centavos=0, chave=None, permitir_negativo=False, data=None):
+        linhas = []
+        pedido = {}  # produto_id -> quantidade total no carrinho
         for it in items:
             pid = int(it["produto_id"])
             qtd = int(it["quantidade"])
-            self.cur.execute("SELECT quantidade, preco FROM produtos WHERE id=?", (pid,))
-            row = self.cur.fetchone()
+            if qtd <= 0:
+                raise ValueError(f"Quantidade inválida para produto {pid}")
+            linhas.append((pid, qtd, desconto_do_item(it)))
+            pedido[pid] = pedido.get(pid, 0) + qtd
+        if not linhas:
+            raise ValueError("Venda sem itens")
+
+        if chave is not None:
+            existente = self._venda_por_chave(chave)
+            if existente is not None:
+                return existente
+
+        # busca todos os produtos do carrinho de uma vez (o cache evita ir ao banco);
+        # a baixa condicional abaixo é que garante o estoque de verdade
+        produtos = {p["id"]: p for p in self.obter_produtos(pedido)}
+        cur = self.conn.cursor()
+
+        # validar estoque
+        for pid, qtd in pedido.items():
+            row = produtos.get(pid)
             if not row:
                 raise ValueError(f"Produto {pid} não encontrado")
-            if row["quantidade"] < qtd:
-                raise ValueError(f"Estoque insuficiente para produto {pid} ({row['quantidade']} disponível)")
-
-        # calcula total
-        total_bruto = 0.0
-        for it in items:
-            pid = int(it["produto_id"])
-            qtd = int(it["quantidade"])
-            self.cur.execute("SELECT preco FROM produtos WHERE id=?", (pid,))
-            preco = float(self.cur.fetchone()["preco"])
-            desconto_item = float(it.get("desconto_item", 0.0))
-            total_bruto += (preco * qtd) - desconto_item
+            if row["quantidade"] < qtd and not permitir_negativo:
+                raise EstoqueInsuficiente(f"Estoque insuficiente para produto {pid} ({row['quantidade']} disponível)")
 
-        total_final = total_bruto - float(desconto_total)
+        # calcula total pelo motor de preços, com o preço atual de cada produto
+        precos = [produtos[pid]["preco_centavos"] for pid, _, _ in linhas]
+        totais = calcular_totais(precos, [qtd for _, qtd, _ in linhas], [d for _, _, d in linhas],
+                                 int(desconto_total_centavos))
 
-        # cria venda
-        self.cur.execute("INSERT INTO vendas (total, desconto) VALUES (?, ?)", (total_final, desconto_total))
-        venda_id = self.cur.lastrowid
+        try:
+            # cria venda
+            cur.execute("""
+                INSERT INTO vendas (total_centavos, desconto_centavos, chave, data)
+                VALUES (?, ?, ?, COALESCE(?, datetime('now','localtime')))
+            """, (totais["total"], totais["desconto"], chave, data))
+            venda_id = cur.lastrowid
+
+            # reduzir estoque somente se ainda houver saldo (outro terminal pode ter vendido antes)
+            cur.executemany(
+                "UPDATE produtos SET quantidade = quantidade - ? WHERE id = ? AND (quantidade >= ? OR ?)",
+                [(qtd, pid, qtd, permitir_negativo) for pid, qtd in pedido.items()]
+            )
+            if cur.rowcount != len(pedido):
+                raise EstoqueInsuficiente("Estoque insuficiente: o estoque foi alterado durante a venda")
 
-        # inserir itens, reduzir estoque, movimentar
-        for it in items:
-            pid = int(it["produto_id"])
-            qtd = int(it["quantidade"])
-            self.cur.execute("SELECT preco FROM produtos WHERE id=?", (pid,))
-            preco = float(self.cur.fetchone()["preco"])
-            desconto_item = float(it.get("desconto_item", 0.0))
-            self.cur.execute("""
-                INSERT INTO venda_itens (venda_id, produto_id, quantidade, preco_unit, desconto_item)
+            # inserir itens e movimentações tipo 'sale'
+            cur.executemany("""
+                INSERT INTO venda_itens (venda_id, produto_id, quantidade, preco_unit_centavos, desconto_item_centavos)
                 VALUES (?, ?, ?, ?, ?)
-            """, (venda_id, pid, qtd, preco, desconto_item))
-            # reduzir estoque
-            self.cur.execute("UPDATE produtos SET quantidade = quantidade - ? WHERE id=?", (qtd, pid))
-            # registrar movimentação tipo 'sale'
-            self.registrar_movimentacao(pid, 'sale', qtd, f'Venda #{venda_id}')
-
-        self.conn.commit()
-        return venda_id, total_final
+            """, [(venda_id, pid, qtd, preco, desconto_item) for (pid, qtd, desconto_item), preco in zip(linhas, precos)])
+            # a movimentação leva a data da venda: uma venda offline sincronizada depois entra no
+            # histórico e no estoque_em no momento em que aconteceu, como nos resumos de vendas
+            cur.executemany("""
+                INSERT INTO movimentacoes (produto_id, tipo, quantidade, descricao, data)
+                SELECT ?, 'sale', ?, ?, data FROM vendas WHERE id = ?
+            """, [(pid, qtd, f'Venda #{venda_id}', venda_id) for pid, qtd, _ in linhas])
+
+            self._confirmar()
+        except sqlite3.IntegrityError:
+            self.conn.rollback()
+            self.cache.invalidar(pedido)
+            # outro terminal gravou a mesma chave entre a consulta e o insert
+            existente = self._venda_por_chave(chave) if chave is not None else None
+            if existente is None:
+                raise
+            return existente
+        except Exception:
+            self.conn.rollback()
+            self.cache.invalidar(pedido)
+            raise
+        self.cache.invalidar(pedido)
+        return venda_id, totais["total"]
+
+    def _venda_por_chave(self, chave):
+        row = self.conn.execute("SELECT id, total_centavos FROM vendas WHERE chave = ?", (chave,)).fetchone()
+        return (row["id"], row["total_centavos"]) if row else None
+
+    # importa produtos de CSV/JSONL em lotes (uma transação por lote, inserts/updates com executemany).
+    # produtos são casados pelo id, se informado, senão pelo nome; novos geram movimentação 'add'
+    # e os existentes com quantidade diferente geram 'set'
+    def importar_produtos(self, caminho, tamanho_lote=1000, ao_progresso=None):
+        inicio = time.perf_counter()
+        resumo = {"linhas": 0, "inseridos": 0, "atualizados": 0, "erros": []}
+        lote = []
+        for numero, registro in enumerate(ler_registros(caminho), start=1):
+            resumo["linhas"] += 1
+            try:
+                lote.append((numero, validar_produto(registro)))
+            except (ValueError, TypeError) as e:
+                resumo["erros"].append((numero, str(e)))
+                continue
+            if len(lote) >= tamanho_lote:
+                self._importar_lote(lote, resumo)
+                lote = []
+                if ao_progresso:
+                    ao_progresso(resumo)
+        if lote:
+            self._importar_lote(lote, resumo)
+        resumo["erros"].sort()
+        resumo["segundos"] = time.perf_counter() - inicio
+        resumo["linhas_por_segundo"] = resumo["linhas"] / resumo["segundos"] if resumo["segundos"] else 0.0
+        return resumo
+
+    @repetir_se_ocupado
+    def _importar_lote(self, lote, resumo):
+        cur = self.conn.cursor()
+        # BEGIN IMMEDIATE: ninguém grava entre a leitura dos existentes e os inserts deste lote
+        cur.execute("BEGIN IMMEDIATE")
+        try:
+            ids = [p["id"] for _, p in lote if p["id"]]
+            nomes = list({p["nome"] for _, p in lote if not p["id"]})
+            codigos = list({p["codigo_barras"] for _, p in lote if p["codigo_barras"]})
+            por_id, por_nome, donos_codigo = {}, {}, {}
+            if ids:
+                cur.execute(f"SELECT id, nome, quantidade FROM produtos WHERE id IN ({','.join('?' * len(ids))})", ids)
+                por_id = {r["id"]: r for r in cur.fetchall()}
+            if nomes:
+                cur.execute(f"SELECT id, nome, quantidade FROM produtos WHERE nome IN ({','.join('?' * len(nomes))})", nomes)
+                por_nome = {r["nome"]: r for r in cur.fetchall()}
+            if codigos:
+                cur.execute(f"SELECT id, codigo_barras FROM produtos WHERE codigo_barras IN ({','.join('?' * len(codigos))})",
+                            codigos)
+                donos_codigo = {r["codigo_barras"]: ("id", r["id"]) for r in cur.fetchall()}
+
+            novos_com_id, novos, atualizar, movs, erros = {}, {}, [], [], []
+            for numero, p in lote:
+                existente = por_id.get(p["id"]) if p["id"] else por_nome.get(p["nome"])
+                # código de barras é único: a linha cujo código já é de outro produto (no banco ou
+                # numa linha anterior do lote) vira erro, sem derrubar o lote
+                if p["codigo_barras"]:
+                    destino = ("id", existente["id"] if existente is not None else p["id"]) \
+                        if existente is not None or p["id"] else ("nome", p["nome"])
+                    dono = donos_codigo.setdefault(p["codigo_barras"], destino)
+                    if dono != destino:
+                        erros.append((numero, f"código de barras {p['codigo_barras']} já pertence a outro produto"))
+                        continue
+                if existente is not None:
+                    atualizar.append((p["nome"], p["categoria"], p["quantidade"], p["preco_centavos"], p["descricao"],
+                                      p["fornecedor"], p["estoque_minimo"], p["codigo_barras"], existente["id"]))
+                    if p["quantidade"] is not None and existente["quantidade"] != p["quantidade"]:
+                        movs.append((existente["id"], 'set', p["quantidade"], 'Importação de catálogo'))
+                    continue
+                campos = (p["nome"], p["categoria"], p["quantidade"] or 0, p["preco_centavos"], p["descricao"], p["fornecedor"],
+                          5 if p["estoque_minimo"] is None else p["estoque_minimo"], p["codigo_barras"])
+                if p["id"]:
+                    novos_com_id[p["id"]] = (p["id"],) + campos
+                else:
+                    novos[p["nome"]] = campos  # nome repetido no mesmo lote: vale o último
+
+            cur.executemany("""
+                UPDATE produtos SET nome=?, categoria=COALESCE(?, categoria), quantidade=COALESCE(?, quantidade), preco_centavos=?,
+                    descricao=COALESCE(?, descricao), fornecedor=COALESCE(?, fornecedor),
+                    estoque_minimo=COALESCE(?, estoque_minimo), codigo_barras=COALESCE(?, codigo_barras)
+                WHERE id=?
+            """, atualizar)
+            cur.executemany("""
+                INSERT INTO produtos (id, nome, categoria, quantidade, preco_centavos, descricao, fornecedor, estoque_minimo, codigo_barras)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, novos_com_id.values())
+            movs += [(c[0], 'add', c[3], f'Cadastro inicial: {c[1]}') for c in novos_com_id.values()]
+            cur.executemany("""
+                INSERT INTO movimentacoes (produto_id, tipo, quantidade, descricao)
+                VALUES (?, ?, ?, ?)
+            """, movs)
+
+            # os novos sem id recebem ids acima do maior atual; a movimentação inicial sai de um INSERT ... SELECT
+            cur.execute("SELECT COALESCE(MAX(id), 0) FROM produtos")
+            ultimo_id = cur.fetchone()[0]
+            cur.executemany("""
+                INSERT INTO produtos (nome, categoria, quantidade, preco_centavos, descricao, fornecedor, estoque_minimo, codigo_barras)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            """, novos.values())
+            cur.execute("""
+                INSERT INTO movimentacoes (produto_id, tipo, quantidade, descricao)
+                SELECT id, 'add', quantidade, 'Cadastro inicial: ' || nome FROM produtos WHERE id > ?
+            """, (ultimo_id,))
+            self._confirmar()
+        except Exception:
+            self.conn.rollback()
+            raise
+        self.cache.invalidar([row[-1] for row in atualizar])
+        resumo["erros"] += erros
+        resumo["inseridos"] += len(novos) + len(novos_com_id)
+        resumo["atualizados"] += len(atualizar)
+
+    # exporta uma tabela/relatório direto do cursor, em blocos de fetchmany (memória constante,
+    # qualquer que seja o tamanho), para CSV/JSONL, .gz ou colunar; data_inicio/data_fim filtram
+    # as que têm data. As movimentações incluem as do banco de arquivo
+    def exportar_tabela(self, tabela, caminho, tamanho_lote=5000, data_inicio=None, data_fim=None, ao_progresso=None):
+        if tabela not in TABELAS_EXPORTAVEIS:
+            raise ValueError(f"Tabela não exportável: {tabela}")
+        consulta, coluna_data, ordem = TABELAS_EXPORTAVEIS[tabela]
+        formato_arquivo(caminho)  # formato inválido falha antes da consulta
+        if coluna_data is None and (data_inicio or data_fim):
+            raise ValueError(f"{tabela} não tem período")
+        where, params = self._filtro_periodo(coluna_data, data_inicio, data_fim) if coluna_data else ("", [])
+        anexar = "{movimentacoes}" in consulta and os.path.exists(self.caminho_arquivo)
+        if anexar:
+            self._anexar_arquivo()
+        try:
+            cur = self.conn.cursor()
+            cur.execute(consulta.format(movimentacoes=MOVIMENTACOES_COM_ARQUIVO if anexar else "movimentacoes")
+                        + f" {where} ORDER BY {ordem}", params)
+
+            def blocos():
+                while True:
+                    linhas = cur.fetchmany(tamanho_lote)
+                    if not linhas:
+                        return
+                    yield linhas
+            return gravar_registros(caminho, [d[0] for d in cur.description], blocos(), ao_progresso)
+        finally:
+            if anexar:
+                cur.close()
+                self._desanexar_arquivo()
+
+    # recalcula os resumos a partir de vendas/venda_itens (para corrigir ou após carga externa)
+    @repetir_se_ocupado
+    def reconstruir_resumos(self):
+        cur = self.conn.cursor()
+        try:
+            cur.execute("BEGIN IMMEDIATE")
+            for sql in SQL_RECONSTRUIR_RESUMOS:
+                cur.execute(sql)
+            self._confirmar()
+        except Exception:
+            self.conn.rollback()
+            raise
+        cur.execute("SELECT COUNT(*) FROM resumo_vendas_dia")
+        return cur.fetchone()[0]
 
     # Relatórios
-    def relatorio_vendas(self):
-        self.cur.execute("SELECT * FROM vendas ORDER BY data DESC")
-        vendas = [dict(r) for r in self.cur.fetchall()]
-        # pegar itens de cada venda
-        for v in vendas:
-            self.cur.execute("SELECT vi.*, p.nome FROM venda_itens vi JOIN produtos p ON vi.produto_id = p.id WHERE vi.venda_id=?", (v["id"],))
-            v["itens"] = [dict(i) for i in self.cur.fetchall()]
-        return vendas
+    # filtro de período (datas 'AAAA-MM-DD', inclusivas) aplicado sobre vendas.data
+    def _filtro_periodo(self, coluna, data_inicio=None, data_fim=None):
+        condicoes, params = [], []
+        if data_inicio:
+            condicoes.append(f"{coluna} >= ?")
+            params.append(str(data_inicio))
+        if data_fim:
+            condicoes.append(f"{coluna} < date(?, '+1 day')")
+            params.append(str(data_fim))
+        where = ("WHERE " + " AND ".join(condicoes)) if condicoes else ""
+        return where, params
+
+    # gerador: vendas com seus itens em uma única consulta ordenada (sem N+1),
+    # com filtro de período e paginação (limite/offset) sobre as vendas
+    def relatorio_vendas(self, data_inicio=None, data_fim=None, limite=None, offset=0, com_itens=True):
+        where, params = self._filtro_periodo("data", data_inicio, data_fim)
+        pagina = ""
+        if limite is not None:
+            pagina = "LIMIT ? OFFSET ?"
+            params += [int(limite), int(offset)]
+        elif offset:
+            pagina = "LIMIT -1 OFFSET ?"
+            params.append(int(offset))
+        vendas_sql = f"SELECT * FROM vendas {where} ORDER BY data DESC, id DESC {pagina}"
+
+        cur = self.conn.cursor()
+        if not com_itens:
+            cur.execute(vendas_sql, params)
+            for r in cur:
+                yield dict(r)
+            return
+
+        cur.execute(f"""
+            SELECT v.id, v.data, v.total_centavos, v.desconto_centavos,
+                   vi.id AS item_id, vi.produto_id, vi.quantidade, vi.preco_unit_centavos, vi.desconto_item_centavos, p.nome
+            FROM ({vendas_sql}) v
+            LEFT JOIN venda_itens vi ON vi.venda_id = v.id
+            LEFT JOIN produtos p ON vi.produto_id = p.id
+            ORDER BY v.data DESC, v.id DESC, vi.id
+        """, params)
+        venda = None
+        for r in cur:
+            if venda is None or venda["id"] != r["id"]:
+                if venda is not None:
+                    yield venda
+                venda = {"id": r["id"], "data": r["data"], "total_centavos": r["total_centavos"],
+                         "desconto_centavos": r["desconto_centavos"], "itens": []}
+            if r["item_id"] is not None:
+                venda["itens"].append({
+                    "id": r["item_id"], "venda_id": r["id"], "produto_id": r["produto_id"],
+                    "quantidade": r["quantidade"], "preco_unit_centavos": r["preco_unit_centavos"],
+                    "desconto_item_centavos": r["desconto_item_centavos"], "nome": r["nome"]
+                })
+        if venda is not None:
+            yield venda
+
+    # relatórios sobre os resumos: custo proporcional ao número de dias, não de itens vendidos
+    def vendas_por_dia(self, data_inicio=None, data_fim=None):
+        where, params = self._filtro_periodo("dia", data_inicio, data_fim)
+        cur = self.conn.cursor()
+        cur.execute(f"SELECT * FROM resumo_vendas_dia {where} ORDER BY dia DESC", params)
+        return [dict(r) for r in cur.fetchall()]
+
+    def vendas_por_produto(self, data_inicio=None, data_fim=None, limite=None):
+        where, params = self._filtro_periodo("r.dia", data_inicio, data_fim)
+        pagina = ""
+        if limite is not None:
+            pagina = "LIMIT ?"
+            params.append(int(limite))
+        cur = self.conn.cursor()
+        cur.execute(f"""
+            SELECT r.produto_id, p.nome, p.categoria, SUM(r.quantidade) AS quantidade, SUM(r.receita_centavos) AS receita_centavos
+            FROM resumo_vendas_dia_produto r LEFT JOIN produtos p ON p.id = r.produto_id
+            {where}
+            GROUP BY r.produto_id
+            ORDER BY receita_centavos DESC
+            {pagina}
+        """, params)
+        return [dict(r) for r in cur.fetchall()]
+
+    def vendas_por_categoria(self, data_inicio=None, data_fim=None):
+        where, params = self._filtro_periodo("r.dia", data_inicio, data_fim)
+        cur = self.conn.cursor()
+        cur.execute(f"""
+            SELECT COALESCE(p.categoria, '-') AS categoria, SUM(r.quantidade) AS quantidade, SUM(r.receita_centavos) AS receita_centavos
+            FROM resumo_vendas_dia_produto r LEFT JOIN produtos p ON p.id = r.produto_id
+            {where}
+            GROUP BY COALESCE(p.categoria, '-')
+            ORDER BY receita_centavos DESC
+        """, params)
+        return [dict(r) for r in cur.fetchall()]
+
+    def contar_vendas(self, data_inicio=None, data_fim=None):
+        where, params = self._filtro_periodo("data", data_inicio, data_fim)
+        cur = self.conn.cursor()
+        cur.execute(f"SELECT COUNT(*) FROM vendas {where}", params)
+        return cur.fetchone()[0]
 
     def relatorio_estoque(self):
-        self.cur.execute("SELECT * FROM produtos ORDER BY nome")
-        return [dict(r) for r in self.cur.fetchall()]
-
-    def historico_movimentacoes(self):
-        self.cur.execute("""
-            SELECT m.*, p.nome as produto_nome FROM movimentacoes m
-            LEFT JOIN produtos p ON m.produto_id = p.id
-            ORDER BY m.data DESC
+        cur = self.conn.cursor()
+        cur.execute("SELECT * FROM produtos ORDER BY nome")
+        return [dict(r) for r in cur.fetchall()]
+
+    # produtos no estoque mínimo ou abaixo, a partir da tabela de alertas (sem varrer produtos)
+    def produtos_abaixo_minimo(self):
+        cur = self.conn.cursor()
+        cur.execute("""
+            SELECT p.*, a.id AS alerta_id, a.desde FROM alertas_estoque a
+            JOIN produtos p ON p.id = a.produto_id
+            ORDER BY a.desde, a.id
+        """)
+        return [dict(r) for r in cur.fetchall()]
+
+    # (quantidade de alertas, maior id): o id muda quando um produto cruza o mínimo
+    def situacao_alertas(self):
+        row = self.conn.execute("SELECT COUNT(*), COALESCE(MAX(id), 0) FROM alertas_estoque").fetchone()
+        return row[0], row[1]
+
+    # sugestão de compra por fornecedor para os produtos em alerta: repor até o mínimo e cobrir
+    # cobertura_dias da venda média dos últimos dias_venda (tirada do resumo por dia x produto)
+    def sugestoes_compra(self, dias_venda=30, cobertura_dias=15):
+        if dias_venda < 1 or cobertura_dias < 0:
+            raise ValueError("Dias de venda deve ser pelo menos 1 e a cobertura não pode ser negativa")
+        cur = self.conn.cursor()
+        cur.execute("""
+            SELECT p.id, p.nome, p.fornecedor, p.quantidade, p.estoque_minimo,
+                   COALESCE((SELECT SUM(r.quantidade) FROM resumo_vendas_dia_produto r
+                             WHERE r.produto_id = p.id AND r.dia >= date('now', 'localtime', ?)), 0) AS vendidos
+            FROM alertas_estoque a JOIN produtos p ON p.id = a.produto_id
+            ORDER BY p.fornecedor, p.nome
+        """, (f"-{int(dias_venda)} days",))
+        por_fornecedor = {}
+        for r in cur.fetchall():
+            velocidade = r["vendidos"] / dias_venda
+            sugerido = max(1, r["estoque_minimo"] - r["quantidade"] + 1 + math.ceil(velocidade * cobertura_dias))
+            fornecedor = r["fornecedor"] or "(sem fornecedor)"
+            grupo = por_fornecedor.setdefault(fornecedor, {"fornecedor": fornecedor, "itens": [], "total_unidades": 0})
+            grupo["itens"].append(dict(r, venda_diaria=round(velocidade, 2), sugerido=sugerido))
+            grupo["total_unidades"] += sugerido
+        return list(por_fornecedor.values())
+
+    def itens_venda(self, venda_id):
+        cur = self.conn.cursor()
+        cur.execute("SELECT vi.*, p.nome FROM venda_itens vi JOIN produtos p ON vi.produto_id = p.id WHERE vi.venda_id=?", (venda_id,))
+        return [dict(i) for i in cur.fetchall()]
+
+    # venda com os itens como foram gravados (preço da venda, não o atual), para o recibo
+    def dados_recibo(self, venda_id):
+        cur = self.conn.cursor()
+        cur.execute("SELECT id, data, total_centavos, desconto_centavos FROM vendas WHERE id = ?", (int(venda_id),))
+        venda = cur.fetchone()
+        if venda is None:
+            return None
+        return dict(venda, itens=self.itens_venda(int(venda_id)))
+
+    # histórico com filtros e paginação por chave (keyset): apos=(data, id) da última linha
+    # da página anterior; cada página custa o mesmo, não importa o tamanho do histórico
+    def historico_movimentacoes(self, produto_id=None, produto_nome=None, tipo=None,
+                                data_inicio=None, data_fim=None, apos=None, limite=None):
+        where, params = self._filtro_periodo("m.data", data_inicio, data_fim)
+        condicoes = [where[len("WHERE "):]] if where else []
+        if produto_id is not None:
+            condicoes.append("m.produto_id = ?")
+            params.append(int(produto_id))
+        if produto_nome:
+            condicoes.append("p.nome LIKE ?")
+            params.append(f"%{produto_nome}%")
+        if tipo:
+            condicoes.append("m.tipo = ?")
+            params.append(tipo)
+        if apos is not None:
+            condicoes.append("(m.data, m.id) < (?, ?)")
+            params += [apos[0], int(apos[1])]
+        where = ("WHERE " + " AND ".join(condicoes)) if condicoes else ""
+        pagina = ""
+        if limite is not None:
+            pagina = "LIMIT ?"
+            params.append(int(limite))
+
+        cur = self.conn.cursor()
+        anexar = os.path.exists(self.caminho_arquivo)
+        if anexar:
+            self._anexar_arquivo()
+        try:
+            # o banco de arquivo só entra na consulta se tiver movimentações no período
+            movimentacoes = "movimentacoes"
+            if anexar:
+                periodo, params_periodo = self._filtro_periodo("data", data_inicio, data_fim)
+                cur.execute(f"SELECT EXISTS (SELECT 1 FROM arquivo.movimentacoes {periodo})", params_periodo)
+                if cur.fetchone()[0]:
+                    movimentacoes = MOVIMENTACOES_COM_ARQUIVO
+            cur.execute(f"""
+                SELECT m.*, p.nome as produto_nome FROM {movimentacoes} m
+                LEFT JOIN produtos p ON m.produto_id = p.id
+                {where}
+                ORDER BY m.data DESC, m.id DESC
+                {pagina}
+            """, params)
+            return [dict(r) for r in cur.fetchall()]
+        finally:
+            if anexar:
+                cur.close()
+                self._desanexar_arquivo()
+
+    # grava a quantidade atual de todos os produtos como retrato
+    @repetir_se_ocupado
+    def criar_retrato(self):
+        cur = self.conn.cursor()
+        cur.execute("BEGIN IMMEDIATE")
+        try:
+            cur.execute("""
+                INSERT INTO estoque_retratos (data, ate_movimentacao)
+                SELECT datetime('now','localtime'), COALESCE(MAX(id), 0) FROM movimentacoes
+            """)
+            retrato_id = cur.lastrowid
+            cur.execute("""
+                INSERT INTO estoque_retrato_itens (retrato_id, produto_id, quantidade)
+                SELECT ?, id, quantidade FROM produtos
+            """, (retrato_id,))
+            self._confirmar()
+        except Exception:
+            self.conn.rollback()
+            raise
+        return retrato_id
+
+    # retrato periódico: só grava se o último tiver mais de intervalo_horas
+    def criar_retrato_se_necessario(self, intervalo_horas=24):
+        recente = self.conn.execute(
+            "SELECT MAX(data) > datetime('now','localtime', ?) FROM estoque_retratos",
+            (f"-{int(intervalo_horas)} hours",)).fetchone()[0]
+        return None if recente else self.criar_retrato()
+
+    # estoque num momento passado ({produto_id: quantidade}, ou só a quantidade de produto_id).
+    # data 'AAAA-MM-DD' vale até o fim do dia. Parte do último retrato até a data e soma só as
+    # movimentações posteriores; antes do retrato mais antigo do banco, usa também o arquivo.
+    # Antes de qualquer retrato levanta EstoqueDesconhecido
+    def estoque_em(self, data, produto_id=None):
+        condicao, params = self._ate("data", data)
+        cur = self.conn.cursor()
+        retrato = self._ultimo_retrato(cur, "estoque_retratos", condicao, params)
+        if retrato is not None or not os.path.exists(self.caminho_arquivo):
+            if retrato is None:
+                raise EstoqueDesconhecido(f"Sem retrato do estoque até {data}: estoque anterior ao primeiro retrato")
+            estoque = self._aplicar_movimentacoes(cur, retrato, condicao, params, produto_id)
+        else:
+            self._anexar_arquivo()
+            try:
+                retrato = self._ultimo_retrato(cur, "arquivo.estoque_retratos", condicao, params)
+                if retrato is None:
+                    raise EstoqueDesconhecido(f"Sem retrato do estoque até {data}: estoque anterior ao primeiro retrato")
+                estoque = self._aplicar_movimentacoes(
+                    cur, retrato, condicao, params, produto_id,
+                    movimentacoes="""(SELECT id, produto_id, tipo, quantidade, data FROM arquivo.movimentacoes
+                                     UNION ALL
+                                     SELECT id, produto_id, tipo, quantidade, data FROM main.movimentacoes)""",
+                    itens="arquivo.estoque_retrato_itens")
+            finally:
+                self._desanexar_arquivo()
+        if produto_id is not None:
+            return estoque.get(int(produto_id), 0)
+        return estoque
+
+    # mesmo critério de data dos relatórios: 'AAAA-MM-DD' inclui o dia inteiro
+    @staticmethod
+    def _ate(coluna, data):
+        if len(data) == 10:
+            return f"{coluna} < date(?, '+1 day')", [data]
+        return f"{coluna} <= ?", [data]
+
+    def _ultimo_retrato(self, cur, tabela, condicao, params):
+        cur.execute(f"SELECT id, ate_movimentacao FROM {tabela} WHERE {condicao} ORDER BY data DESC, id DESC LIMIT 1",
+                    params)
+        return cur.fetchone()
+
+    # quantidades do retrato mais as movimentações de id maior que atendem a
+    # condição; um 'set' fixa o valor e, depois dele, só contam as movimentações seguintes
+    def _aplicar_movimentacoes(self, cur, retrato, condicao, params, produto_id=None,
+                               movimentacoes="movimentacoes", itens="estoque_retrato_itens"):
+        filtro, params_filtro = "", []
+        if produto_id is not None:
+            filtro, params_filtro = " AND produto_id = ?", [int(produto_id)]
+        estoque, ate = {}, 0
+        if retrato is not None:
+            cur.execute(f"SELECT produto_id, quantidade FROM {itens} WHERE retrato_id = ?{filtro}",
+                        [retrato["id"]] + params_filtro)
+            estoque = {pid: qtd for pid, qtd in cur.fetchall()}
+            ate = retrato["ate_movimentacao"]
+        cur.execute(f"""
+            WITH delta AS (
+                SELECT id, produto_id, tipo, quantidade FROM {movimentacoes}
+                WHERE id > ? AND {condicao}{filtro}
+            ), ultimo_set AS (
+                SELECT produto_id, MAX(id) AS set_id FROM delta WHERE tipo = 'set' GROUP BY produto_id
+            )
+            SELECT d.produto_id,
+                   MAX(CASE WHEN d.id = u.set_id THEN d.quantidade END) AS valor_set,
+                   SUM(CASE WHEN d.id <= COALESCE(u.set_id, 0) THEN 0
+                            WHEN d.tipo = 'add' THEN d.quantidade
+                            WHEN d.tipo IN ('remove', 'sale') THEN -d.quantidade
+                            ELSE 0 END) AS variacao
+            FROM delta d LEFT JOIN ultimo_set u ON u.produto_id = d.produto_id
+            GROUP BY d.produto_id
+        """, [ate] + params + params_filtro)
+        for pid, valor_set, variacao in cur.fetchall():
+            estoque[pid] = (estoque.get(pid, 0) if valor_set is None else valor_set) + variacao
+        return estoque
+
+    # move para o banco de arquivo as movimentações anteriores a antes_de e os retratos que elas
+    # já cobrem. Antes grava o retrato exato do corte, para que estoque_em de datas posteriores
+    # continue sendo respondido só pelo banco principal. vacuum=True devolve o espaço ao disco
+    def arquivar_movimentacoes(self, antes_de, vacuum=False):
+        cur = self.conn.cursor()
+        self._anexar_arquivo()
+        try:
+            for sql in SQL_ARQUIVO:
+                cur.execute(sql)
+            cur.execute("BEGIN IMMEDIATE")
+            try:
+                cur.execute("SELECT MAX(id) FROM main.movimentacoes WHERE data < ?", (antes_de,))
+                corte = cur.fetchone()[0]
+                if corte is None:
+                    self._confirmar()
+                    return {"movimentacoes": 0, "retratos": 0}
+                cur.execute("""
+                    SELECT id, ate_movimentacao FROM main.estoque_retratos WHERE ate_movimentacao <= ?
+                    ORDER BY ate_movimentacao DESC, id DESC LIMIT 1
+                """, (corte,))
+                retrato = cur.fetchone()
+                # sem retrato até o corte, o estoque do corte não é conhecido: não grava retrato
+                # (estoque_em dessas datas continua sem resposta)
+                retrato_corte = 0
+                if retrato is not None:
+                    estoque = self._aplicar_movimentacoes(cur, retrato, "id <= ?", [corte],
+                                                          movimentacoes="main.movimentacoes",
+                                                          itens="main.estoque_retrato_itens")
+                    cur.execute("INSERT INTO main.estoque_retratos (data, ate_movimentacao) VALUES (datetime(?, '-1 second'), ?)",
+                                (antes_de, corte))
+                    retrato_corte = cur.lastrowid
+                    cur.executemany("INSERT INTO main.estoque_retrato_itens (retrato_id, produto_id, quantidade) VALUES (?, ?, ?)",
+                                    [(retrato_corte, pid, qtd) for pid, qtd in estoque.items()])
+
+                cur.execute("""
+                    INSERT INTO arquivo.movimentacoes (id, produto_id, tipo, quantidade, data, descricao)
+                    SELECT id, produto_id, tipo, quantidade, data, descricao FROM main.movimentacoes WHERE id <= ?
+                """, (corte,))
+                movidas = cur.rowcount
+                cur.execute("DELETE FROM main.movimentacoes WHERE id <= ?", (corte,))
+                antigos = "SELECT id FROM main.estoque_retratos WHERE ate_movimentacao <= ? AND id != ?"
+                cur.execute(f"INSERT INTO arquivo.estoque_retratos SELECT * FROM main.estoque_retratos WHERE id IN ({antigos})",
+                            (corte, retrato_corte))
+                retratos = cur.rowcount
+                cur.execute(f"""
+                    INSERT INTO arquivo.estoque_retrato_itens
+                    SELECT * FROM main.estoque_retrato_itens WHERE retrato_id IN ({antigos})
+                """, (corte, retrato_corte))
+                cur.execute(f"DELETE FROM main.estoque_retrato_itens WHERE retrato_id IN ({antigos})", (corte, retrato_corte))
+                cur.execute(f"DELETE FROM main.estoque_retratos WHERE id IN ({antigos})", (corte, retrato_corte))
+                self._confirmar()
+            except Exception:
+                self.conn.rollback()
+                raise
+        finally:
+            self._desanexar_arquivo()
+        if vacuum:
+            self.conn.execute("VACUUM")
+        return {"movimentacoes": movidas, "retratos": retratos}
+
+    def _anexar_arquivo(self):
+        self.conn.execute("ATTACH DATABASE ? AS arquivo", (self.caminho_arquivo,))
+
+    def _desanexar_arquivo(self):
+        self.conn.execute("DETACH DATABASE arquivo")
+
+# ----------------- Fila local de vendas (caixa offline) -----------------
+class FilaVendas:
+    # diário local (SQLite pequeno, no disco do caixa) onde a venda é gravada na hora;
+    # o SincronizadorVendas depois a leva para o banco principal. Cada venda tem uma chave
+    # única, que vai junto para o banco principal e impede que seja gravada duas vezes
+    def __init__(self, caminho="fila_vendas.db"):
+        self.caminho = caminho
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(caminho, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS vendas_pendentes (
+                chave TEXT PRIMARY KEY,
+                itens TEXT NOT NULL,
+                desconto_total REAL NOT NULL DEFAULT 0,
+                data TEXT NOT NULL DEFAULT (datetime('now','localtime')),
+                status TEXT NOT NULL DEFAULT 'pendente', -- 'pendente', 'sincronizada', 'conflito', 'erro'
+                venda_id INTEGER,
+                detalhe TEXT
+            )
         """)
-        return [dict(r) for r in self.cur.fetchall()]
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_vendas_pendentes_status ON vendas_pendentes(status, data)")
+        # vendas gravadas antes dos centavos têm só desconto_total (reais)
+        _adicionar_coluna(self.conn.cursor(), "vendas_pendentes", "desconto_total_centavos", "INTEGER")
+        self.conn.commit()
+
+    # grava a venda e devolve a chave
+    def adicionar(self, items, desconto_total_centavos=0):
+        chave = f"{os.getpid():x}-{time.time_ns():x}-{os.urandom(4).hex()}"
+        with self._lock:
+            self.conn.execute("INSERT INTO vendas_pendentes (chave, itens, desconto_total_centavos) VALUES (?, ?, ?)",
+                              (chave, json.dumps(items), int(desconto_total_centavos)))
+            self.conn.commit()
+        return chave
+
+    def pendentes(self, limite=None):
+        with self._lock:
+            rows = self.conn.execute(
+                "SELECT * FROM vendas_pendentes WHERE status = 'pendente' ORDER BY data, rowid LIMIT ?",
+                (-1 if limite is None else int(limite),)).fetchall()
+        return [dict(r, itens=json.loads(r["itens"])) for r in rows]
+
+    def contar_pendentes(self):
+        with self._lock:
+            return self.conn.execute("SELECT COUNT(*) FROM vendas_pendentes WHERE status = 'pendente'").fetchone()[0]
+
+    # resultados = [(chave, status, venda_id, detalhe), ...], gravados numa transação
+    def marcar(self, resultados):
+        with self._lock:
+            self.conn.executemany("UPDATE vendas_pendentes SET status = ?, venda_id = ?, detalhe = ? WHERE chave = ?",
+                                  [(status, venda_id, detalhe, chave) for chave, status, venda_id, detalhe in resultados])
+            self.conn.commit()
+
+    # vendas que não entraram como deveriam: estoque ficou negativo ou deram erro
+    def conflitos(self):
+        with self._lock:
+            rows = self.conn.execute(
+                "SELECT * FROM vendas_pendentes WHERE status IN ('conflito', 'erro') ORDER BY data").fetchall()
+        return [dict(r, itens=json.loads(r["itens"])) for r in rows]
+
+    def fechar(self):
+        self.conn.close()
+
+
+class SincronizadorVendas:
+    # leva as vendas da FilaVendas para o banco principal em lotes, via registrar_venda com a
+    # chave da venda. Sem saldo, a venda (que já aconteceu) entra assim mesmo, deixando o
+    # estoque negativo, e fica marcada como conflito; com o banco travado, o lote para e as
+    # vendas seguem pendentes para a próxima passada
+    def __init__(self, estoque, fila, tamanho_lote=50):
+        self.estoque = estoque
+        self.fila = fila
+        self.tamanho_lote = tamanho_lote
+        self._lock = threading.Lock()
+
+    # uma passada; devolve {"sincronizadas", "conflitos", "erros", "pendentes", "produtos", "vendas"}
+    def sincronizar(self):
+        resumo = {"sincronizadas": 0, "conflitos": [], "erros": [], "pendentes": 0, "produtos": set(), "vendas": []}
+        with self._lock:
+            while True:
+                lote = self.fila.pendentes(self.tamanho_lote)
+                if not lote:
+                    break
+                resultados = []
+                try:
+                    for venda in lote:
+                        resultados.append(self._enviar(venda, resumo))
+                except sqlite3.OperationalError as e:
+                    log.warning("sincronização de vendas interrompida: %s", e)
+                    break
+                finally:
+                    self.fila.marcar(resultados)
+                if len(lote) < self.tamanho_lote:
+                    break
+            resumo["pendentes"] = self.fila.contar_pendentes()
+        return resumo
+
+    def _enviar(self, venda, resumo):
+        chave, itens = venda["chave"], venda["itens"]
+        resumo["produtos"].update(int(it["produto_id"]) for it in itens)
+        desconto = venda["desconto_total_centavos"]
+        if desconto is None:
+            desconto = centavos(venda["desconto_total"])
+        try:
+            venda_id, _ = self.estoque.registrar_venda(itens, desconto, chave=chave, data=venda["data"])
+            resumo["sincronizadas"] += 1
+            resumo["vendas"].append(venda_id)
+            return chave, "sincronizada", venda_id, None
+        except EstoqueInsuficiente:
+            pass
+        except ValueError as e:
+            resumo["erros"].append((chave, str(e)))
+            return chave, "erro", None, str(e)
+        venda_id, _ = self.estoque.registrar_venda(itens, desconto, chave=chave,
+                                                   permitir_negativo=True, data=venda["data"])
+        resumo["vendas"].append(venda_id)
+        negativos = [{"produto_id": p["id"], "nome": p["nome"], "quantidade": p["quantidade"]}
+                     for p in self.estoque.obter_produtos({int(it["produto_id"]) for it in itens})
+                     if p["quantidade"] < 0]
+        if not negativos:  # o saldo voltou entre as duas tentativas
+            resumo["sincronizadas"] += 1
+            return chave, "sincronizada", venda_id, None
+        resumo["conflitos"].append((chave, venda_id, negativos))
+        return chave, "conflito", venda_id, json.dumps(negativos, ensure_ascii=False)
+
+
+# ----------------- Recibos -----------------
+# texto do recibo a partir dos dados gravados da venda (dados_recibo): reimprimir dá o mesmo texto,
+# e os totais saem do mesmo motor de preços que calculou a venda. pendente=True marca o recibo provisório de uma venda ainda na fila local
+def renderizar_recibo(venda, pendente=False):
+    itens = venda["itens"]
+    totais = calcular_totais([it["preco_unit_centavos"] for it in itens], [it["quantidade"] for it in itens],
+                             [it.get("desconto_item_centavos") or 0 for it in itens], venda.get("desconto_centavos") or 0,
+                             validar=False)
+    linhas = [f"RECIBO DE VENDA #{venda['id']}", f"Data: {venda['data']}", "-" * 40]
+    for it, subtotal in zip(itens, totais["subtotais"]):
+        linhas.append(f"{it['nome']} x{it['quantidade']}  {formatar_moeda(it['preco_unit_centavos'])}  Sub: {formatar_moeda(subtotal)}")
+    linhas.append("-" * 40)
+    linhas.append(f"Total bruto: {formatar_moeda(totais['bruto'])}")
+    linhas.append(f"Desconto total aplicado: {formatar_moeda(totais['desconto'])}")
+    linhas.append(f"Total final: {formatar_moeda(totais['total'])}")
+    if pendente:
+        linhas.append("(venda aguardando sincronização)")
+    return "\n".join(linhas)
+
+
+class ArquivoRecibos:
+    # os recibos de cada dia vão, um após o outro, para recibos_AAAA-MM-DD.txt, com um índice
+    # binário ao lado (.idx: venda_id, posição e tamanho). Reimprimir é ler o índice do dia e dar
+    # um seek, sem criar um arquivo por venda
+    REGISTRO = struct.Struct("<qQI")
+
+    def __init__(self, pasta="recibos"):
+        self.pasta = pasta
+        self._lock = threading.Lock()
+        self._indices = {}  # dia -> {venda_id: (posição, tamanho)}
+
+    def _caminhos(self, dia):
+        base = os.path.join(self.pasta, f"recibos_{dia}")
+        return base + ".txt", base + ".idx"
+
+    # trava exclusiva entre processos (outro terminal com o mesmo diretório de recibos)
+    def _travar(self, f):
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        else:
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+
+    def _destravar(self, f):
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+        else:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+    # recibos = [(venda_id, dia, texto), ...]: um append por arquivo do dia; os já guardados são ignorados.
+    # Sob a trava do arquivo, o índice é relido do disco (outro terminal pode ter gravado) e a
+    # posição vem do fim real do .txt
+    def guardar(self, recibos):
+        por_dia = {}
+        for venda_id, dia, texto in recibos:
+            por_dia.setdefault(dia, []).append((int(venda_id), (texto.rstrip("\n") + "\n\n").encode("utf-8")))
+        guardados = 0
+        with self._lock:
+            os.makedirs(self.pasta, exist_ok=True)
+            with open(os.path.join(self.pasta, "recibos.lock"), "a+b") as trava:
+                self._travar(trava)
+                try:
+                    for dia, novos in por_dia.items():
+                        self._indices.pop(dia, None)
+                        indice = self._indice(dia)
+                        novos = [(venda_id, dados) for venda_id, dados in dict(novos).items() if venda_id not in indice]
+                        if not novos:
+                            continue
+                        txt, idx = self._caminhos(dia)
+                        registros = []
+                        # o texto vai antes do índice: numa queda no meio, sobra texto sem índice, nunca o contrário
+                        with open(txt, "ab") as f:
+                            posicao = f.tell()
+                            for venda_id, dados in novos:
+                                f.write(dados)
+                                registros.append((venda_id, posicao, len(dados)))
+                                posicao += len(dados)
+                        with open(idx, "ab") as f:
+                            f.write(b"".join(self.REGISTRO.pack(*r) for r in registros))
+                        for venda_id, posicao, tamanho in registros:
+                            indice[venda_id] = (posicao, tamanho)
+                        guardados += len(registros)
+                finally:
+                    self._destravar(trava)
+        return guardados
+
+    def ler(self, venda_id, dia):
+        with self._lock:
+            local = self._indice(dia).get(int(venda_id))
+            if local is None:
+                # outro processo pode ter guardado depois da última leitura do índice
+                self._indices.pop(dia, None)
+                local = self._indice(dia).get(int(venda_id))
+        if local is None:
+            return None
+        with open(self._caminhos(dia)[0], "rb") as f:
+            f.seek(local[0])
+            return f.read(local[1]).decode("utf-8").rstrip("\n")
+
+    def _indice(self, dia):
+        indice = self._indices.get(dia)
+        if indice is None:
+            indice = {}
+            idx = self._caminhos(dia)[1]
+            if os.path.exists(idx):
+                with open(idx, "rb") as f:
+                    dados = f.read()
+                dados = dados[:len(dados) - len(dados) % self.REGISTRO.size]  # registro cortado por uma queda
+                for venda_id, posicao, tamanho in self.REGISTRO.iter_unpack(dados):
+                    indice[venda_id] = (posicao, tamanho)
+            self._indices[dia] = indice
+        return indice
+
+    # recibo da venda: do arquivo, se já guardado; senão montado do banco e guardado
+    def obter(self, estoque, venda_id):
+        venda = estoque.dados_recibo(venda_id)
+        if venda is None:
+            raise ValueError(f"Venda {venda_id} não encontrada")
+        dia = venda["data"][:10]
+        texto = self.ler(venda_id, dia)
+        if texto is None:
+            texto = renderizar_recibo(venda)
+            self.guardar([(venda_id, dia, texto)])
+        return texto
+
+    # guarda de uma vez os recibos de várias vendas (ex.: as que acabaram de ser sincronizadas)
+    def arquivar(self, estoque, venda_ids):
+        recibos = []
+        for venda_id in venda_ids:
+            venda = estoque.dados_recibo(venda_id)
+            if venda is not None:
+                recibos.append((venda_id, venda["data"][:10], renderizar_recibo(venda)))
+        return self.guardar(recibos)
+
+
+# ----------------- Execução em segundo plano -----------------
+class TarefaCancelada(Exception):
+    pass
+
+
+class Tarefa:
+    def __init__(self, servico):
+        self.servico = servico
+        self.future = None
+        self._cancelada = threading.Event()
+
+    @property
+    def cancelada(self):
+        return self._cancelada.is_set()
+
+    def cancelar(self):
+        self._cancelada.set()
+        if self.future is not None:
+            self.future.cancel()
+
+    # chamado na thread de trabalho: interrompe a tarefa se o usuário cancelou
+    def verificar(self):
+        if self.cancelada:
+            raise TarefaCancelada()
+
+
+class ServicoEstoque:
+    # executa as chamadas ao GerenciadorEstoque num pool de threads (cada thread com a sua
+    # própria conexão do PoolConexoes) e devolve os resultados à thread do Tk: as threads
+    # só colocam o resultado numa fila, que é esvaziada via root.after
+    INTERVALO_MS = 30
+
+    def __init__(self, root, estoque, max_workers=2):
+        self.root = root
+        self.estoque = estoque
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="estoque")
+        self._fila = queue.Queue()
+        self._callbacks = {}  # tarefa -> (ao_concluir, ao_erro)
+        self._agendado = False
+
+    def executar(self, func, *args, ao_concluir=None, ao_erro=None, **kwargs):
+        tarefa = Tarefa(self)
+
+        def rodar():
+            tarefa.verificar()
+            return func(*args, **kwargs)
+        return self._submeter(tarefa, rodar, ao_concluir, ao_erro)
+
+    def _submeter(self, tarefa, rodar, ao_concluir, ao_erro):
+        self._callbacks[tarefa] = (ao_concluir, ao_erro or self._erro_padrao)
+
+        def trabalho():
+            try:
+                self._fila.put((tarefa, "ok", rodar()))
+            except TarefaCancelada:
+                self._fila.put((tarefa, "cancelada", None))
+            except Exception as e:
+                self._fila.put((tarefa, "erro", e))
+        tarefa.future = self.executor.submit(trabalho)
+        if not self._agendado:
+            self._agendado = True
+            self.root.after(self.INTERVALO_MS, self._processar)
+        return tarefa
+
+    # roda na thread do Tk
+    def _processar(self):
+        while True:
+            try:
+                tarefa, tipo, valor = self._fila.get_nowait()
+            except queue.Empty:
+                break
+            ao_concluir, ao_erro = self._callbacks.pop(tarefa, (None, None))
+            callback = ao_erro if tipo == "erro" else ao_concluir
+            if callback is None or tarefa.cancelada or tipo == "cancelada":
+                continue
+            # um erro no callback (ex.: janela já fechada) não pode parar o processamento da fila
+            try:
+                callback(valor)
+            except Exception:
+                self.root.report_callback_exception(*sys.exc_info())
+        # tarefas canceladas antes de começar nunca chegam à fila
+        for tarefa in [t for t in self._callbacks if t.future.cancelled()]:
+            del self._callbacks[tarefa]
+        if self._callbacks:
+            self.root.after(self.INTERVALO_MS, self._processar)
+        else:
+            self._agendado = False
+
+    def _erro_padrao(self, erro):
+        messagebox.showerror("Erro", str(erro))
+
+    def fechar(self):
+        for tarefa in list(self._callbacks):
+            tarefa.cancelar()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+# ----------------- Busca de produtos (caixa de texto) -----------------
+class BuscaProdutos:
+    # campo de busca que consulta enquanto o usuário digita: espera uma pausa na digitação
+    # (debounce), busca em segundo plano e descarta respostas de buscas já superadas.
+    # Campo vazio devolve o catálogo completo; na primeira vez, a primeira tela chega antes dele
+    ESPERA_MS = 250
+    PRIMEIRA_PAGINA = 200
+
+    def __init__(self, parent, estoque, servico, ao_resultado, limite=500, width=30):
+        self.estoque = estoque
+        self.servico = servico
+        self.ao_resultado = ao_resultado  # (lista de produtos, ranqueados) -> None; ranqueados: resultado de busca
+        self.limite = limite
+        self.entry = tk.Entry(parent, width=width)
+        self.entry.bind("<KeyRelease>", self._digitou)
+        self.entry.bind("<Return>", lambda e: self.buscar())
+        self._agendado = None
+        self._seq = 0
+        self._catalogo_carregado = False
+
+    @property
+    def termo(self):
+        return self.entry.get().strip()
+
+    def _digitou(self, event=None):
+        if self._agendado is not None:
+            self.entry.after_cancel(self._agendado)
+        self._agendado = self.entry.after(self.ESPERA_MS, self.buscar)
+
+    def buscar(self):
+        if self._agendado is not None:
+            self.entry.after_cancel(self._agendado)
+            self._agendado = None
+        self._seq += 1
+        seq = self._seq
+
+        def concluido(produtos, ranqueados=False):
+            if seq == self._seq:
+                self.ao_resultado(produtos, ranqueados)
+
+        def catalogo(produtos):
+            self._catalogo_carregado = True
+            concluido(produtos)
+
+        def primeira_pagina(produtos):
+            if seq == self._seq:
+                self.ao_resultado(produtos, False)
+                self.servico.executar(self.estoque.listar_produtos, ao_concluir=catalogo)
+        if self.termo:
+            self.servico.executar(self.estoque.buscar_produtos, self.termo, self.limite,
+                                  ao_concluir=lambda produtos: concluido(produtos, True))
+        elif self._catalogo_carregado:
+            self.servico.executar(self.estoque.listar_produtos, ao_concluir=concluido)
+        else:
+            self.servico.executar(self.estoque.listar_produtos, self.PRIMEIRA_PAGINA, ao_concluir=primeira_pagina)
+
 
 # ----------------- Interface Principal (com Vendas e Relatórios) -----------------
 class App:
-    def __init__(self, root):
+    INTERVALO_SINCRONIZACAO_MS = 5000
+
+    def __init__(self, root, estoque=None, fila_vendas=None, recibos=None, inicio=None):
+        # inicio (time.perf_counter): desde quando contar o tempo até a primeira tela de produtos
+        self._inicio = time.perf_counter() if inicio is None else inicio
         self.root = root
         self.root.title("Sistema de Estoque e Vendas")
-        self.estoque = GerenciadorEstoque()
+        self.estoque = estoque or GerenciadorEstoque()
+        self.servico = ServicoEstoque(root, self.estoque)
+        self.recibos = recibos or ArquivoRecibos()
+        self.analise = AnaliseVendas(self.estoque)  # uma por aplicação: o cache vale entre janelas
+        self.root.protocol("WM_DELETE_WINDOW", self.fechar)
+
+        # caixa offline: vendas vão para a fila local e são sincronizadas em segundo plano
+        self.fila_vendas = fila_vendas
+        self.sincronizador = SincronizadorVendas(self.estoque, fila_vendas) if fila_vendas else None
+        self._sincronizando = False
+        self._sincronizar_de_novo = False
+        self._ao_sincronizar = []
 
         # Frame principal: formulário de cadastro
         frame = tk.Frame(root)
         frame.pack(pady=10, fill="x")
 
-        labels = ["Nome", "Categoria", "Quantidade", "Preço", "Descrição", "Fornecedor"]
+        labels = ["Nome", "Categoria", "Quantidade", "Preço", "Descrição", "Fornecedor", "Código de barras"]
         for i, text in enumerate(labels):
             tk.Label(frame, text=text).grid(row=0, column=i)
         self.entries = [tk.Entry(frame) for _ in range(len(labels))]
@@ -252,13 +2547,25 @@ class App:
             e.grid(row=1, column=i, padx=5)
         tk.Button(frame, text="Cadastrar Produto", command=self.cadastrar).grid(row=1, column=len(labels), padx=5)
 
+        # Busca de produtos
+        frame_busca = tk.Frame(root)
+        frame_busca.pack(padx=10, fill="x")
+        tk.Label(frame_busca, text="Buscar:").pack(side="left")
+        self.busca = BuscaProdutos(frame_busca, self.estoque, self.servico, self._mostrar_produtos)
+        self.busca.entry.pack(side="left", padx=5)
+
         # Treeview de produtos
-        self.tree = ttk_native.Treeview(root, columns=("id", "nome", "categoria", "quantidade", "preco", "fornecedor"), show="headings", height=10)
+        frame_tree = tk.Frame(root)
+        frame_tree.pack(pady=10, padx=10, fill="x")
+        self.tree = ttk_native.Treeview(frame_tree, columns=("id", "nome", "categoria", "quantidade", "preco", "fornecedor"), show="headings", height=10)
         for col in ("id", "nome", "categoria", "quantidade", "preco", "fornecedor"):
             self.tree.heading(col, text=col.capitalize())
             self.tree.column(col, anchor="center")
-        self.tree.pack(pady=10, padx=10, fill="x")
+        scroll = ttk_native.Scrollbar(frame_tree, orient="vertical")
+        scroll.pack(side="right", fill="y")
+        self.tree.pack(side="left", fill="x", expand=True)
         self.tree.tag_configure("red", background="#ffcccc")
+        self.modelo = ModeloProdutosTree(self.tree, scroll, self._linha_produto)
 
         # Botões ações
         btns = tk.Frame(root)
@@ -268,42 +2575,105 @@ class App:
         tk.Button(btns, text="Atualizar Estoque", command=self.atualizar).grid(row=0, column=2, padx=5)
         tk.Button(btns, text="Abrir Vendas", command=self.abrir_vendas).grid(row=0, column=3, padx=5)
         tk.Button(btns, text="Relatórios", command=self.abrir_relatorios).grid(row=0, column=4, padx=5)
-
+        tk.Button(btns, text="Importar Catálogo", command=self.importar).grid(row=0, column=5, padx=5)
+        tk.Button(btns, text="Exportar Dados", command=self.exportar).grid(row=0, column=6, padx=5)
+        tk.Button(btns, text="Diagnóstico", command=self.abrir_diagnostico).grid(row=0, column=7, padx=5)
+        self.btn_reposicao = tk.Button(btns, text="Reposição", command=self.abrir_reposicao)
+        self.btn_reposicao.grid(row=0, column=8, padx=5)
+        tk.Button(btns, text="Inventário", command=self.abrir_inventario).grid(row=0, column=9, padx=5)
+        self._ultimo_alerta = None
+        self._controles = frame.winfo_children() + [self.busca.entry] + btns.winfo_children()
+
+        # banco novo ou de versão anterior: a janela aparece antes e a migração roda em segundo plano
+        if self.estoque.precisa_migrar():
+            self._migrar()
+        else:
+            self._iniciar()
+
+    def _iniciar(self):
         self.carregar_tree()
-
-    def carregar_tree(self):
-        for i in self.tree.get_children():
-            self.tree.delete(i)
-        for p in self.estoque.listar_produtos():
-            id = p["id"]
-            nome = p["nome"]
-            categoria = p["categoria"]
-            quantidade = p["quantidade"]
-            preco = p["preco"]
-            fornecedor = p["fornecedor"]
-            estoque_min = p["estoque_minimo"]
-            cor = "red" if quantidade <= estoque_min else ""
-            self.tree.insert("", "end", values=(id, nome, categoria, quantidade, f"R${preco:.2f}", fornecedor), tags=(cor,))
+        if self.sincronizador is not None:
+            self._sincronizacao_periodica()
+
+    # enquanto migra, os controles ficam desabilitados: nenhuma operação disputa o banco com a migração
+    def _migrar(self):
+        for w in self._controles:
+            if isinstance(w, (tk.Button, tk.Entry)):
+                w.config(state="disabled")
+        self.lbl_migracao = tk.Label(self.root, text="Migrando banco de dados...")
+        self.lbl_migracao.pack(before=self.tree.master)
+
+        def concluido(_):
+            self.lbl_migracao.destroy()
+            for w in self._controles:
+                if isinstance(w, (tk.Button, tk.Entry)):
+                    w.config(state="normal")
+            self._iniciar()
+
+        def erro(e):
+            messagebox.showerror("Erro", f"Falha ao migrar o banco de dados:\n{e}")
+            self.fechar()
+        self.servico.executar(self.estoque.preparar_banco, ao_concluir=concluido, ao_erro=erro)
+
+    def _mostrar_produtos(self, produtos, ranqueados=False):
+        self.modelo.carregar(produtos, ordenar=not ranqueados)
+        if self._inicio is None:
+            return
+        log.info("primeira tela de produtos em %.0f ms", (time.perf_counter() - self._inicio) * 1000)
+        self._inicio = None
+        # retrato diário do estoque, para consultas de estoque em datas passadas; fica para
+        # depois da primeira tela, para não disputar o banco com ela
+        self.servico.executar(self.estoque.criar_retrato_se_necessario, ao_erro=lambda e: log.warning("retrato: %s", e))
+
+    def _linha_produto(self, p):
+        cor = "red" if p["quantidade"] <= p["estoque_minimo"] else ""
+        values = (p["id"], p["nome"], p["categoria"], p["quantidade"], formatar_moeda(p["preco_centavos"]), p["fornecedor"])
+        return values, (cor,)
+
+    # ids: recarrega só esses produtos; sem ids, sincroniza com o catálogo inteiro (ou com a busca)
+    def carregar_tree(self, ids=None):
+        self.verificar_alertas()
+        if ids is None:
+            self.busca.buscar()
+            return
+        ids = set(ids)
+        if self.busca.termo:
+            # com busca ativa, só atualiza o que já está na lista
+            ids &= set(self.modelo.produtos)
+            if not ids:
+                return
+        self.servico.executar(self.estoque.obter_produtos, ids,
+                              ao_concluir=lambda produtos: self.modelo.atualizar(
+                                  produtos, removidos=ids - {p["id"] for p in produtos}))
+
+    def fechar(self):
+        self.servico.fechar()
+        self.root.destroy()
 
     def cadastrar(self):
         try:
-            nome, categoria, qtd, preco, descricao, fornecedor = [e.get() for e in self.entries]
+            nome, categoria, qtd, preco, descricao, fornecedor, codigo = [e.get() for e in self.entries]
             produto = {
                 "nome": nome,
                 "categoria": categoria,
                 "quantidade": int(qtd),
-                "preco": float(preco),
+                "preco_centavos": centavos(preco),
                 "descricao": descricao,
                 "fornecedor": fornecedor,
-                "estoque_minimo": 5
+                "estoque_minimo": 5,
+                "codigo_barras": codigo.strip() or None
             }
-            if self.estoque.cadastrar_produto(produto):
+        except Exception as ex:
+            messagebox.showerror("Erro", f"Preencha os campos corretamente!\n{ex}")
+            return
+
+        def concluido(ok):
+            if ok:
                 messagebox.showinfo("Sucesso", "Produto cadastrado!")
                 self.carregar_tree()
             else:
                 messagebox.showerror("Erro", "Não foi possível cadastrar o produto.")
-        except Exception as ex:
-            messagebox.showerror("Erro", f"Preencha os campos corretamente!\n{ex}")
+        self.servico.executar(self.estoque.cadastrar_produto, produto, ao_concluir=concluido)
 
     def adicionar(self):
         item = self.tree.selection()
@@ -312,8 +2682,8 @@ class App:
             return
         id = int(self.tree.item(item[0], "values")[0])
         qtd = self._ask_qtd("Adicionar")
-        if qtd and self.estoque.adicionar_estoque(id, qtd):
-            self.carregar_tree()
+        if qtd:
+            self._alterar_estoque(self.estoque.adicionar_estoque, id, qtd)
 
     def remover(self):
         item = self.tree.selection()
@@ -322,8 +2692,8 @@ class App:
             return
         id = int(self.tree.item(item[0], "values")[0])
         qtd = self._ask_qtd("Remover")
-        if qtd and self.estoque.remover_estoque(id, qtd):
-            self.carregar_tree()
+        if qtd:
+            self._alterar_estoque(self.estoque.remover_estoque, id, qtd)
 
     def atualizar(self):
         item = self.tree.selection()
@@ -332,8 +2702,16 @@ class App:
             return
         id = int(self.tree.item(item[0], "values")[0])
         qtd = self._ask_qtd("Nova quantidade")
-        if qtd is not None and self.estoque.atualizar_estoque(id, qtd):
-            self.carregar_tree()
+        if qtd is not None:
+            self._alterar_estoque(self.estoque.atualizar_estoque, id, qtd)
+
+    def _alterar_estoque(self, metodo, id, qtd):
+        def concluido(ok):
+            if ok:
+                self.carregar_tree([id])
+            else:
+                messagebox.showerror("Erro", "Não foi possível alterar o estoque.")
+        self.servico.executar(metodo, id, qtd, ao_concluir=concluido)
 
     def _ask_qtd(self, title):
         win = tk.Toplevel(self.root)
@@ -355,20 +2733,151 @@ class App:
         self.root.wait_window(win)
         return result.get("qtd")
 
+    # ----------------- IMPORTAÇÃO / EXPORTAÇÃO -----------------
+    def importar(self):
+        caminho = filedialog.askopenfilename(parent=self.root, title="Importar catálogo",
+                                             filetypes=[("CSV", "*.csv"), ("JSON Lines", "*.jsonl"), ("Todos", "*.*")])
+        if not caminho:
+            return
+
+        def concluido(resumo):
+            msg = (f"{resumo['inseridos']} inseridos, {resumo['atualizados']} atualizados "
+                   f"em {resumo['segundos']:.1f}s ({resumo['linhas_por_segundo']:.0f} linhas/s)")
+            if resumo["erros"]:
+                msg += f"\n{len(resumo['erros'])} linhas com erro, por exemplo:\n"
+                msg += "\n".join(f"linha {n}: {e}" for n, e in resumo["erros"][:10])
+            messagebox.showinfo("Importação concluída", msg)
+            self.carregar_tree()
+        self.servico.executar(self.estoque.importar_produtos, caminho, ao_concluir=concluido)
+
+    def exportar(self):
+        win = tk.Toplevel(self.root)
+        win.attributes('-topmost', True)
+        Utils().centralizar(win, 300, 100)
+        win.title("Exportar")
+        tk.Label(win, text="Tabela:").pack()
+        combo = ttk_native.Combobox(win, values=list(TABELAS_EXPORTAVEIS), state="readonly")
+        combo.current(0)
+        combo.pack(pady=5)
+
+        def confirmar():
+            tabela = combo.get()
+            win.destroy()
+            exportar_em_segundo_plano(self.root, self.servico, self.estoque, tabela)
+        tk.Button(win, text="OK", command=confirmar).pack(pady=5)
+
+    # ----------------- REPOSIÇÃO -----------------
+    # chamado a cada alteração de estoque: só lê a tabela de alertas (contagem e maior id)
+    def verificar_alertas(self):
+        def mostrar(situacao):
+            total, ultimo = situacao
+            novos = self._ultimo_alerta is not None and ultimo > self._ultimo_alerta
+            self._ultimo_alerta = ultimo
+            self.btn_reposicao.config(text=f"Reposição ({total})" if total else "Reposição",
+                                      fg="red" if novos else "black")
+        self.servico.executar(self.estoque.situacao_alertas, ao_concluir=mostrar,
+                              ao_erro=lambda e: log.warning("alertas de estoque: %s", e))
+
+    def abrir_reposicao(self):
+        self.btn_reposicao.config(fg="black")
+        RelatoriosWindow(self.root, self.estoque, self.servico, self.recibos, aba="reposicao", analise=self.analise)
+
     # ----------------- VENDAS -----------------
     def abrir_vendas(self):
-        VendaWindow(self.root, self.estoque, self.carregar_tree)
+        VendaWindow(self.root, self.estoque, self.carregar_tree, self.servico,
+                    fila_vendas=self.fila_vendas, sincronizar=self.sincronizar_vendas, recibos=self.recibos)
+
+    # ----------------- SINCRONIZAÇÃO DA FILA DE VENDAS -----------------
+    def _sincronizacao_periodica(self):
+        if self.fila_vendas.contar_pendentes():
+            self.sincronizar_vendas()
+        self.root.after(self.INTERVALO_SINCRONIZACAO_MS, self._sincronizacao_periodica)
+
+    # uma passada por vez; pedidos durante a passada geram outra logo depois.
+    # ao_concluir(resumo) é chamado ao fim de uma passada iniciada depois do pedido
+    def sincronizar_vendas(self, ao_concluir=None):
+        if ao_concluir is not None:
+            self._ao_sincronizar.append(ao_concluir)
+        if self._sincronizando:
+            self._sincronizar_de_novo = True
+            return
+        self._sincronizando = True
+        callbacks, self._ao_sincronizar = self._ao_sincronizar, []
+
+        def fim():
+            self._sincronizando = False
+            if self._sincronizar_de_novo:
+                self._sincronizar_de_novo = False
+                self.sincronizar_vendas()
+
+        def concluido(resumo):
+            fim()
+            if resumo["vendas"]:
+                self.servico.executar(self.recibos.arquivar, self.estoque, resumo["vendas"],
+                                      ao_erro=lambda e: log.warning("arquivo de recibos: %s", e))
+            if resumo["produtos"]:
+                self.carregar_tree(resumo["produtos"])
+            for callback in callbacks:
+                callback(resumo)
+            if resumo["conflitos"] or resumo["erros"]:
+                self._avisar_conflitos(resumo)
+
+        def erro(e):
+            fim()
+            log.warning("sincronização de vendas: %s", e)
+        self.servico.executar(self.sincronizador.sincronizar, ao_concluir=concluido, ao_erro=erro)
+
+    def _avisar_conflitos(self, resumo):
+        linhas = []
+        for chave, venda_id, negativos in resumo["conflitos"]:
+            produtos = ", ".join(f"{p['nome']} ({p['quantidade']})" for p in negativos)
+            linhas.append(f"Venda #{venda_id} deixou estoque negativo: {produtos}")
+        for chave, erro in resumo["erros"]:
+            linhas.append(f"Venda {chave} não sincronizada: {erro}")
+        messagebox.showwarning("Conflitos na sincronização de vendas", "\n".join(linhas[:20]))
 
     # ----------------- RELATÓRIOS -----------------
     def abrir_relatorios(self):
-        RelatoriosWindow(self.root, self.estoque)
+        RelatoriosWindow(self.root, self.estoque, self.servico, self.recibos, analise=self.analise)
+
+    # ----------------- INVENTÁRIO -----------------
+    def abrir_inventario(self):
+        InventarioWindow(self.root, self.estoque, self.servico, self.carregar_tree)
+
+    # ----------------- DIAGNÓSTICO -----------------
+    def abrir_diagnostico(self):
+        if self.estoque.instrumentacao is None:
+            messagebox.showinfo("Diagnóstico", "Instrumentação desligada. Inicie com: python main.py --instrumentar")
+            return
+        DiagnosticoWindow(self.root, self.estoque.instrumentacao)
+
+FORMATOS_EXPORTACAO = [("CSV", "*.csv"), ("CSV compactado", "*.csv.gz"), ("JSON Lines", "*.jsonl"),
+                       ("JSON Lines compactado", "*.jsonl.gz"), ("Colunar", "*.col")]
+
+
+# pergunta o arquivo e exporta a tabela/relatório no ServicoEstoque, sem travar a janela
+def exportar_em_segundo_plano(parent, servico, estoque, tabela, data_inicio=None, data_fim=None):
+    caminho = filedialog.asksaveasfilename(parent=parent, title="Exportar", initialfile=f"{tabela}.csv",
+                                           defaultextension=".csv", filetypes=FORMATOS_EXPORTACAO)
+    if not caminho:
+        return
+    servico.executar(estoque.exportar_tabela, tabela, caminho, data_inicio=data_inicio, data_fim=data_fim,
+                     ao_concluir=lambda total: messagebox.showinfo(
+                         "Exportação concluída", f"{total} linhas exportadas para {caminho}", parent=parent),
+                     ao_erro=lambda e: messagebox.showerror("Erro na exportação", str(e), parent=parent))
+
 
 # ----------------- Janela de Vendas -----------------
 class VendaWindow:
-    def __init__(self, parent, estoque: GerenciadorEstoque, atualizar_callback=None):
+    def __init__(self, parent, estoque: GerenciadorEstoque, atualizar_callback=None, servico=None,
+                 fila_vendas=None, sincronizar=None, recibos=None):
         self.parent = parent
         self.estoque = estoque
         self.atualizar_callback = atualizar_callback
+        self.servico = servico or ServicoEstoque(parent, estoque)
+        self.recibos = recibos or ArquivoRecibos()
+        self.fila_vendas = fila_vendas  # com fila, a venda é gravada localmente e sincronizada depois
+        self.sincronizar = sincronizar
 
         self.win = tk.Toplevel(parent)
         self.win.title("Vendas")
@@ -379,12 +2888,37 @@ class VendaWindow:
         left = tk.Frame(self.win)
         left.pack(side="left", fill="both", expand=True, padx=10, pady=10)
 
-        tk.Label(left, text="Produtos").pack()
-        self.tree_prod = ttk_native.Treeview(left, columns=("id", "nome", "qtd", "preco"), show="headings", height=12)
+        # Leitor de código de barras: o leitor "digita" o código e manda Enter.
+        # "3*7891234567890" lança 3 unidades de uma vez
+        leitor = tk.Frame(left)
+        leitor.pack(fill="x", pady=(0, 5))
+        tk.Label(leitor, text="Código de barras:").pack(side="left")
+        self.entry_codigo = tk.Entry(leitor, width=24)
+        self.entry_codigo.pack(side="left", padx=5)
+        self.entry_codigo.bind("<Return>", self.ler_codigo)
+        self.lbl_leitura = tk.Label(leitor, text="", anchor="w")
+        self.lbl_leitura.pack(side="left", fill="x", expand=True)
+        # produtos por código, para validar as leituras sem ir ao banco: vem dos produtos já
+        # carregados na lista (e das leituras), sem uma carga extra do catálogo
+        self.por_codigo = {}
+
+        topo = tk.Frame(left)
+        topo.pack(fill="x")
+        tk.Label(topo, text="Produtos").pack(side="left")
+        self.busca = BuscaProdutos(topo, self.estoque, self.servico, self._mostrar_produtos)
+        self.busca.entry.pack(side="right")
+        tk.Label(topo, text="Buscar:").pack(side="right", padx=5)
+        frame_prod = tk.Frame(left)
+        frame_prod.pack(fill="both", expand=True)
+        self.tree_prod = ttk_native.Treeview(frame_prod, columns=("id", "nome", "qtd", "preco"), show="headings", height=12)
         for c in ("id", "nome", "qtd", "preco"):
             self.tree_prod.heading(c, text=c.capitalize())
             self.tree_prod.column(c, anchor="center")
-        self.tree_prod.pack(fill="both", expand=True)
+        scroll = ttk_native.Scrollbar(frame_prod, orient="vertical")
+        scroll.pack(side="right", fill="y")
+        self.tree_prod.pack(side="left", fill="both", expand=True)
+        self.modelo = ModeloProdutosTree(self.tree_prod, scroll,
+                                         lambda p: ((p["id"], p["nome"], p["quantidade"], formatar_moeda(p["preco_centavos"])), ()))
         self.carregar_produtos()
 
         # Controls para adicionar ao carrinho
@@ -404,7 +2938,7 @@ class VendaWindow:
         tk.Label(right, text="Carrinho").pack()
         self.listbox_cart = tk.Listbox(right, width=50, height=12)
         self.listbox_cart.pack()
-        self.cart = []  # items: dicts {produto_id, nome, quantidade, preco_unit, desconto_item}
+        self.cart = []  # items: dicts {produto_id, nome, quantidade, preco_unit_centavos, desconto_item_centavos}
 
         # descontos e total
         bottom = tk.Frame(right)
@@ -413,13 +2947,87 @@ class VendaWindow:
         self.entry_desc_total = tk.Entry(bottom, width=8)
         self.entry_desc_total.grid(row=0, column=1, padx=5)
         tk.Button(bottom, text="Remover item selecionado", command=self.remover_item_cart).grid(row=0, column=2, padx=5)
-        tk.Button(bottom, text="Finalizar Venda", command=self.finalizar_venda).grid(row=0, column=3, padx=5)
+        self.btn_finalizar = tk.Button(bottom, text="Finalizar Venda", command=self.finalizar_venda)
+        self.btn_finalizar.grid(row=0, column=3, padx=5)
 
-    def carregar_produtos(self):
-        for i in self.tree_prod.get_children():
-            self.tree_prod.delete(i)
-        for p in self.estoque.listar_produtos():
-            self.tree_prod.insert("", "end", values=(p["id"], p["nome"], p["quantidade"], f"R${p['preco']:.2f}"))
+        self.entry_codigo.focus_set()
+
+    def carregar_produtos(self, ids=None):
+        if ids is None:
+            self.busca.buscar()
+            return
+        ids = set(ids)
+
+        def concluido(produtos):
+            self._atualizar_codigos(produtos)
+            visiveis = ids
+            if self.busca.termo:
+                # com busca ativa, só atualiza o que já está na lista
+                visiveis = ids & set(self.modelo.produtos)
+                produtos = [p for p in produtos if p["id"] in visiveis]
+            self.modelo.atualizar(produtos, removidos=visiveis - {p["id"] for p in produtos})
+        self.servico.executar(self.estoque.obter_produtos, ids, ao_concluir=concluido)
+
+    def _mostrar_produtos(self, produtos, ranqueados=False):
+        self._atualizar_codigos(produtos)
+        self.modelo.carregar(produtos, ordenar=not ranqueados)
+
+    def _atualizar_codigos(self, produtos):
+        for p in produtos:
+            if p.get("codigo_barras"):
+                self.por_codigo[p["codigo_barras"]] = p
+
+    # ----------------- Leitor de código de barras -----------------
+    def ler_codigo(self, event=None):
+        texto = self.entry_codigo.get().strip()
+        self.entry_codigo.delete(0, tk.END)
+        if not texto:
+            return "break"
+        qtd, _, codigo = texto.rpartition("*")
+        try:
+            qtd = int(qtd) if qtd else 1
+        except ValueError:
+            qtd = 0
+        if qtd <= 0 or not codigo:
+            self._aviso_leitura(f"Leitura inválida: {texto}")
+            return "break"
+        produto = self.por_codigo.get(codigo)
+        if produto is None:
+            # pode ter sido cadastrado depois que a janela abriu
+            self.servico.executar(self.estoque.obter_produto_por_codigo, codigo,
+                                  ao_concluir=lambda p: self._lancar_codigo(codigo, p, qtd))
+        else:
+            self._lancar_codigo(codigo, produto, qtd)
+        return "break"
+
+    # leituras repetidas somam na mesma linha do carrinho. O estoque é conferido contra o retrato;
+    # a conferência definitiva é a baixa condicional de registrar_venda, no commit da venda
+    def _lancar_codigo(self, codigo, produto, qtd):
+        if produto is None:
+            self._aviso_leitura(f"Código {codigo} não cadastrado")
+            return
+        self.por_codigo[codigo] = produto
+        no_carrinho = sum(it["quantidade"] for it in self.cart if it["produto_id"] == produto["id"])
+        if no_carrinho + qtd > produto["quantidade"]:
+            self._aviso_leitura(f"Estoque insuficiente para {produto['nome']} ({produto['quantidade']} disponível)")
+            return
+        linha = next((it for it in self.cart if it["produto_id"] == produto["id"] and not it["desconto_item_centavos"]), None)
+        if linha is None:
+            linha = {
+                "produto_id": produto["id"],
+                "nome": produto["nome"],
+                "quantidade": 0,
+                "preco_unit_centavos": produto["preco_centavos"],
+                "desconto_item_centavos": 0
+            }
+            self.cart.append(linha)
+        linha["quantidade"] += qtd
+        self._refresh_cart_list()
+        self.lbl_leitura.config(text=f"{produto['nome']} x{linha['quantidade']}", fg="green")
+
+    def _aviso_leitura(self, texto):
+        self.win.bell()
+        self.lbl_leitura.config(text=texto, fg="red")
 
     def adicionar_carrinho(self):
         sel = self.tree_prod.selection()
@@ -434,33 +3042,35 @@ class VendaWindow:
             messagebox.showerror("Erro", "Quantidade inválida")
             return
         try:
-            desconto_item = float(self.entry_desc_item.get()) if self.entry_desc_item.get() else 0.0
+            desconto_item = centavos(self.entry_desc_item.get()) if self.entry_desc_item.get() else 0
         except:
             messagebox.showerror("Erro", "Desconto inválido")
             return
 
         # verificar estoque
-        prod = self.estoque.obter_produto(produto_id)
-        if prod is None:
-            messagebox.showerror("Erro", "Produto não encontrado")
-            return
-        if prod["quantidade"] < qtd:
-            messagebox.showerror("Erro", f"Estoque insuficiente ({prod['quantidade']} disponível)")
-            return
-
-        self.cart.append({
-            "produto_id": produto_id,
-            "nome": nome,
-            "quantidade": qtd,
-            "preco_unit": float(prod["preco"]),
-            "desconto_item": desconto_item
-        })
-        self._refresh_cart_list()
+        def verificado(prod):
+            if prod is None:
+                messagebox.showerror("Erro", "Produto não encontrado")
+                return
+            if prod["quantidade"] < qtd:
+                messagebox.showerror("Erro", f"Estoque insuficiente ({prod['quantidade']} disponível)")
+                return
+
+            self.cart.append({
+                "produto_id": produto_id,
+                "nome": nome,
+                "quantidade": qtd,
+                "preco_unit_centavos": prod["preco_centavos"],
+                "desconto_item_centavos": desconto_item
+            })
+            self._refresh_cart_list()
+        self.servico.executar(self.estoque.obter_produto, produto_id, ao_concluir=verificado)
 
     def _refresh_cart_list(self):
         self.listbox_cart.delete(0, tk.END)
         for it in self.cart:
-            line = f"{it['nome']} x{it['quantidade']} - R${it['preco_unit']:.2f} (-{it['desconto_item']:.2f})"
+            line = (f"{it['nome']} x{it['quantidade']} - {formatar_moeda(it['preco_unit_centavos'])}"
+                    f" (-{reais(it['desconto_item_centavos'])})")
             self.listbox_cart.insert(tk.END, line)
 
     def remover_item_cart(self):
@@ -476,10 +3086,17 @@ class VendaWindow:
             messagebox.showwarning("Carrinho vazio", "Adicione itens ao carrinho antes de finalizar")
             return
         try:
-            desconto_total = float(self.entry_desc_total.get()) if self.entry_desc_total.get() else 0.0
+            desconto_total = centavos(self.entry_desc_total.get()) if self.entry_desc_total.get() else 0
         except:
             messagebox.showerror("Erro", "Desconto total inválido")
             return
+        # mesmas contas (e mesmas regras de desconto) que registrar_venda fará
+        try:
+            totais = calcular_totais([it["preco_unit_centavos"] for it in self.cart], [it["quantidade"] for it in self.cart],
+                                     [it["desconto_item_centavos"] for it in self.cart], desconto_total)
+        except ValueError as e:
+            messagebox.showerror("Erro", str(e))
+            return
 
         # preparar items para registrar venda
         items_payload = []
@@ -487,105 +3104,308 @@ class VendaWindow:
             items_payload.append({
                 "produto_id": it["produto_id"],
                 "quantidade": it["quantidade"],
-                "desconto_item": it.get("desconto_item", 0.0)
+                "desconto_item_centavos": it["desconto_item_centavos"]
             })
 
-        try:
-            venda_id, total = self.estoque.registrar_venda(items_payload, desconto_total)
-        except ValueError as e:
-            messagebox.showerror("Erro na venda", str(e))
+        carrinho = list(self.cart)
+        if self.fila_vendas is not None:
+            # grava na fila local (instantâneo) e o sincronizador leva ao banco principal
+            try:
+                chave = self.fila_vendas.adicionar(items_payload, desconto_total)
+            except sqlite3.Error as e:
+                messagebox.showerror("Erro na venda", f"Não foi possível gravar a venda na fila local:\n{e}")
+                return
+            # recibo provisório, montado do carrinho; o definitivo é arquivado após a sincronização
+            provisorio = {"id": chave, "data": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                          "total_centavos": totais["total"], "desconto_centavos": desconto_total, "itens": carrinho}
+            self.servico.executar(renderizar_recibo, provisorio, pendente=True,
+                                  ao_concluir=lambda texto: self.mostrar_recibo(chave, texto))
+            self._venda_registrada(carrinho)
+            if self.sincronizar is not None:
+                self.sincronizar(ao_concluir=lambda resumo: self.carregar_produtos(resumo["produtos"]))
             return
 
-        # gerar recibo (texto) e mostrar
-        now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        recibo_lines = [f"RECIBO DE VENDA #{venda_id}", f"Data: {now}", "-"*40]
-        total_bruto = 0.0
-        for it in self.cart:
-            subtotal = it['preco_unit'] * it['quantidade'] - it.get('desconto_item', 0.0)
-            recibo_lines.append(f"{it['nome']} x{it['quantidade']}  R${it['preco_unit']:.2f}  Sub: R${subtotal:.2f}")
-            total_bruto += subtotal
-        recibo_lines.append("-"*40)
-        recibo_lines.append(f"Total bruto: R${total_bruto:.2f}")
-        recibo_lines.append(f"Desconto total aplicado: R${desconto_total:.2f}")
-        recibo_lines.append(f"Total final: R${total:.2f}")
-
-        recibo_text = "\n".join(recibo_lines)
+        # registra em segundo plano; o botão fica desabilitado para evitar venda em dobro
+        self.btn_finalizar.config(state="disabled")
 
-        # Mostrar recibo em nova janela com opção de salvar
-        self.mostrar_recibo(venda_id, recibo_text)
+        def erro(e):
+            self.btn_finalizar.config(state="normal")
+            messagebox.showerror("Erro na venda", str(e))
 
-        # limpar carrinho e recarregar produtos/estoque
+        def concluido(resultado):
+            self.btn_finalizar.config(state="normal")
+            venda_id = resultado[0]
+            # recibo montado do que foi gravado e guardado no arquivo do dia, fora da thread do Tk
+            self.servico.executar(self.recibos.obter, self.estoque, venda_id,
+                                  ao_concluir=lambda texto: self.mostrar_recibo(venda_id, texto))
+            self._venda_registrada(carrinho)
+        self.servico.executar(self.estoque.registrar_venda, items_payload, desconto_total,
+                              ao_concluir=concluido, ao_erro=erro)
+
+    def _venda_registrada(self, carrinho):
+        # limpar carrinho e recarregar só os produtos vendidos
+        vendidos = {it["produto_id"] for it in carrinho}
         self.cart.clear()
         self._refresh_cart_list()
-        self.carregar_produtos()
+        self.carregar_produtos(vendidos)
         if self.atualizar_callback:
-            self.atualizar_callback()
+            self.atualizar_callback(vendidos)
 
     def mostrar_recibo(self, venda_id, texto):
-        w = tk.Toplevel(self.win)
-        w.title(f"Recibo #{venda_id}")
-        Utils().centralizar(w, 400, 400)
-        txt = tk.Text(w, wrap="word")
-        txt.insert("1.0", texto)
-        txt.config(state="disabled")
-        txt.pack(expand=True, fill="both")
-        btns = tk.Frame(w)
-        btns.pack(pady=5)
-        def salvar():
-            filename = f"recibo_venda_{venda_id}.txt"
-            with open(filename, "w", encoding="utf-8") as f:
-                f.write(texto)
-            messagebox.showinfo("Salvo", f"Recibo salvo em {os.path.abspath(filename)}")
-        tk.Button(btns, text="Salvar Recibo (TXT)", command=salvar).pack(side="left", padx=5)
-        tk.Button(btns, text="Fechar", command=w.destroy).pack(side="left", padx=5)
+        mostrar_recibo(self.win, venda_id, texto)
+
+
+# janela com o texto do recibo; o recibo já está no arquivo do dia, salvar é só uma cópia avulsa
+def mostrar_recibo(parent, venda_id, texto):
+    w = tk.Toplevel(parent)
+    w.title(f"Recibo #{venda_id}")
+    Utils().centralizar(w, 400, 400)
+    txt = tk.Text(w, wrap="word")
+    txt.insert("1.0", texto)
+    txt.config(state="disabled")
+    txt.pack(expand=True, fill="both")
+    btns = tk.Frame(w)
+    btns.pack(pady=5)
+    def salvar():
+        filename = filedialog.asksaveasfilename(parent=w, title="Salvar recibo", initialfile=f"recibo_venda_{venda_id}.txt",
+                                                defaultextension=".txt", filetypes=[("Texto", "*.txt")])
+        if not filename:
+            return
+        with open(filename, "w", encoding="utf-8") as f:
+            f.write(texto)
+        messagebox.showinfo("Salvo", f"Recibo salvo em {os.path.abspath(filename)}", parent=w)
+    tk.Button(btns, text="Salvar Cópia (TXT)", command=salvar).pack(side="left", padx=5)
+    tk.Button(btns, text="Fechar", command=w.destroy).pack(side="left", padx=5)
 
 # ----------------- Janela de Relatórios -----------------
 class RelatoriosWindow:
-    def __init__(self, parent, estoque: GerenciadorEstoque):
+    VENDAS_POR_PAGINA = 200
+    HIST_POR_PAGINA = 500
+    # análise -> (colunas, método de AnaliseVendas, linha -> valores)
+    ANALISES = {
+        "Curva ABC": (("Produto", "Classe", "Receita", "% receita", "% acumulado", "Qtd"), "curva_abc",
+                      lambda l: (l["nome"] or f"#{l['produto_id']}", l["classe"], formatar_moeda(l["receita_centavos"]),
+                                 f"{l['participacao'] * 100:.2f}", f"{l['acumulado'] * 100:.2f}", l["quantidade"])),
+        "Velocidade": (("Produto", "Vendidos", "Por dia", "Estoque", "Cobertura (dias)"), "velocidade",
+                       lambda l: (l["nome"] or f"#{l['produto_id']}", l["vendidos"], f"{l['por_dia']:.2f}", l["estoque"],
+                                  "-" if l["cobertura_dias"] is None else f"{l['cobertura_dias']:.0f}")),
+        "Médias móveis": (("Dia", "Qtd", "Receita", "Média 7 dias", "Média 30 dias"), "medias_moveis",
+                          lambda l: (l["dia"], l["quantidade"], formatar_moeda(l["receita_centavos"]),
+                                     formatar_moeda(l["media_7d_centavos"]), formatar_moeda(l["media_30d_centavos"]))),
+        "Giro": (("Produto", "Vendidos", "Estoque inicial", "Estoque final", "Giro", "Dias por giro"), "giro",
+                 lambda l: (l["nome"] or f"#{l['produto_id']}", l["vendidos"],
+                            "-" if l["estoque_inicial"] is None else l["estoque_inicial"],
+                            "-" if l["estoque_final"] is None else l["estoque_final"],
+                            "-" if l["giro"] is None else f"{l['giro']:.2f}",
+                            "-" if l["dias_por_giro"] is None else f"{l['dias_por_giro']:.0f}")),
+    }
+
+    def __init__(self, parent, estoque: GerenciadorEstoque, servico=None, recibos=None, aba=None, analise=None):
         self.parent = parent
         self.estoque = estoque
+        self.servico = servico or ServicoEstoque(parent, estoque)
+        self.recibos = recibos or ArquivoRecibos()
+        self.analise = analise or AnaliseVendas(estoque)
         self.win = tk.Toplevel(parent)
         self.win.title("Relatórios")
         Utils().centralizar(self.win, 900, 600)
 
-        # Tabs simples com 3 relatórios
-        nb = ttk_native.Notebook(self.win)
-        nb.pack(fill="both", expand=True)
-
-        # Vendas
-        tab_vendas = tk.Frame(nb)
-        nb.add(tab_vendas, text="Relatório de Vendas")
+        # as abas começam vazias e cada uma é montada na primeira vez que é selecionada
+        self.nb = ttk_native.Notebook(self.win)
+        self.nb.pack(fill="both", expand=True)
+        self._abas = {}  # nome do frame -> função que monta a aba (sai daqui depois de montada)
+        abas = {}
+        for chave, texto, montar in (("vendas", "Relatório de Vendas", self._montar_vendas),
+                                     ("resumo", "Resumo de Vendas", self._montar_resumo),
+                                     ("estoque", "Relatório de Estoque", self._montar_estoque),
+                                     ("reposicao", "Reposição", self._montar_reposicao),
+                                     ("historico", "Histórico Movimentações", self._montar_historico),
+                                     ("analise", "Análise", self._montar_analise)):
+            frame = tk.Frame(self.nb)
+            self.nb.add(frame, text=texto)
+            self._abas[str(frame)] = (frame, montar)
+            abas[chave] = frame
+        self.tarefa_hist = None
+        self.win.bind("<Destroy>", lambda e: self.cancelar_hist() if e.widget is self.win else None)
+        self.nb.bind("<<NotebookTabChanged>>", self._aba_selecionada)
+        self.nb.select(abas.get(aba, abas["vendas"]))
+        self._aba_selecionada()
+        if aba == "reposicao":
+            self.carregar_reposicao()
+
+    def _aba_selecionada(self, event=None):
+        frame, montar = self._abas.pop(str(self.nb.select()), (None, None))
+        if montar is not None:
+            montar(frame)
+
+    def _montar_vendas(self, tab_vendas):
         self.tree_vendas = ttk_native.Treeview(tab_vendas, columns=("id","data","total","desconto"), show="headings", height=10)
         for c in ("id","data","total","desconto"):
             self.tree_vendas.heading(c, text=c.capitalize())
         self.tree_vendas.pack(fill="both", expand=True)
+        filtro = tk.Frame(tab_vendas)
+        filtro.pack(pady=5)
+        tk.Label(filtro, text="De (AAAA-MM-DD):").grid(row=0, column=0)
+        self.entry_vendas_de = tk.Entry(filtro, width=12)
+        self.entry_vendas_de.grid(row=0, column=1, padx=5)
+        tk.Label(filtro, text="Até:").grid(row=0, column=2)
+        self.entry_vendas_ate = tk.Entry(filtro, width=12)
+        self.entry_vendas_ate.grid(row=0, column=3, padx=5)
+        tk.Button(filtro, text="< Anterior", command=lambda: self.paginar_vendas(-1)).grid(row=0, column=4, padx=5)
+        tk.Button(filtro, text="Próxima >", command=lambda: self.paginar_vendas(1)).grid(row=0, column=5, padx=5)
+        self.lbl_pagina_vendas = tk.Label(filtro, text="")
+        self.lbl_pagina_vendas.grid(row=0, column=6, padx=5)
+        self.pagina_vendas = 0
         tk.Button(tab_vendas, text="Carregar Vendas", command=self.carregar_vendas).pack(pady=5)
         tk.Button(tab_vendas, text="Visualizar Itens da Venda Selecionada", command=self.visualizar_itens_venda).pack(pady=5)
-
-        # Estoque
-        tab_estoque = tk.Frame(nb)
-        nb.add(tab_estoque, text="Relatório de Estoque")
+        tk.Button(tab_vendas, text="Reimprimir Recibo", command=self.reimprimir_recibo).pack(pady=5)
+        exportar = tk.Frame(tab_vendas)
+        exportar.pack(pady=5)
+        tk.Button(exportar, text="Exportar Vendas do Período",
+                  command=lambda: self.exportar("vendas", self.entry_vendas_de, self.entry_vendas_ate)).pack(side="left", padx=5)
+        tk.Button(exportar, text="Exportar Itens do Período",
+                  command=lambda: self.exportar("venda_itens", self.entry_vendas_de, self.entry_vendas_ate)).pack(side="left", padx=5)
+
+    # Resumo (lê só as tabelas de resumo)
+    def _montar_resumo(self, tab_resumo):
+        self.tree_resumo = ttk_native.Treeview(tab_resumo, columns=("chave", "vendas", "qtd", "receita"), show="headings", height=12)
+        for c, texto in (("chave", "Dia"), ("vendas", "Nº vendas"), ("qtd", "Qtd vendida"), ("receita", "Receita")):
+            self.tree_resumo.heading(c, text=texto)
+            self.tree_resumo.column(c, anchor="center")
+        self.tree_resumo.pack(fill="both", expand=True)
+        ctl_resumo = tk.Frame(tab_resumo)
+        ctl_resumo.pack(pady=5)
+        tk.Label(ctl_resumo, text="Agrupar por:").grid(row=0, column=0)
+        self.combo_resumo = ttk_native.Combobox(ctl_resumo, values=("Dia", "Produto", "Categoria"), width=10, state="readonly")
+        self.combo_resumo.current(0)
+        self.combo_resumo.grid(row=0, column=1, padx=5)
+        tk.Label(ctl_resumo, text="De:").grid(row=0, column=2)
+        self.entry_resumo_de = tk.Entry(ctl_resumo, width=12)
+        self.entry_resumo_de.grid(row=0, column=3, padx=5)
+        tk.Label(ctl_resumo, text="Até:").grid(row=0, column=4)
+        self.entry_resumo_ate = tk.Entry(ctl_resumo, width=12)
+        self.entry_resumo_ate.grid(row=0, column=5, padx=5)
+        tk.Button(ctl_resumo, text="Carregar Resumo", command=self.carregar_resumo).grid(row=0, column=6, padx=5)
+        tk.Button(ctl_resumo, text="Exportar",
+                  command=lambda: self.exportar("vendas_por_dia" if self.combo_resumo.get() == "Dia" else "vendas_por_dia_produto",
+                                                self.entry_resumo_de, self.entry_resumo_ate)).grid(row=0, column=7, padx=5)
+
+    def _montar_estoque(self, tab_estoque):
         self.tree_estoque = ttk_native.Treeview(tab_estoque, columns=("id","nome","qtd","preco","min"), show="headings", height=12)
         for c in ("id","nome","qtd","preco","min"):
             self.tree_estoque.heading(c, text=c.capitalize())
         self.tree_estoque.pack(fill="both", expand=True)
         tk.Button(tab_estoque, text="Carregar Estoque", command=self.carregar_estoque).pack(pady=5)
-
-        # Histórico
-        tab_hist = tk.Frame(nb)
-        nb.add(tab_hist, text="Histórico Movimentações")
+        tk.Button(tab_estoque, text="Exportar Estoque", command=lambda: self.exportar("estoque")).pack(pady=5)
+
+    # Reposição: produtos em alerta e sugestão de compra por fornecedor
+    def _montar_reposicao(self, tab_repo):
+        self.tree_repo = ttk_native.Treeview(tab_repo, columns=("id", "qtd", "min", "venda_dia", "sugerido"),
+                                             show="tree headings", height=12)
+        self.tree_repo.heading("#0", text="Fornecedor / Produto")
+        for c, texto in (("id", "Id"), ("qtd", "Qtd"), ("min", "Mínimo"), ("venda_dia", "Venda/dia"), ("sugerido", "Comprar")):
+            self.tree_repo.heading(c, text=texto)
+            self.tree_repo.column(c, anchor="center", width=90)
+        self.tree_repo.pack(fill="both", expand=True)
+        ctl_repo = tk.Frame(tab_repo)
+        ctl_repo.pack(pady=5)
+        tk.Label(ctl_repo, text="Venda média dos últimos (dias):").grid(row=0, column=0)
+        self.entry_repo_dias = tk.Entry(ctl_repo, width=5)
+        self.entry_repo_dias.insert(0, "30")
+        self.entry_repo_dias.grid(row=0, column=1, padx=5)
+        tk.Label(ctl_repo, text="Cobrir (dias):").grid(row=0, column=2)
+        self.entry_repo_cobertura = tk.Entry(ctl_repo, width=5)
+        self.entry_repo_cobertura.insert(0, "15")
+        self.entry_repo_cobertura.grid(row=0, column=3, padx=5)
+        tk.Button(ctl_repo, text="Carregar Sugestões", command=self.carregar_reposicao).grid(row=0, column=4, padx=5)
+
+    # Análise: tabelas prontas para gráfico (AnaliseVendas), trocando as colunas conforme a análise
+    def _montar_analise(self, tab_analise):
+        ctl = tk.Frame(tab_analise)
+        ctl.pack(side="bottom", pady=5)
+        self.combo_analise = ttk_native.Combobox(ctl, values=list(self.ANALISES), width=14, state="readonly")
+        self.combo_analise.current(0)
+        self.combo_analise.grid(row=0, column=0, padx=5)
+        tk.Label(ctl, text="De:").grid(row=0, column=1)
+        self.entry_analise_de = tk.Entry(ctl, width=12)
+        self.entry_analise_de.grid(row=0, column=2, padx=5)
+        tk.Label(ctl, text="Até:").grid(row=0, column=3)
+        self.entry_analise_ate = tk.Entry(ctl, width=12)
+        self.entry_analise_ate.grid(row=0, column=4, padx=5)
+        tk.Button(ctl, text="Calcular", command=self.carregar_analise).grid(row=0, column=5, padx=5)
+        self.lbl_analise = tk.Label(ctl, text="")
+        self.lbl_analise.grid(row=0, column=6, padx=5)
+        scroll = ttk_native.Scrollbar(tab_analise, orient="vertical")
+        self.tree_analise = ttk_native.Treeview(tab_analise, show="headings", height=14, yscrollcommand=scroll.set)
+        scroll.config(command=self.tree_analise.yview)
+        scroll.pack(side="right", fill="y")
+        self.tree_analise.pack(fill="both", expand=True)
+
+    def _montar_historico(self, tab_hist):
         self.tree_hist = ttk_native.Treeview(tab_hist, columns=("data","produto","tipo","qtd","descricao"), show="headings", height=12)
         for c in ("data","produto","tipo","qtd","descricao"):
             self.tree_hist.heading(c, text=c.capitalize())
+        scroll_hist = ttk_native.Scrollbar(tab_hist, orient="vertical", command=self.tree_hist.yview)
+        self.tree_hist.config(yscrollcommand=lambda primeiro, ultimo: self._hist_rolou(scroll_hist, primeiro, ultimo))
+        filtro_hist = tk.Frame(tab_hist)
+        filtro_hist.pack(side="bottom", pady=5)
+        tk.Label(filtro_hist, text="Produto (id ou nome):").grid(row=0, column=0)
+        self.entry_hist_produto = tk.Entry(filtro_hist, width=16)
+        self.entry_hist_produto.grid(row=0, column=1, padx=5)
+        tk.Label(filtro_hist, text="Tipo:").grid(row=0, column=2)
+        self.combo_hist_tipo = ttk_native.Combobox(filtro_hist, values=("", "add", "remove", "sale", "set"), width=8, state="readonly")
+        self.combo_hist_tipo.grid(row=0, column=3, padx=5)
+        tk.Label(filtro_hist, text="De:").grid(row=0, column=4)
+        self.entry_hist_de = tk.Entry(filtro_hist, width=12)
+        self.entry_hist_de.grid(row=0, column=5, padx=5)
+        tk.Label(filtro_hist, text="Até:").grid(row=0, column=6)
+        self.entry_hist_ate = tk.Entry(filtro_hist, width=12)
+        self.entry_hist_ate.grid(row=0, column=7, padx=5)
+        ctl_hist = tk.Frame(tab_hist)
+        ctl_hist.pack(side="bottom", pady=5)
+        tk.Button(ctl_hist, text="Carregar Histórico", command=self.carregar_hist).grid(row=0, column=0, padx=5)
+        tk.Button(ctl_hist, text="Carregar mais", command=self.carregar_mais_hist).grid(row=0, column=1, padx=5)
+        tk.Button(ctl_hist, text="Cancelar", command=self.cancelar_hist).grid(row=0, column=2, padx=5)
+        tk.Button(ctl_hist, text="Exportar Período",
+                  command=lambda: self.exportar("historico", self.entry_hist_de, self.entry_hist_ate)).grid(row=0, column=3, padx=5)
+        self.lbl_hist = tk.Label(ctl_hist, text="")
+        self.lbl_hist.grid(row=0, column=4, padx=5)
+        scroll_hist.pack(side="right", fill="y")
         self.tree_hist.pack(fill="both", expand=True)
-        tk.Button(tab_hist, text="Carregar Histórico", command=self.carregar_hist).pack(pady=5)
+        self.hist_filtros = {}
+        self.hist_apos = None  # (data, id) da última movimentação carregada
+        self.hist_fim = True
 
     def carregar_vendas(self):
-        for i in self.tree_vendas.get_children():
-            self.tree_vendas.delete(i)
-        vendas = self.estoque.relatorio_vendas()
-        for v in vendas:
-            self.tree_vendas.insert("", "end", values=(v["id"], v["data"], f"R${v['total']:.2f}", f"R${v['desconto']:.2f}"))
+        self.pagina_vendas = 0
+        self._carregar_pagina_vendas()
+
+    def paginar_vendas(self, passo):
+        self.pagina_vendas = max(0, self.pagina_vendas + passo)
+        self._carregar_pagina_vendas()
+
+    def _carregar_pagina_vendas(self):
+        de = self.entry_vendas_de.get().strip() or None
+        ate = self.entry_vendas_ate.get().strip() or None
+        pagina = self.pagina_vendas
+
+        def buscar():
+            total = self.estoque.contar_vendas(de, ate)
+            paginas = max(1, -(-total // self.VENDAS_POR_PAGINA))
+            p = min(pagina, paginas - 1)
+            vendas = list(self.estoque.relatorio_vendas(de, ate, limite=self.VENDAS_POR_PAGINA,
+                                                        offset=p * self.VENDAS_POR_PAGINA, com_itens=False))
+            return total, paginas, p, vendas
+
+        def mostrar(resultado):
+            total, paginas, self.pagina_vendas, vendas = resultado
+            self.lbl_pagina_vendas.config(text=f"Página {self.pagina_vendas + 1}/{paginas} ({total} vendas)")
+            for i in self.tree_vendas.get_children():
+                self.tree_vendas.delete(i)
+            for v in vendas:
+                self.tree_vendas.insert("", "end", values=(v["id"], v["data"], formatar_moeda(v["total_centavos"]),
+                                                           formatar_moeda(v["desconto_centavos"])))
+        self.servico.executar(buscar, ao_concluir=mostrar)
 
     def visualizar_itens_venda(self):
         sel = self.tree_vendas.selection()
@@ -594,28 +3414,486 @@ class RelatoriosWindow:
             return
         venda_id = int(self.tree_vendas.item(sel[0], "values")[0])
         # pegar itens
-        self.estoque.cur.execute("SELECT vi.*, p.nome FROM venda_itens vi JOIN produtos p ON vi.produto_id = p.id WHERE vi.venda_id=?", (venda_id,))
-        itens = [dict(r) for r in self.estoque.cur.fetchall()]
-        txt = "\n".join([f"{it['nome']} x{it['quantidade']}  R${it['preco_unit']:.2f} (-{it['desconto_item']:.2f})" for it in itens])
-        messagebox.showinfo(f"Itens Venda #{venda_id}", txt or "Sem itens")
+        def mostrar(itens):
+            txt = "\n".join([f"{it['nome']} x{it['quantidade']}  {formatar_moeda(it['preco_unit_centavos'])}"
+                              f" (-{reais(it['desconto_item_centavos'])})" for it in itens])
+            messagebox.showinfo(f"Itens Venda #{venda_id}", txt or "Sem itens")
+        self.servico.executar(self.estoque.itens_venda, venda_id, ao_concluir=mostrar)
 
-    def carregar_estoque(self):
-        for i in self.tree_estoque.get_children():
-            self.tree_estoque.delete(i)
-        produtos = self.estoque.relatorio_estoque()
-        for p in produtos:
-            self.tree_estoque.insert("", "end", values=(p["id"], p["nome"], p["quantidade"], f"R${p['preco']:.2f}", p["estoque_minimo"]))
+    def reimprimir_recibo(self):
+        sel = self.tree_vendas.selection()
+        if not sel:
+            messagebox.showwarning("Atenção", "Selecione uma venda")
+            return
+        venda_id = int(self.tree_vendas.item(sel[0], "values")[0])
+        self.servico.executar(self.recibos.obter, self.estoque, venda_id,
+                              ao_concluir=lambda texto: mostrar_recibo(self.win, venda_id, texto))
+
+    # exporta direto do banco para o arquivo (não o que está na lista), com o período dos campos
+    def exportar(self, tabela, entry_de=None, entry_ate=None):
+        de = entry_de.get().strip() or None if entry_de else None
+        ate = entry_ate.get().strip() or None if entry_ate else None
+        exportar_em_segundo_plano(self.win, self.servico, self.estoque, tabela, de, ate)
+
+    def carregar_resumo(self):
+        agrupamento = self.combo_resumo.get()
+        de = self.entry_resumo_de.get().strip() or None
+        ate = self.entry_resumo_ate.get().strip() or None
+        consultas = {
+            "Dia": lambda: [(r["dia"], r["num_vendas"], "-", r["total_centavos"]) for r in self.estoque.vendas_por_dia(de, ate)],
+            "Produto": lambda: [(r["nome"] or f"#{r['produto_id']}", "-", r["quantidade"], r["receita_centavos"])
+                                for r in self.estoque.vendas_por_produto(de, ate)],
+            "Categoria": lambda: [(r["categoria"], "-", r["quantidade"], r["receita_centavos"])
+                                  for r in self.estoque.vendas_por_categoria(de, ate)],
+        }
+
+        def mostrar(linhas):
+            self.tree_resumo.heading("chave", text=agrupamento)
+            for i in self.tree_resumo.get_children():
+                self.tree_resumo.delete(i)
+            for chave, vendas, qtd, receita in linhas:
+                self.tree_resumo.insert("", "end", values=(chave, vendas, qtd, formatar_moeda(receita)))
+        self.servico.executar(consultas[agrupamento], ao_concluir=mostrar)
+
+    def carregar_reposicao(self):
+        try:
+            dias = int(self.entry_repo_dias.get())
+            cobertura = int(self.entry_repo_cobertura.get())
+        except ValueError:
+            messagebox.showerror("Erro", "Informe os dias em números inteiros")
+            return
 
+        def mostrar(grupos):
+            self.tree_repo.delete(*self.tree_repo.get_children())
+            for g in grupos:
+                pai = self.tree_repo.insert("", "end", text=g["fornecedor"], open=True,
+                                            values=("", "", "", "", g["total_unidades"]))
+                for p in g["itens"]:
+                    self.tree_repo.insert(pai, "end", text=p["nome"],
+                                          values=(p["id"], p["quantidade"], p["estoque_minimo"], p["venda_diaria"], p["sugerido"]))
+        self.servico.executar(self.estoque.sugestoes_compra, dias, cobertura, ao_concluir=mostrar)
+
+    def carregar_estoque(self):
+        def mostrar(produtos):
+            for i in self.tree_estoque.get_children():
+                self.tree_estoque.delete(i)
+            for p in produtos:
+                self.tree_estoque.insert("", "end", values=(p["id"], p["nome"], p["quantidade"], formatar_moeda(p["preco_centavos"]), p["estoque_minimo"]))
+        self.servico.executar(self.estoque.relatorio_estoque, ao_concluir=mostrar)
+
+    # o histórico é lido em páginas (keyset em data, id); a próxima página é pedida pelo
+    # botão "Carregar mais" ou automaticamente ao rolar até o fim da lista
     def carregar_hist(self):
+        self.cancelar_hist()
         for i in self.tree_hist.get_children():
             self.tree_hist.delete(i)
-        movs = self.estoque.historico_movimentacoes()
-        for m in movs:
-            self.tree_hist.insert("", "end", values=(m["data"], m.get("produto_nome") or "-", m["tipo"], m["quantidade"], m["descricao"]))
+        produto = self.entry_hist_produto.get().strip()
+        self.hist_filtros = {
+            "produto_id": int(produto) if produto.isdigit() else None,
+            "produto_nome": produto if produto and not produto.isdigit() else None,
+            "tipo": self.combo_hist_tipo.get() or None,
+            "data_inicio": self.entry_hist_de.get().strip() or None,
+            "data_fim": self.entry_hist_ate.get().strip() or None,
+        }
+        self.hist_apos = None
+        self.hist_fim = False
+        self.carregar_mais_hist()
+
+    def carregar_mais_hist(self):
+        if self.tarefa_hist is not None or self.hist_fim:
+            return
+        self.lbl_hist.config(text="Carregando...")
+
+        def mostrar(movs):
+            self.tarefa_hist = None
+            for m in movs:
+                self.tree_hist.insert("", "end", values=(m["data"], m.get("produto_nome") or "-", m["tipo"], m["quantidade"], m["descricao"]))
+            if movs:
+                self.hist_apos = (movs[-1]["data"], movs[-1]["id"])
+            self.hist_fim = len(movs) < self.HIST_POR_PAGINA
+            carregadas = len(self.tree_hist.get_children())
+            self.lbl_hist.config(text=f"{carregadas} movimentações" + ("" if self.hist_fim else " (há mais)"))
+
+        def erro(e):
+            self.tarefa_hist = None
+            self.lbl_hist.config(text="")
+            messagebox.showerror("Erro", str(e), parent=self.win)
+        self.tarefa_hist = self.servico.executar(
+            self.estoque.historico_movimentacoes, apos=self.hist_apos, limite=self.HIST_POR_PAGINA,
+            **self.hist_filtros, ao_concluir=mostrar, ao_erro=erro)
+
+    def _hist_rolou(self, scrollbar, primeiro, ultimo):
+        scrollbar.set(primeiro, ultimo)
+        if float(ultimo) >= 1.0 and float(primeiro) > 0.0:
+            self.carregar_mais_hist()
+
+    def carregar_analise(self):
+        nome = self.combo_analise.get()
+        colunas, metodo, formatar = self.ANALISES[nome]
+        de = self.entry_analise_de.get().strip() or None
+        ate = self.entry_analise_ate.get().strip() or None
+        self.lbl_analise.config(text="Calculando...")
+        inicio = time.perf_counter()
+
+        def mostrar(linhas):
+            self.tree_analise.delete(*self.tree_analise.get_children())
+            self.tree_analise.config(columns=[f"c{i}" for i in range(len(colunas))])
+            for i, texto in enumerate(colunas):
+                self.tree_analise.heading(f"c{i}", text=texto)
+                self.tree_analise.column(f"c{i}", anchor="center", width=120)
+            for linha in linhas:
+                self.tree_analise.insert("", "end", values=formatar(linha))
+            self.lbl_analise.config(text=f"{len(linhas)} linhas em {(time.perf_counter() - inicio) * 1000:.0f} ms")
+
+        def erro(e):
+            self.lbl_analise.config(text="")
+            messagebox.showerror("Erro", str(e))
+        self.servico.executar(getattr(self.analise, metodo), de, ate, ao_concluir=mostrar, ao_erro=erro)
+
+    def cancelar_hist(self):
+        if self.tarefa_hist is not None and not self.tarefa_hist.cancelada:
+            self.tarefa_hist.cancelar()
+            if self.lbl_hist.winfo_exists():
+                self.lbl_hist.config(text="Cancelado")
+        self.tarefa_hist = None
+
+# ----------------- Janela de Inventário -----------------
+# contagem física: linhas digitadas (código/id + quantidade contada) ou lidas de arquivo; Conferir
+# mostra as divergências sem gravar, Aplicar grava todas numa transação
+class InventarioWindow:
+    def __init__(self, parent, estoque: GerenciadorEstoque, servico=None, atualizar_callback=None):
+        self.estoque = estoque
+        self.servico = servico or ServicoEstoque(parent, estoque)
+        self.atualizar_callback = atualizar_callback
+        self.contagens = []
+        self.relatorio = None
+        self.win = tk.Toplevel(parent)
+        self.win.title("Inventário")
+        Utils().centralizar(self.win, 900, 550)
+
+        frame_add = tk.Frame(self.win)
+        frame_add.pack(pady=5)
+        tk.Label(frame_add, text="Código de barras:").grid(row=0, column=0)
+        self.entry_codigo = tk.Entry(frame_add, width=18)
+        self.entry_codigo.grid(row=0, column=1, padx=5)
+        tk.Label(frame_add, text="ou ID:").grid(row=0, column=2)
+        self.entry_id = tk.Entry(frame_add, width=8)
+        self.entry_id.grid(row=0, column=3, padx=5)
+        tk.Label(frame_add, text="Contado:").grid(row=0, column=4)
+        self.entry_contado = tk.Entry(frame_add, width=8)
+        self.entry_contado.grid(row=0, column=5, padx=5)
+        self.entry_contado.bind("<Return>", lambda e: self.adicionar())
+        tk.Button(frame_add, text="Adicionar", command=self.adicionar).grid(row=0, column=6, padx=5)
+        tk.Button(frame_add, text="Abrir contagem...", command=self.abrir).grid(row=0, column=7, padx=5)
+        tk.Button(frame_add, text="Limpar", command=self.limpar).grid(row=0, column=8, padx=5)
+
+        colunas = ("produto", "codigo", "sistema", "contado", "diferenca", "valor")
+        titulos = ("Produto", "Código", "Sistema", "Contado", "Diferença", "Valor")
+        self.tree = ttk_native.Treeview(self.win, columns=colunas, show="headings", height=16)
+        for c, t in zip(colunas, titulos):
+            self.tree.heading(c, text=t)
+            self.tree.column(c, anchor="center", width=110)
+        self.tree.column("produto", width=250, anchor="w")
+        self.tree.tag_configure("falta", background="#ffcccc")
+        self.tree.tag_configure("sobra", background="#ccffcc")
+        self.tree.tag_configure("erro", background="#ffe0a0")
+        self.tree.pack(fill="both", expand=True, padx=10)
+
+        btns = tk.Frame(self.win)
+        btns.pack(pady=5)
+        tk.Button(btns, text="Conferir", command=lambda: self.conciliar(False)).pack(side="left", padx=5)
+        tk.Button(btns, text="Aplicar", command=lambda: self.conciliar(True)).pack(side="left", padx=5)
+        tk.Button(btns, text="Salvar relatório", command=self.salvar).pack(side="left", padx=5)
+        self.lbl_resumo = tk.Label(self.win, text="")
+        self.lbl_resumo.pack(pady=5)
+
+    def adicionar(self):
+        codigo = self.entry_codigo.get().strip()
+        produto_id = self.entry_id.get().strip()
+        try:
+            if codigo and produto_id:
+                raise ValueError("informe o código de barras ou o ID, não os dois")
+            contagem = validar_contagem({"id": produto_id, "codigo_barras": codigo, "contado": self.entry_contado.get()})
+        except (ValueError, TypeError) as e:
+            messagebox.showerror("Erro", str(e), parent=self.win)
+            return
+        self.contagens.append(contagem)
+        self.relatorio = None
+        self.tree.insert("", "end", values=(contagem["id"] or "", contagem["codigo_barras"] or "", "",
+                                            contagem["contado"], "", ""))
+        self.lbl_resumo.config(text=f"{len(self.contagens)} linhas de contagem")
+        self.entry_codigo.delete(0, "end")
+        self.entry_id.delete(0, "end")
+        self.entry_contado.delete(0, "end")
+        self.entry_codigo.focus_set()
+
+    def abrir(self):
+        caminho = filedialog.askopenfilename(parent=self.win, title="Abrir contagem",
+                                             filetypes=[("CSV", "*.csv"), ("JSON Lines", "*.jsonl"), ("Todos", "*.*")])
+        if not caminho:
+            return
+
+        def lido(resultado):
+            contagens, erros = resultado
+            self.contagens.extend(contagens)
+            if erros:
+                messagebox.showwarning("Contagem", f"{len(erros)} linhas com erro, por exemplo:\n" +
+                                       "\n".join(f"linha {n}: {e}" for n, e in erros[:10]), parent=self.win)
+            self.conciliar(False)
+        self.servico.executar(ler_contagens, caminho, ao_concluir=lido,
+                              ao_erro=lambda e: messagebox.showerror("Erro", str(e), parent=self.win))
+
+    def limpar(self):
+        self.contagens = []
+        self.relatorio = None
+        self.tree.delete(*self.tree.get_children())
+        self.lbl_resumo.config(text="")
+
+    def conciliar(self, aplicar):
+        if not self.contagens:
+            messagebox.showwarning("Atenção", "Nenhuma contagem informada", parent=self.win)
+            return
+        if aplicar and not messagebox.askyesno(
+                "Inventário", f"Gravar as quantidades contadas de {len(self.contagens)} linhas?", parent=self.win):
+            return
+        self.lbl_resumo.config(text="Conferindo..." if not aplicar else "Aplicando...")
+
+        def concluido(relatorio):
+            self.relatorio = relatorio
+            self.mostrar(relatorio)
+            if relatorio["aplicado"]:
+                self.contagens = []
+                if self.atualizar_callback and relatorio["divergencias"]:
+                    self.atualizar_callback([d["produto_id"] for d in relatorio["divergencias"]])
+
+        def erro(e):
+            self.lbl_resumo.config(text="")
+            messagebox.showerror("Erro", str(e), parent=self.win)
+        self.servico.executar(self.estoque.conciliar_inventario, list(self.contagens), aplicar=aplicar,
+                              ao_concluir=concluido, ao_erro=erro)
+
+    def mostrar(self, r):
+        self.tree.delete(*self.tree.get_children())
+        for identificador in r["nao_encontrados"]:
+            self.tree.insert("", "end", values=(f"não encontrado: {identificador}", "", "", "", "", ""), tags=("erro",))
+        for d in r["divergencias"]:
+            self.tree.insert("", "end", values=(f"{d['produto_id']} - {d['nome']}", d["codigo_barras"] or "",
+                                                d["sistema"], d["contado"], f"{d['diferenca']:+d}",
+                                                formatar_moeda(d["valor_centavos"])),
+                             tags=("sobra" if d["diferenca"] > 0 else "falta",))
+        self.lbl_resumo.config(text=(
+            f"{'Aplicado' if r['aplicado'] else 'Conferência (nada gravado)'}: {r['conferidos']} produtos, "
+            f"{r['iguais']} iguais, {len(r['divergencias'])} divergentes | sobras {r['sobras']} un "
+            f"({formatar_moeda(r['valor_sobras_centavos'])}), faltas {r['faltas']} un "
+            f"({formatar_moeda(r['valor_faltas_centavos'])}) | {len(r['nao_encontrados'])} não encontrados"))
+
+    def salvar(self):
+        if self.relatorio is None:
+            messagebox.showwarning("Atenção", "Confira a contagem antes de salvar o relatório", parent=self.win)
+            return
+        caminho = filedialog.asksaveasfilename(parent=self.win, title="Salvar relatório", initialfile="divergencias.csv",
+                                               defaultextension=".csv",
+                                               filetypes=[("CSV", "*.csv"), ("JSON Lines", "*.jsonl")])
+        if caminho:
+            total = gravar_divergencias(self.relatorio, caminho)
+            messagebox.showinfo("Relatório", f"{total} divergências gravadas em {caminho}", parent=self.win)
+
+
+# ----------------- Janela de Diagnóstico -----------------
+class DiagnosticoWindow:
+    def __init__(self, parent, instrumentacao: Instrumentacao):
+        self.instrumentacao = instrumentacao
+        self.win = tk.Toplevel(parent)
+        self.win.title("Diagnóstico do Banco")
+        Utils().centralizar(self.win, 1000, 550)
+
+        colunas = ("metodo", "chamadas", "stmts", "commits", "media", "max", "histograma")
+        titulos = ("Método", "Chamadas", "Stmts/chamada", "Commits/chamada", "Média ms", "Máx ms", "Histograma")
+        self.tree = ttk_native.Treeview(self.win, columns=colunas, show="headings", height=12)
+        for c, t in zip(colunas, titulos):
+            self.tree.heading(c, text=t)
+            self.tree.column(c, anchor="center", width=90)
+        self.tree.column("metodo", width=200, anchor="w")
+        self.tree.column("histograma", width=300, anchor="w")
+        self.tree.pack(fill="both", expand=True, padx=10, pady=5)
+
+        tk.Label(self.win, text=f"Operações lentas (>= {instrumentacao.limite_lento_ms:.0f} ms)").pack()
+        self.txt_lentas = tk.Text(self.win, height=10, wrap="none")
+        self.txt_lentas.pack(fill="both", expand=True, padx=10)
+
+        btns = tk.Frame(self.win)
+        btns.pack(pady=5)
+        tk.Button(btns, text="Atualizar", command=self.atualizar).pack(side="left", padx=5)
+        tk.Button(btns, text="Salvar JSON", command=self.salvar).pack(side="left", padx=5)
+        tk.Button(btns, text="Zerar", command=self.zerar).pack(side="left", padx=5)
+        self.atualizar()
+
+    def atualizar(self):
+        relatorio = self.instrumentacao.relatorio()
+        for i in self.tree.get_children():
+            self.tree.delete(i)
+        for nome, m in relatorio["metodos"].items():
+            histograma = " ".join(f"{faixa}:{n}" for faixa, n in m["histograma"].items() if n)
+            self.tree.insert("", "end", values=(nome, m["chamadas"], f"{m['statements_por_chamada']:.1f}",
+                                                f"{m['commits_por_chamada']:.1f}", f"{m['media_ms']:.2f}",
+                                                f"{m['max_ms']:.2f}", histograma))
+        self.txt_lentas.delete("1.0", tk.END)
+        for lenta in reversed(relatorio["lentas"]):
+            self.txt_lentas.insert(tk.END, f"[{lenta['quando']}] {lenta['metodo']}: {lenta['ms']:.1f} ms, "
+                                           f"{lenta['statements']} statements\n")
+            for p in lenta["planos"]:
+                self.txt_lentas.insert(tk.END, f"    {p['sql'][:200]}\n")
+                for linha in p["plano"]:
+                    self.txt_lentas.insert(tk.END, f"        {linha}\n")
+
+    def salvar(self):
+        caminho = filedialog.asksaveasfilename(parent=self.win, initialfile="diagnostico.json", defaultextension=".json",
+                                               filetypes=[("JSON", "*.json")])
+        if caminho:
+            self.instrumentacao.salvar_json(caminho)
+            messagebox.showinfo("Salvo", f"Diagnóstico salvo em {caminho}", parent=self.win)
+
+    def zerar(self):
+        self.instrumentacao.zerar()
+        self.atualizar()
 
 # ----------------- Execução -----------------
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sistema de Estoque e Vendas")
+    parser.add_argument("--db", default="estoque.db", help="caminho do banco SQLite")
+    parser.add_argument("--multi-terminal", action="store_true",
+                        help="modo para vários caixas no mesmo banco (WAL, busy_timeout e retentativas)")
+    parser.add_argument("--cache-max", type=int, default=None,
+                        help="limite de produtos no cache (LRU), para catálogos muito grandes")
+    parser.add_argument("--instrumentar", action="store_true",
+                        help="mede statements, commits e latência de cada operação (janela Diagnóstico)")
+    parser.add_argument("--limite-lento-ms", type=float, default=100.0,
+                        help="operações acima deste tempo vão para o log com o plano de execução")
+    parser.add_argument("--diagnostico-json", help="ao sair, grava as métricas da instrumentação neste arquivo")
+    parser.add_argument("--recibos", default="recibos", help="pasta do arquivo de recibos (um arquivo por dia)")
+    parser.add_argument("--fila-vendas", help="fila local de vendas (caixa offline): as vendas são gravadas "
+                                              "neste arquivo e sincronizadas com o banco em segundo plano")
+    sub = parser.add_subparsers(dest="comando")
+    p_imp = sub.add_parser("importar", help="importa produtos de um arquivo CSV/JSONL")
+    p_imp.add_argument("arquivo")
+    p_imp.add_argument("--lote", type=int, default=1000, help="produtos por transação")
+    p_exp = sub.add_parser("exportar", help="exporta uma tabela ou relatório (.csv, .jsonl, .csv.gz, .jsonl.gz, .col)")
+    p_exp.add_argument("tabela", choices=list(TABELAS_EXPORTAVEIS))
+    p_exp.add_argument("arquivo")
+    p_exp.add_argument("--de", help="início do período (AAAA-MM-DD), nas tabelas com data")
+    p_exp.add_argument("--ate", help="fim do período (AAAA-MM-DD), nas tabelas com data")
+    p_exp.add_argument("--lote", type=int, default=5000, help="linhas lidas e gravadas por vez")
+    sub.add_parser("reconstruir-resumos", help="recalcula os resumos de vendas por dia/produto")
+    sub.add_parser("retrato", help="grava um retrato do estoque atual")
+    p_arq = sub.add_parser("arquivar", help="move movimentações antigas para o banco de arquivo")
+    p_arq.add_argument("antes_de", help="data de corte (AAAA-MM-DD), exclusiva")
+    p_arq.add_argument("--vacuum", action="store_true", help="compacta o banco principal depois de arquivar")
+    p_em = sub.add_parser("estoque-em", help="estoque numa data passada")
+    p_em.add_argument("data", help="AAAA-MM-DD (fim do dia) ou AAAA-MM-DD HH:MM:SS")
+    p_em.add_argument("--produto", type=int)
+    sub.add_parser("sincronizar-vendas", help="envia ao banco as vendas pendentes da --fila-vendas")
+    p_rec = sub.add_parser("recibo", help="reimprime o recibo de uma venda")
+    p_rec.add_argument("venda_id", type=int)
+    sub.add_parser("conflitos-vendas", help="lista as vendas da --fila-vendas com conflito ou erro")
+    p_inv = sub.add_parser("inventario", help="confere uma contagem física (CSV/JSONL) com o estoque")
+    p_inv.add_argument("arquivo", help="colunas id ou codigo_barras, e contado")
+    p_inv.add_argument("--aplicar", action="store_true", help="grava as quantidades contadas (padrão: só confere)")
+    p_inv.add_argument("--relatorio", help="grava as divergências neste arquivo (CSV/JSONL)")
+    p_ana = sub.add_parser("analise", help="análises de vendas em JSON (curva ABC, velocidade, médias móveis, giro)")
+    p_ana.add_argument("tipo", choices=["abc", "velocidade", "medias-moveis", "giro"])
+    p_ana.add_argument("--de", help="início do período (AAAA-MM-DD)")
+    p_ana.add_argument("--ate", help="fim do período (AAAA-MM-DD), padrão hoje")
+    args = parser.parse_args()
+    inicio = time.perf_counter()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    instrumentacao = None
+    if args.instrumentar or args.diagnostico_json:
+        instrumentacao = Instrumentacao(limite_lento_ms=args.limite_lento_ms)
+        if args.diagnostico_json:
+            atexit.register(instrumentacao.salvar_json, args.diagnostico_json)
+
+    # na janela, a migração (se houver) roda depois que ela aparece; os comandos migram antes
+    estoque = GerenciadorEstoque(args.db, multi_terminal=args.multi_terminal, cache_max=args.cache_max,
+                                 instrumentacao=instrumentacao, migrar=args.comando is not None)
+
+    if args.comando == "importar":
+        resumo = estoque.importar_produtos(args.arquivo, tamanho_lote=args.lote,
+                                           ao_progresso=lambda r: print(f"{r['linhas']} linhas lidas...", end="\r"))
+        print(f"{resumo['inseridos']} inseridos, {resumo['atualizados']} atualizados, {len(resumo['erros'])} erros "
+              f"em {resumo['segundos']:.1f}s ({resumo['linhas_por_segundo']:.0f} linhas/s)")
+        for numero, erro in resumo["erros"]:
+            print(f"linha {numero}: {erro}")
+        sys.exit(0)
+    if args.comando == "exportar":
+        inicio = time.perf_counter()
+        total = estoque.exportar_tabela(args.tabela, args.arquivo, tamanho_lote=args.lote, data_inicio=args.de,
+                                        data_fim=args.ate, ao_progresso=lambda n: print(f"{n} linhas...", end="\r"))
+        print(f"{total} linhas exportadas para {args.arquivo} em {time.perf_counter() - inicio:.1f}s "
+              f"({os.path.getsize(args.arquivo) / 1e6:.1f} MB)")
+        sys.exit(0)
+    if args.comando == "reconstruir-resumos":
+        print(f"resumos reconstruídos: {estoque.reconstruir_resumos()} dias")
+        sys.exit(0)
+    if args.comando == "retrato":
+        print(f"retrato {estoque.criar_retrato()} gravado")
+        sys.exit(0)
+    if args.comando == "arquivar":
+        resumo = estoque.arquivar_movimentacoes(args.antes_de, vacuum=args.vacuum)
+        print(f"{resumo['movimentacoes']} movimentações e {resumo['retratos']} retratos movidos para {estoque.caminho_arquivo}")
+        sys.exit(0)
+    if args.comando in ("sincronizar-vendas", "conflitos-vendas"):
+        if not args.fila_vendas:
+            parser.error(f"{args.comando} precisa de --fila-vendas")
+        fila = FilaVendas(args.fila_vendas)
+        if args.comando == "sincronizar-vendas":
+            resumo = SincronizadorVendas(estoque, fila).sincronizar()
+            print(f"{resumo['sincronizadas']} sincronizadas, {len(resumo['conflitos'])} com conflito, "
+                  f"{len(resumo['erros'])} com erro, {resumo['pendentes']} pendentes")
+        for venda in fila.conflitos():
+            print(f"{venda['data']}\t{venda['chave']}\t{venda['status']}\tvenda {venda['venda_id']}\t{venda['detalhe']}")
+        sys.exit(0)
+    if args.comando == "recibo":
+        print(ArquivoRecibos(args.recibos).obter(estoque, args.venda_id))
+        sys.exit(0)
+    if args.comando == "inventario":
+        contagens, erros = ler_contagens(args.arquivo)
+        for numero, erro in erros:
+            print(f"linha {numero}: {erro}")
+        r = estoque.conciliar_inventario(contagens, aplicar=args.aplicar)
+        for d in r["divergencias"]:
+            print(f"{d['produto_id']}\t{d['nome']}\t{d['sistema']} -> {d['contado']}\t{d['diferenca']:+d}\t"
+                  f"{formatar_moeda(d['valor_centavos'])}")
+        for identificador in r["nao_encontrados"]:
+            print(f"não encontrado: {identificador}")
+        print(f"{'aplicado' if r['aplicado'] else 'conferência (nada gravado)'}: {r['conferidos']} produtos, "
+              f"{r['iguais']} iguais, {len(r['divergencias'])} divergentes, sobras {r['sobras']} un "
+              f"({formatar_moeda(r['valor_sobras_centavos'])}), faltas {r['faltas']} un "
+              f"({formatar_moeda(r['valor_faltas_centavos'])}) em {r['segundos']:.2f}s")
+        if args.relatorio:
+            gravar_divergencias(r, args.relatorio)
+        sys.exit(0)
+    if args.comando == "analise":
+        analise = AnaliseVendas(estoque)
+        metodo = {"abc": analise.curva_abc, "velocidade": analise.velocidade,
+                  "medias-moveis": analise.medias_moveis, "giro": analise.giro}[args.tipo]
+        print(json.dumps(metodo(args.de, args.ate), ensure_ascii=False, indent=1))
+        sys.exit(0)
+    if args.comando == "estoque-em":
+        try:
+            resultado = estoque.estoque_em(args.data, args.produto)
+        except EstoqueDesconhecido as e:
+            print(e)
+            sys.exit(1)
+        if args.produto is not None:
+            print(resultado)
+        else:
+            for produto_id, quantidade in sorted(resultado.items()):
+                print(f"{produto_id}\t{quantidade}")
+        sys.exit(0)
+
     root = ttk.Window(themename="darkly")
-    app = App(root)
+    app = App(root, estoque, FilaVendas(args.fila_vendas) if args.fila_vendas else None, ArquivoRecibos(args.recibos),
+              inicio=inicio)
     Utils().centralizar(root, 1000, 600)
     root.mainloop()
@@ -0,0 +1,277 @@
+import argparse
+import asyncio
+import json
+import logging
+import re
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from http import HTTPStatus
+from urllib.parse import parse_qs, unquote, urlsplit
+
+from main import GerenciadorEstoque, Instrumentacao, centavos, validar_contagem
+
+log = logging.getLogger("estoque.servidor")
+
+
+class ErroHttp(Exception):
+    def __init__(self, status, mensagem):
+        super().__init__(mensagem)
+        self.status = status
+
+
+# ----------------- Servidor HTTP/JSON -----------------
+class ServidorEstoque:
+    # expõe o GerenciadorEstoque como API JSON para vários caixas/clientes.
+    # Escritas (vendas, cadastros, ajustes) passam por uma única thread, em ordem;
+    # leituras rodam num pool separado, cada thread com a sua conexão (WAL)
+    def __init__(self, estoque, leitores=4, lote_max=200, espera_lote_ms=5):
+        self.estoque = estoque
+        self.escritor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="escritor")
+        self.leitores = ThreadPoolExecutor(max_workers=leitores, thread_name_prefix="leitor")
+        self.lote_max = lote_max
+        self.espera_lote = espera_lote_ms / 1000
+        self._ajustes = None
+        self._tarefa_lote = None
+        self.rotas = [
+            ("GET", r"/saude", self.saude),
+            ("GET", r"/produtos", self.listar_produtos),
+            ("POST", r"/produtos", self.cadastrar_produto),
+            ("GET", r"/produtos/(\d+)", self.obter_produto),
+            ("GET", r"/produtos/codigo/([^/]+)", self.obter_produto_por_codigo),
+            ("POST", r"/produtos/(\d+)/estoque", self.ajustar_estoque),
+            ("POST", r"/estoque/inventario", self.conciliar_inventario),
+            ("GET", r"/vendas", self.listar_vendas),
+            ("POST", r"/vendas", self.registrar_venda),
+            ("GET", r"/vendas/(\d+)/itens", self.itens_venda),
+            ("GET", r"/movimentacoes", self.movimentacoes),
+            ("GET", r"/relatorios/estoque", self.relatorio_estoque),
+            ("GET", r"/relatorios/vendas-por-dia", self.vendas_por_dia),
+            ("GET", r"/relatorios/vendas-por-produto", self.vendas_por_produto),
+            ("GET", r"/relatorios/vendas-por-categoria", self.vendas_por_categoria),
+            ("GET", r"/relatorios/abaixo-minimo", self.abaixo_minimo),
+            ("GET", r"/relatorios/sugestoes-compra", self.sugestoes_compra),
+        ]
+
+    async def _ler(self, func, *args, **kwargs):
+        return await asyncio.get_running_loop().run_in_executor(self.leitores, partial(func, *args, **kwargs))
+
+    async def _escrever(self, func, *args, **kwargs):
+        return await asyncio.get_running_loop().run_in_executor(self.escritor, partial(func, *args, **kwargs))
+
+    # ----------------- Ciclo de vida -----------------
+    async def iniciar(self, host="127.0.0.1", porta=8080):
+        self._ajustes = asyncio.Queue()
+        self._tarefa_lote = asyncio.create_task(self._processar_ajustes())
+        self.server = await asyncio.start_server(self._atender, host, porta)
+        return self.server.sockets[0].getsockname()
+
+    async def parar(self):
+        self.server.close()
+        await self.server.wait_closed()
+        self._tarefa_lote.cancel()
+        self.escritor.shutdown(wait=True)
+        self.leitores.shutdown(wait=True)
+        self.estoque.fechar()
+
+    # ----------------- Protocolo -----------------
+    async def _atender(self, reader, writer):
+        try:
+            while True:
+                linha = await reader.readline()
+                if not linha:
+                    break
+                metodo, alvo, versao = linha.decode("latin-1").split()
+                cabecalhos = {}
+                while True:
+                    h = await reader.readline()
+                    if h in (b"\r\n", b"\n", b""):
+                        break
+                    nome, _, valor = h.decode("latin-1").partition(":")
+                    cabecalhos[nome.strip().lower()] = valor.strip()
+                tamanho = int(cabecalhos.get("content-length", 0))
+                corpo = await reader.readexactly(tamanho) if tamanho else b""
+
+                status, resposta = await self._despachar(metodo, alvo, corpo)
+                dados = json.dumps(resposta, ensure_ascii=False).encode("utf-8")
+                manter = versao == "HTTP/1.1" and cabecalhos.get("connection", "").lower() != "close"
+                writer.write(
+                    f"HTTP/1.1 {status.value} {status.phrase}\r\n"
+                    f"Content-Type: application/json; charset=utf-8\r\n"
+                    f"Content-Length: {len(dados)}\r\n"
+                    f"Connection: {'keep-alive' if manter else 'close'}\r\n\r\n".encode("latin-1") + dados)
+                await writer.drain()
+                if not manter:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionResetError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def _despachar(self, metodo, alvo, corpo):
+        url = urlsplit(alvo)
+        params = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        caminho_existe = False
+        for m, padrao, handler in self.rotas:
+            achou = re.fullmatch(padrao, url.path)
+            if not achou:
+                continue
+            caminho_existe = True
+            if m != metodo:
+                continue
+            try:
+                dados = json.loads(corpo) if corpo else {}
+                return HTTPStatus.OK, await handler(params, dados, *achou.groups())
+            except ErroHttp as e:
+                return e.status, {"erro": str(e)}
+            except (ValueError, KeyError, TypeError) as e:
+                return HTTPStatus.BAD_REQUEST, {"erro": str(e)}
+            except Exception as e:
+                log.exception("erro em %s %s", metodo, alvo)
+                return HTTPStatus.INTERNAL_SERVER_ERROR, {"erro": str(e)}
+        if caminho_existe:
+            return HTTPStatus.METHOD_NOT_ALLOWED, {"erro": "método não permitido"}
+        return HTTPStatus.NOT_FOUND, {"erro": "rota não encontrada"}
+
+    # ----------------- Ajustes de estoque em lote -----------------
+    # ajustes que chegam quase juntos são gravados numa só transação (um commit para o lote)
+    async def _processar_ajustes(self):
+        while True:
+            lote = [await self._ajustes.get()]
+            prazo = asyncio.get_running_loop().time() + self.espera_lote
+            while len(lote) < self.lote_max:
+                restante = prazo - asyncio.get_running_loop().time()
+                if restante <= 0:
+                    break
+                try:
+                    lote.append(await asyncio.wait_for(self._ajustes.get(), restante))
+                except asyncio.TimeoutError:
+                    break
+            try:
+                resultados = await self._escrever(self.estoque.aplicar_ajustes, [a for a, _ in lote])
+            except Exception as e:
+                for _, futuro in lote:
+                    futuro.set_exception(e)
+                continue
+            for (_, futuro), ok in zip(lote, resultados):
+                futuro.set_result(ok)
+
+    # ----------------- Rotas -----------------
+    async def saude(self, params, dados):
+        return {"ok": True, "versao_schema": await self._ler(self.estoque.versao_schema)}
+
+    async def listar_produtos(self, params, dados):
+        if params.get("q"):
+            return await self._ler(self.estoque.buscar_produtos, params["q"], int(params.get("limite", 50)))
+        produtos = await self._ler(self.estoque.listar_produtos)
+        offset = int(params.get("offset", 0))
+        limite = int(params["limite"]) if "limite" in params else None
+        return produtos[offset:None if limite is None else offset + limite]
+
+    async def obter_produto(self, params, dados, produto_id):
+        produto = await self._ler(self.estoque.obter_produto, int(produto_id))
+        if produto is None:
+            raise ErroHttp(HTTPStatus.NOT_FOUND, "produto não encontrado")
+        return produto
+
+    async def obter_produto_por_codigo(self, params, dados, codigo):
+        produto = await self._ler(self.estoque.obter_produto_por_codigo, unquote(codigo))
+        if produto is None:
+            raise ErroHttp(HTTPStatus.NOT_FOUND, "código não cadastrado")
+        return produto
+
+    async def cadastrar_produto(self, params, dados):
+        if not await self._escrever(self.estoque.cadastrar_produto, dados):
+            raise ErroHttp(HTTPStatus.CONFLICT, "não foi possível cadastrar o produto")
+        return {"ok": True}
+
+    async def ajustar_estoque(self, params, dados, produto_id):
+        # valida aqui: um ajuste inválido não pode derrubar o lote dos outros clientes
+        tipo, qtd = dados["tipo"], int(dados["quantidade"])
+        if tipo not in ("add", "remove", "set") or qtd < 0 or (qtd == 0 and tipo != "set"):
+            raise ValueError("ajuste inválido: tipo deve ser add/remove/set e quantidade positiva")
+        futuro = asyncio.get_running_loop().create_future()
+        await self._ajustes.put(((int(produto_id), tipo, qtd), futuro))
+        if not await futuro:
+            raise ErroHttp(HTTPStatus.CONFLICT, "produto não encontrado ou estoque insuficiente")
+        return await self._ler(self.estoque.obter_produto, int(produto_id))
+
+    # contagem física inteira numa requisição: {"contagens": [{id|codigo_barras, contado}], "aplicar": bool}
+    async def conciliar_inventario(self, params, dados):
+        contagens = [validar_contagem(c) for c in dados["contagens"]]
+        return await self._escrever(self.estoque.conciliar_inventario, contagens, aplicar=bool(dados.get("aplicar")))
+
+    async def registrar_venda(self, params, dados):
+        # "chave" opcional: o caixa pode reenviar a mesma venda sem duplicá-la.
+        # valores em centavos; desconto_total (reais) segue aceito para clientes antigos
+        desconto = dados.get("desconto_total_centavos")
+        if desconto is None:
+            desconto = centavos(dados.get("desconto_total") or 0)
+        venda_id, total = await self._escrever(self.estoque.registrar_venda, dados["itens"],
+                                               int(desconto), chave=dados.get("chave"))
+        return {"venda_id": venda_id, "total_centavos": total}
+
+    async def listar_vendas(self, params, dados):
+        return await self._ler(lambda: list(self.estoque.relatorio_vendas(
+            params.get("data_inicio"), params.get("data_fim"),
+            limite=int(params.get("limite", 100)), offset=int(params.get("offset", 0)),
+            com_itens=params.get("com_itens", "0") == "1")))
+
+    async def itens_venda(self, params, dados, venda_id):
+        return await self._ler(self.estoque.itens_venda, int(venda_id))
+
+    async def movimentacoes(self, params, dados):
+        apos = (params["apos_data"], int(params["apos_id"])) if "apos_data" in params and "apos_id" in params else None
+        return await self._ler(self.estoque.historico_movimentacoes,
+                               produto_id=int(params["produto_id"]) if "produto_id" in params else None,
+                               tipo=params.get("tipo"), data_inicio=params.get("data_inicio"),
+                               data_fim=params.get("data_fim"), apos=apos, limite=int(params.get("limite", 500)))
+
+    async def relatorio_estoque(self, params, dados):
+        return await self._ler(self.estoque.relatorio_estoque)
+
+    async def vendas_por_dia(self, params, dados):
+        return await self._ler(self.estoque.vendas_por_dia, params.get("data_inicio"), params.get("data_fim"))
+
+    async def vendas_por_produto(self, params, dados):
+        return await self._ler(self.estoque.vendas_por_produto, params.get("data_inicio"), params.get("data_fim"),
+                               int(params["limite"]) if "limite" in params else None)
+
+    async def vendas_por_categoria(self, params, dados):
+        return await self._ler(self.estoque.vendas_por_categoria, params.get("data_inicio"), params.get("data_fim"))
+
+    async def abaixo_minimo(self, params, dados):
+        return await self._ler(self.estoque.produtos_abaixo_minimo)
+
+    async def sugestoes_compra(self, params, dados):
+        return await self._ler(self.estoque.sugestoes_compra, int(params.get("dias_venda", 30)),
+                               int(params.get("cobertura_dias", 15)))
+
+
+async def servir(args):
+    instrumentacao = Instrumentacao(args.limite_lento_ms) if args.instrumentar else None
+    estoque = GerenciadorEstoque(args.db, multi_terminal=True, cache_max=args.cache_max, instrumentacao=instrumentacao)
+    servidor = ServidorEstoque(estoque, leitores=args.leitores)
+    host, porta = (await servidor.iniciar(args.host, args.porta))[:2]
+    log.info("servindo %s em http://%s:%s", args.db, host, porta)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await servidor.parar()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="API JSON do Sistema de Estoque e Vendas (sem interface gráfica)")
+    parser.add_argument("--db", default="estoque.db", help="caminho do banco SQLite")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--porta", type=int, default=8080)
+    parser.add_argument("--leitores", type=int, default=4, help="threads de leitura")
+    parser.add_argument("--cache-max", type=int, default=None)
+    parser.add_argument("--instrumentar", action="store_true")
+    parser.add_argument("--limite-lento-ms", type=float, default=100.0)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    try:
+        asyncio.run(servir(args))
+    except KeyboardInterrupt:
+        pass